@@ -1,51 +1,109 @@
 from flask import Flask, request, render_template, jsonify 
-from pymongo import MongoClient
 from data.config import Config
-from data.database import MongoDBConnection
+from data.database import MongoDBConnection, Catalogue, get_client, pool_metrics
 from service.recommendations import RecommendationService  # Adjust import based on your project structure
+from service.cache import ResultCache, model_version
+from model.scorer import load_scorer
+from model.retrieval import RetrievalPredictor, build_index
+from model.encoder import load_encoder
 
-app = Flask(__name__, template_folder='ui/templates', static_folder='ui/static')
-
-connection = MongoDBConnection(host=Config.MONGO_HOST, 
-                       port=Config.MONGO_PORT, 
-                       db_name=Config.MONGO_DB_NAME)
-connection.connect()
-db = connection.db
-
-
-@app.route('/recommend', methods=['POST'])
-def recommend():
-    user_id = request.form.get('userId')
-    context = [
-        {'type': 'daytime', 'value': request.form.get('daytime')},
-        {'type': 'weekday', 'value': request.form.get('weekday')},
-        {'type': 'isweekend', 'value': request.form.get('isweekend')},
-        {'type': 'homework', 'value': request.form.get('homework')},
-        # {'type': 'cost', 'value': request.form.get('cost')},
-        {'type': 'weather', 'value': request.form.get('weather')},
-        {'type': 'country', 'value': request.form.get('country')},
-        {'type': 'city', 'value': int(request.form.get('city'))}
-    ]
-    rs = RecommendationService(db)
-
-    recommendations = rs.get_recommendations(user_id, context)
-    return render_template('recommend.html', items = recommendations)
-
-
-@app.route('/', methods=['GET'])
-def index():
-
-    context_fields = ['daytime', 'weekday', 'isweekend', 'homework', 'cost', 'weather', 'country', 'city']
-    context_data = {}
-    for field in context_fields:
-        context_data[field] = []
-        field_data = list(db[field].find())
-        for data in field_data:
-            # print(data)
-            context_data[field].append(data.get(field))
-        # context_data[field] = list(db[field].find())
-    return render_template('index.html', data=context_data)
 
+def load_predictor(config=Config):
+    encoder = load_encoder(config.ENCODER_FILE, config.RAW_DATA_FILE)
+    if config.MODEL_BACKEND == 'tensorflow':
+        # only import TensorFlow when the session backend is requested
+        from model.IFM import SessionPredictor
+        predictor = SessionPredictor(config.PRETRAIN_PATH, encoder)
+    elif config.MODEL_BACKEND == 'frozen':
+        from model.freeze import FrozenPredictor
+        predictor = FrozenPredictor(config.FROZEN_FILE, encoder)
+    else:
+        predictor = load_scorer(config.WEIGHTS_FILE, encoder)
 
+    if config.RETRIEVAL_WEIGHTS_FILE:
+        # the FM index retrieves candidates, the model above only re-ranks them
+        fm = load_scorer(config.RETRIEVAL_WEIGHTS_FILE, encoder)
+        index = build_index(fm, encoder.candidates('item'), config.RETRIEVAL_INDEX)
+        predictor = RetrievalPredictor(fm, index, predictor, config.RETRIEVAL_CANDIDATES, config.RETRIEVAL_OBJECTIVE)
+    return predictor
+
+def model_paths(config=Config):  # the files load_predictor serves
+    model_files = {'tensorflow': config.PRETRAIN_PATH, 'frozen': config.FROZEN_FILE}
+    paths = [model_files.get(config.MODEL_BACKEND, config.WEIGHTS_FILE)]
+    if config.RETRIEVAL_WEIGHTS_FILE:
+        paths.append(config.RETRIEVAL_WEIGHTS_FILE)
+    return paths
+
+def load_cache(version, config=Config):
+    '''ResultCache of the rankings of the predictor loaded from the model files of `version`'''
+    if not config.CACHE_ENABLED:
+        return None
+    return ResultCache(config.CACHE_SIZE, config.CACHE_TTL, version, config.CACHE_FILE)
+
+def create_app(config=Config):
+    '''Flask application with one shared MongoClient, predictor and RecommendationService per process'''
+    app = Flask(__name__, template_folder='ui/templates', static_folder='ui/static')
+
+    connection = MongoDBConnection(db_name=config.MONGO_DB_NAME, client=get_client(config))
+    connection.connect(config.RAW_DATA_FILE, config.META_DATA_FILE, config.LOAD_CHUNK_SIZE)
+    db = connection.db
+
+    # load the model once per process, every request reuses the same service; the cached rankings
+    # are tagged with the signature of the files taken before loading them, a newer model is only
+    # served, and cached, after a restart
+    version = model_version(model_paths(config))
+    predictor = load_predictor(config)
+    cache = load_cache(version, config)
+    # item documents and context values, refreshed by the data loading functions
+    catalogue = Catalogue(db)
+    service = RecommendationService(db, predictor, cache, catalogue)
+    app.extensions['recommendation_service'] = service
+
+    @app.route('/recommend', methods=['POST'])
+    def recommend():
+        user_id = request.form.get('userId')
+        context = [
+            {'type': 'daytime', 'value': request.form.get('daytime')},
+            {'type': 'weekday', 'value': request.form.get('weekday')},
+            {'type': 'isweekend', 'value': request.form.get('isweekend')},
+            {'type': 'homework', 'value': request.form.get('homework')},
+            # {'type': 'cost', 'value': request.form.get('cost')},
+            {'type': 'weather', 'value': request.form.get('weather')},
+            {'type': 'country', 'value': request.form.get('country')},
+            {'type': 'city', 'value': int(request.form.get('city'))}
+        ]
+        recommendations = service.get_recommendations(user_id, context)
+        return render_template('recommend.html', items = recommendations)
+
+    @app.route('/recommend/batch', methods=['POST'])
+    def recommend_batch():
+        # {"k": 3, "requests": [{"userId": 1, "context": {"daytime": "morning", ...}, "exclude": [...]}, ...]}
+        # a malformed body is rejected, an invalid entry only gets {"error": ...} in its slot
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict) or not isinstance(payload.get('requests'), list):
+            return jsonify({'error': 'Expected a JSON object with a "requests" list'}), 400
+        k = payload.get('k', 3)
+        if isinstance(k, bool) or not isinstance(k, int) or k <= 0:
+            return jsonify({'error': 'k must be a positive integer'}), 400
+        recommendations = service.get_recommendations_batch(payload['requests'], k)
+        return jsonify({'recommendations': recommendations})
+
+    @app.route('/cache/stats', methods=['GET'])
+    def cache_stats():
+        return jsonify(cache.stats() if cache is not None else {})
+
+    @app.route('/pool/stats', methods=['GET'])
+    def pool_stats():
+        # MongoDB connection pool of this worker process
+        return jsonify(pool_metrics.snapshot())
+
+    @app.route('/', methods=['GET'])
+    def index():
+        return render_template('index.html', data=catalogue.context_values())
+
+    return app
+
+
+# nothing is built on import: `flask run` and `gunicorn 'app:create_app()'` call the factory once per process
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,75 @@
+'''
+Throughput of per-request top_k against the batched top_k_batch (model only, no MongoDB)
+
+usage (from src/):
+python -m benchmark.batch_recommend --weights ../pretrain/fm_frappe_256/frappe_256.npz --encoder ../data/frappe/frappe.encoder.json
+python -m benchmark.batch_recommend      # random IFM weights with the frappe shape
+'''
+import argparse
+import numpy as np
+from time import time
+from model.encoder import FeatureEncoder, FIELDS
+from model.scorer import NumpyIFM, load_scorer
+
+#################### Arguments ####################
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark batched recommendation.")
+    parser.add_argument('--weights', nargs='?', default=None,
+                        help='Weights exported by model/export.py. Random IFM weights when omitted.')
+    parser.add_argument('--encoder', nargs='?', default='../data/frappe/frappe.encoder.json',
+                        help='Feature encoder matching the weights.')
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='Number of user/context requests.')
+    parser.add_argument('--k', type=int, default=10,
+                        help='Items per request.')
+    parser.add_argument('--hidden_factor', nargs='?', default='[8,256]',
+                        help='Factors of the random model: [attention factors, embedding factors].')
+    return parser.parse_args()
+
+def synthetic_predictor(hidden_factor, kf=16):
+    # frappe sized vocabulary: 957 users, 4082 items, a handful of values per context field
+    sizes = {'user': 957, 'item': 4082, 'daytime': 7, 'weekday': 7, 'isweekend': 2, 'homework': 3,
+             'weather': 9, 'country': 80, 'city': 233}
+    vocabulary, offset = {}, 0
+    for field in FIELDS:
+        vocabulary[field] = {str(i): offset + i for i in range(sizes[field])}
+        offset += sizes[field]
+    encoder = FeatureEncoder(FIELDS, vocabulary)
+
+    rng = np.random.RandomState(2016)
+    AK, K = hidden_factor
+    weights = {'feature_embeddings': rng.normal(0, 0.01, (offset, K)), 'feature_bias': rng.normal(0, 0.1, offset),
+               'bias': 0.0, 'attention_W': rng.normal(0, 0.1, (K, AK)), 'attention_b': rng.normal(0, 0.1, (1, AK)),
+               'attention_p': rng.normal(0, 1, AK), 'interaction': rng.normal(0, 1, (len(FIELDS), kf)),
+               'factor': rng.normal(0, 1, (kf, K)), 'temp': 1.0}
+    weights = {name: np.asarray(value, dtype=np.float32) for name, value in weights.items()}
+    return NumpyIFM(weights, encoder)
+
+def random_requests(encoder, num_requests):
+    rng = np.random.RandomState(0)
+    values = dict((field, list(encoder.vocabulary[field].keys())) for field in encoder.fields)
+    users = [values['user'][i] for i in rng.randint(len(values['user']), size=num_requests)]
+    contexts = [[values[field][rng.randint(len(values[field]))] for field in encoder.fields[2:]] for i in range(num_requests)]
+    return users, contexts
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.weights:
+        predictor = load_scorer(args.weights, FeatureEncoder.load(args.encoder))
+    else:
+        predictor = synthetic_predictor(eval(args.hidden_factor))
+    users, contexts = random_requests(predictor.encoder, args.requests)
+    print("%s: items=%d, requests=%d, k=%d" % (type(predictor).__name__, len(predictor.item_ids), args.requests, args.k))
+
+    t = time()
+    single = [predictor.top_k(user, context, args.k) for user, context in zip(users, contexts)]
+    elapsed = time() - t
+    print("top_k per request:  %.1f requests/s [%.1f s]" % (len(users) / elapsed, elapsed))
+
+    t = time()
+    batch = predictor.top_k_batch(users, contexts, args.k)
+    elapsed = time() - t
+    print("top_k_batch:        %.1f requests/s [%.1f s]" % (len(users) / elapsed, elapsed))
+
+    same = np.mean([np.array_equal(a, b) for a, b in zip(single, batch)])
+    print("identical rankings: %.1f%%" % (100 * same))
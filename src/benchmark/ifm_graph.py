@@ -0,0 +1,94 @@
+'''
+Size and speed of the IFM graph with the gathered field-pair products of AFM.pairwise_interactions
+against the former slice-and-multiply double loop, and the largest difference of out_afm between both
+
+graph build: constructing the AFM (graph, session, variable initialization)
+import: tf.train.import_meta_graph of the exported .meta into an empty graph
+step: one training batch (partial_fit), after a warm-up
+
+usage (from src/):
+python -m benchmark.ifm_graph --valid_dimen 10 --batch_size 4096
+'''
+import argparse
+import os
+import shutil
+import tempfile
+import numpy as np
+import tensorflow as tf
+from time import time
+from model.IFM import AFM
+
+#################### Arguments ####################
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the IFM pair interaction kernel.")
+    parser.add_argument('--features_M', type=int, default=5382,
+                        help='Number of features (frappe: 5382).')
+    parser.add_argument('--valid_dimen', type=int, default=10,
+                        help='Number of fields.')
+    parser.add_argument('--hidden_factor', nargs='?', default='[8,256]',
+                        help='Attention factors and hidden factors.')
+    parser.add_argument('--kf', type=int, default=16,
+                        help='k_f.')
+    parser.add_argument('--batch_size', type=int, default=4096,
+                        help='Batch size of the training steps.')
+    parser.add_argument('--steps', type=int, default=20,
+                        help='Timed training steps.')
+    return parser.parse_args()
+
+
+class LoopedAFM(AFM):
+    '''AFM with the pair products built by the former double loop over the fields'''
+
+    def pairwise_interactions(self, nonzero_embeddings, interaction):
+        element_wise_product_list = []
+        interactions = []
+        for i in range(0, self.valid_dimension):
+            for j in range(i+1, self.valid_dimension):
+                element_wise_product_list.append(tf.multiply(nonzero_embeddings[:,i,:], nonzero_embeddings[:,j,:]))
+                interactions.append(tf.multiply(interaction[i,:], interaction[j,:]))
+        element_wise_product = tf.stack(element_wise_product_list) # (M'*(M'-1)) * None * K
+        element_wise_product = tf.transpose(element_wise_product, perm=[1,0,2], name="element_wise_product") # None * (M'*(M'-1)) * K
+        return element_wise_product, tf.stack(interactions)
+
+
+def build(model_class, args, save_file):
+    # same seeds, so both graphs get the same initial weights
+    np.random.seed(2016)
+    t = time()
+    model = model_class(args.features_M, 0, save_file, 1, eval(args.hidden_factor), args.valid_dimen, tf.nn.relu, args.valid_dimen,
+                        0, 1, args.batch_size, 0.01, 0.0, 0.0, args.kf, 1.0, [1.0, 0.5], 'AdagradOptimizer', 0, 0.999, 0, 0)
+    return model, time() - t
+
+def measure(model, batch, meta_file, steps):
+    with model.graph.as_default():
+        tf.train.export_meta_graph(meta_file)
+    size = os.path.getsize(meta_file)
+    t = time()
+    with tf.Graph().as_default():
+        tf.train.import_meta_graph(meta_file)
+    import_time = time() - t
+    model.partial_fit(batch)  # warm-up
+    t = time()
+    for _ in range(steps):
+        model.partial_fit(batch)
+    return size, import_time, (time() - t) / steps
+
+if __name__ == '__main__':
+    args = parse_args()
+    rng = np.random.RandomState(0)
+    batch = {'X': rng.randint(0, args.features_M, (args.batch_size, args.valid_dimen)).astype(np.int32),
+             'Y': rng.uniform(-1, 1, (args.batch_size, 1)).astype(np.float32)}
+    directory = tempfile.mkdtemp()
+    try:
+        outputs = {}
+        print("%-10s %10s %10s %10s %10s" % ('kernel', 'build [s]', 'meta [KB]', 'import [s]', 'step [ms]'))
+        for name, model_class in [('loop', LoopedAFM), ('gather', AFM)]:
+            model, build_time = build(model_class, args, os.path.join(directory, name, name))
+            # predictions of the initial weights, before any step changes them
+            outputs[name] = model.predict_chunk(batch['X'])
+            size, import_time, step_time = measure(model, batch, os.path.join(directory, name + '.meta'), args.steps)
+            print("%-10s %10.2f %10.1f %10.3f %10.1f" % (name, build_time, size / 1024.0, import_time, step_time * 1000))
+            model.sess.close()
+        print("max |out_afm(loop) - out_afm(gather)| = %.3g" % np.max(np.abs(outputs['loop'] - outputs['gather'])))
+    finally:
+        shutil.rmtree(directory)
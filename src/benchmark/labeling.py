@@ -0,0 +1,67 @@
+'''
+Runtime of the row-wise labeling (DataFrame.apply per row) against preprocessing/labeling.py
+
+usage (from src/):
+python -m benchmark.labeling --csv ../data/raw/frappe_dataset.csv
+python -m benchmark.labeling --rows 9620300      # synthetic log, 100x frappe
+'''
+import argparse
+import numpy as np
+import pandas as pd
+from time import time
+from sklearn.preprocessing import MinMaxScaler
+from preprocessing.labeling import label, CONTEXT_COLUMNS
+
+#################### Arguments ####################
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the labeling stage.")
+    parser.add_argument('--csv', nargs='?', default=None,
+                        help='Raw interaction log. A synthetic frappe-like log when omitted.')
+    parser.add_argument('--rows', type=int, default=962030,
+                        help='Rows of the synthetic log (frappe has 96203).')
+    parser.add_argument('--max_rowwise', type=int, default=200000,
+                        help='Rows timed with the row-wise version, extrapolated linearly beyond.')
+    return parser.parse_args()
+
+def synthetic_log(num_rows, random_seed=2016):
+    # frappe cardinalities, skewed usage counts
+    rng = np.random.RandomState(random_seed)
+    sizes = {'user': 957 * max(1, num_rows // 96203), 'item': 4082, 'daytime': 7, 'weekday': 7, 'isweekend': 2,
+             'homework': 3, 'cost': 2, 'weather': 9, 'country': 80, 'city': 233}
+    data = pd.DataFrame(dict((column, rng.randint(size, size=num_rows)) for column, size in sizes.items()))
+    data['cnt'] = rng.zipf(2.0, size=num_rows).clip(max=10000)
+    return data
+
+def calculate_user_rate(row):
+    if row['cnt'] == 1 and row['context_total_cnt'] == 1:
+        return 50
+    return (row['cnt'] / row['context_total_cnt']) * 100
+
+def rowwise_label(data):  # the previous implementation
+    data['context_total_cnt'] = data.groupby(CONTEXT_COLUMNS)['cnt'].transform('sum')
+    data['user_rate'] = data.apply(calculate_user_rate, axis=1)
+    scaler = MinMaxScaler(feature_range=(-1, 1))
+    data['user_rate'] = scaler.fit_transform(data['user_rate'].values.reshape(-1, 1))
+    return data
+
+if __name__ == '__main__':
+    args = parse_args()
+    data = pd.read_csv(args.csv, sep="\t") if args.csv else synthetic_log(args.rows)
+    print("rows=%d" % len(data))
+
+    t = time()
+    new = label(data.copy())
+    new_time = time() - t
+    print("column operations: %.2f s [%.0f rows/s]" % (new_time, len(data) / new_time))
+
+    sample = data.iloc[:args.max_rowwise].copy()
+    t = time()
+    old = rowwise_label(sample)
+    old_time = (time() - t) * len(data) / float(len(sample))
+    print("row-wise apply:    %.2f s [%.0f rows/s]%s" % (old_time, len(data) / old_time,
+                                                         ' (extrapolated from %d rows)' % len(sample) if len(sample) < len(data) else ''))
+    print("speedup: %.1fx" % (old_time / new_time))
+
+    # same labels on the timed rows
+    check = label(data.iloc[:len(sample)].copy())
+    print("max label difference: %.2e" % np.max(np.abs(check['user_rate'].values - old['user_rate'].values)))
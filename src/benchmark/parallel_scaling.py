@@ -0,0 +1,61 @@
+'''
+Training throughput of the IFM against the number of cores: samples per second of partial_fit with
+the session thread pools limited to n cores, with one tower and with n data-parallel towers
+
+usage (from src/):
+python -m benchmark.parallel_scaling --cores [1,2,4,8,16,32] --batch_size 4096
+'''
+import argparse
+import shutil
+import tempfile
+import numpy as np
+import tensorflow as tf
+from time import time
+from model.IFM import AFM
+
+#################### Arguments ####################
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark multi-core IFM training.")
+    parser.add_argument('--cores', nargs='?', default='[1,2,4,8,16,32]',
+                        help='Thread pool sizes to measure.')
+    parser.add_argument('--features_M', type=int, default=5382,
+                        help='Number of features (frappe: 5382).')
+    parser.add_argument('--valid_dimen', type=int, default=10,
+                        help='Number of fields.')
+    parser.add_argument('--hidden_factor', nargs='?', default='[8,256]',
+                        help='Attention factors and hidden factors.')
+    parser.add_argument('--batch_size', type=int, default=4096,
+                        help='Batch size of the training steps.')
+    parser.add_argument('--steps', type=int, default=20,
+                        help='Timed training steps per configuration.')
+    return parser.parse_args()
+
+def throughput(args, batch, save_file, cores, towers):
+    np.random.seed(2016)
+    model = AFM(args.features_M, 0, save_file, 1, eval(args.hidden_factor), args.valid_dimen, tf.nn.relu, args.valid_dimen,
+                0, 1, args.batch_size, 0.01, 0.0, 0.0, 16, 1.0, [1.0, 0.5], 'AdagradOptimizer', 0, 0.999, 0, 0,
+                towers=towers, intra_op_threads=cores, inter_op_threads=cores)
+    model.partial_fit(batch)  # warm-up
+    t = time()
+    for _ in range(args.steps):
+        model.partial_fit(batch)
+    samples_per_second = args.steps * args.batch_size / (time() - t)
+    model.sess.close()
+    return samples_per_second
+
+if __name__ == '__main__':
+    args = parse_args()
+    rng = np.random.RandomState(0)
+    batch = {'X': rng.randint(0, args.features_M, (args.batch_size, args.valid_dimen)).astype(np.int32),
+             'Y': rng.uniform(-1, 1, (args.batch_size, 1)).astype(np.float32)}
+    directory = tempfile.mkdtemp()
+    try:
+        base = None
+        print("%6s %7s %14s %8s" % ('cores', 'towers', 'samples/s', 'speedup'))
+        for cores in eval(args.cores):
+            for towers in sorted(set([1, cores])):
+                rate = throughput(args, batch, directory + '/ifm', cores, towers)
+                base = base or rate
+                print("%6d %7d %14.0f %8.2f" % (cores, towers, rate, rate / base))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,73 @@
+'''
+Accuracy of the float16 and int8 embedding tables of model/precision.py against float32
+
+For every precision: memory of feature_embeddings, test RMSE, RMSE and largest difference of the
+predictions from the float32 ones, overlap of the top-k items with the float32 top-k, and the
+time to score the test set.
+
+usage (from src/):
+python -m benchmark.precision --weights ../pretrain/fm_frappe_256/frappe_256.npz --encoder ../data/frappe/frappe.encoder.json
+'''
+import argparse
+import numpy as np
+from time import time
+import model.LoadData as DATA
+from model.encoder import FeatureEncoder
+from model.evaluation import predict_chunked, streaming_rmse
+from model.precision import PRECISIONS, compress
+from model.ranking import top_k
+from model.scorer import make_scorer
+
+#################### Arguments ####################
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark reduced-precision embedding tables.")
+    parser.add_argument('--weights', nargs='?', default='../pretrain/fm_frappe_256/frappe_256.npz',
+                        help='float32 weights exported by model/export.py.')
+    parser.add_argument('--encoder', nargs='?', default='../data/frappe/frappe.encoder.json',
+                        help='Feature encoder matching the weights.')
+    parser.add_argument('--path', nargs='?', default='../data/',
+                        help='Input data path.')
+    parser.add_argument('--dataset', nargs='?', default='frappe',
+                        help='Choose a dataset.')
+    parser.add_argument('--k', type=int, default=10,
+                        help='Number of recommended items compared.')
+    parser.add_argument('--queries', type=int, default=500,
+                        help='Number of random user/context queries.')
+    parser.add_argument('--chunk_size', type=int, default=4096,
+                        help='Rows scored at a time.')
+    return parser.parse_args()
+
+def random_rows(encoder, num_queries):
+    rng = np.random.RandomState(2016)
+    rows = np.empty((num_queries, len(encoder.fields)), dtype=np.int32)
+    for j, field in enumerate(encoder.fields):
+        ids = np.array(list(encoder.vocabulary[field].values()))
+        rows[:, j] = ids[rng.randint(len(ids), size=num_queries)]
+    return rows
+
+if __name__ == '__main__':
+    args = parse_args()
+    weights = dict(np.load(args.weights))
+    encoder = FeatureEncoder.load(args.encoder)
+    test = DATA.LoadData(args.path, args.dataset).Test_data
+    candidates = encoder.candidates('item')
+    slot = encoder.fields.index('item')
+    rows = random_rows(encoder, args.queries)
+    print("%s model, test=%d, items=%d, queries=%d" % (weights['model'], len(test['Y']), len(candidates), len(rows)))
+
+    print("%-8s %10s %9s %11s %11s %8s %9s" % ('', 'embedding', 'test', 'rmse vs', 'max diff', 'top-%d' % args.k, 'time'))
+    reference = None
+    for precision in PRECISIONS:
+        scorer = make_scorer(compress(weights, precision), encoder)
+        t = time()
+        y_pred = predict_chunked(scorer.predict, test['X'], args.chunk_size)
+        seconds = time() - t
+        rmse = streaming_rmse(scorer.predict, test, args.chunk_size)
+        top = top_k(scorer.score_candidates_batch(rows, slot, candidates), args.k)
+        if reference is None:  # float32 is the reference
+            reference = (y_pred, top)
+        difference = y_pred.astype(np.float64) - reference[0]
+        overlap = np.mean([len(np.intersect1d(a, b)) / float(args.k) for a, b in zip(top, reference[1])])
+        print("%-8s %8.2f MB %9.4f %11.2e %11.2e %8.4f %7.1f s"
+              % (precision, scorer.feature_embeddings.nbytes / 1e6, rmse, np.sqrt(np.mean(np.square(difference))),
+                 np.max(np.abs(difference)), overlap, seconds))
@@ -0,0 +1,95 @@
+'''
+Recall@N and latency of the FM retrieval indexes against exhaustive FM scoring
+
+usage (from src/):
+python -m benchmark.retrieval --weights ../pretrain/fm_frappe_256/frappe_256.npz --encoder ../data/frappe/frappe.encoder.json
+python -m benchmark.retrieval --items 100000 --factors 256      # synthetic catalogue
+'''
+import argparse
+import numpy as np
+from time import time
+from model.encoder import FeatureEncoder
+from model.scorer import NumpyFM
+from model.retrieval import build_index
+from model.ranking import top_n
+
+#################### Arguments ####################
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark FM candidate retrieval.")
+    parser.add_argument('--weights', nargs='?', default=None,
+                        help='FM weights exported by model/export.py. Random weights when omitted.')
+    parser.add_argument('--encoder', nargs='?', default='../data/frappe/frappe.encoder.json',
+                        help='Feature encoder matching the weights.')
+    parser.add_argument('--items', type=int, default=100000,
+                        help='Number of items of the synthetic catalogue.')
+    parser.add_argument('--factors', type=int, default=256,
+                        help='Number of hidden factors of the synthetic model.')
+    parser.add_argument('--queries', type=int, default=200,
+                        help='Number of random user/context queries.')
+    parser.add_argument('--n', type=int, default=200,
+                        help='Number of retrieved candidates (N of recall@N).')
+    parser.add_argument('--num_lists', type=int, default=256,
+                        help='Number of IVF lists.')
+    parser.add_argument('--nprobe', nargs='?', default='[8,16,32,64]',
+                        help='IVF lists probed per query.')
+    return parser.parse_args()
+
+def synthetic_model(num_items, factors, num_queries, num_context=400, fields=9):
+    rng = np.random.RandomState(2016)
+    # a few latent directions shared by items and contexts, so that the catalogue has structure
+    basis = rng.normal(0, 1, (16, factors))
+    features_M = num_context + num_items
+    weights = {'feature_embeddings': (np.dot(rng.normal(0, 1, (features_M, 16)), basis) * 0.01
+                                      + rng.normal(0, 0.01, (features_M, factors))).astype(np.float32),
+               'feature_bias': rng.normal(0, 0.1, features_M).astype(np.float32),
+               'bias': np.float32(0.0)}
+    fm = NumpyFM(weights, None)
+    candidates = np.arange(num_context, features_M)
+    rows = rng.randint(0, num_context, (num_queries, fields))
+    return fm, candidates, rows
+
+def frappe_model(weights_file, encoder_file, num_queries):
+    fm = NumpyFM(dict(np.load(weights_file)), None)
+    encoder = FeatureEncoder.load(encoder_file)
+    candidates = encoder.candidates('item')
+    rng = np.random.RandomState(2016)
+    rows = np.empty((num_queries, len(encoder.fields)), dtype=np.int32)
+    for j, field in enumerate(encoder.fields):
+        ids = np.array(list(encoder.vocabulary[field].values()))
+        rows[:, j] = ids[rng.randint(len(ids), size=num_queries)]
+    return fm, candidates, rows
+
+def benchmark(name, search, truth, n):
+    # search(i) returns the candidate positions retrieved for query i
+    t = time()
+    retrieved = [search(i) for i in range(len(truth))]
+    latency = (time() - t) / len(truth) * 1000
+    recall = np.mean([len(np.intersect1d(r, t)) / float(n) for r, t in zip(retrieved, truth)])
+    print("%-24s recall@%d=%.4f  %.3f ms/query" % (name, n, recall, latency))
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.weights:
+        fm, candidates, rows = frappe_model(args.weights, args.encoder, args.queries)
+    else:
+        fm, candidates, rows = synthetic_model(args.items, args.factors, args.queries)
+    slot = 1
+    queries = [np.append(fm.item_query(row, slot)[0], 1.0) for row in rows]
+    print("items=%d, factors=%d, queries=%d" % (len(candidates), fm.feature_embeddings.shape[1], len(queries)))
+
+    # exhaustive FM scoring of the whole catalogue is the reference
+    truth = [top_n(fm.score_candidates(row, slot, candidates), args.n) for row in rows]
+    benchmark('exhaustive', lambda i: top_n(fm.score_candidates(rows[i], slot, candidates), args.n), truth, args.n)
+
+    t = time()
+    exact = build_index(fm, candidates, 'exact')
+    print("exact index built [%.1f s]" % (time() - t))
+    benchmark('exact', lambda i: exact.search(queries[i], args.n)[0], truth, args.n)
+
+    for kind in ['ivf', 'ivf_int8']:
+        t = time()
+        ivf = build_index(fm, candidates, kind, num_lists=args.num_lists)
+        print("%s index built [%.1f s]" % (kind, time() - t))
+        for nprobe in eval(args.nprobe):
+            ivf.nprobe = nprobe
+            benchmark('%s nprobe=%d' % (kind, nprobe), lambda i: ivf.search(queries[i], args.n)[0], truth, args.n)
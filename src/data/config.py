@@ -4,3 +4,43 @@ class Config:
     MONGO_HOST = 'localhost'
     MONGO_PORT = 27017
     MONGO_DB_NAME = 'recommendation_system'
+    MONGO_USERNAME = None
+    MONGO_PASSWORD = None
+    # connection pool of the per-process client (data/database.py get_client)
+    MONGO_MAX_POOL_SIZE = 20  # per worker process: workers * MONGO_MAX_POOL_SIZE connections at most
+    MONGO_MIN_POOL_SIZE = 0
+    MONGO_MAX_IDLE_TIME_MS = 60000
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = 2000
+    MONGO_CONNECT_TIMEOUT_MS = 2000
+    MONGO_SOCKET_TIMEOUT_MS = 5000
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = 3000
+    MONGO_READ_PREFERENCE = 'primaryPreferred'
+    # use mongomock instead of a mongod server
+    MONGO_MOCK = False
+
+    # model served by the recommendation service
+    PRETRAIN_PATH = '../pretrain/fm_frappe_256/frappe_256'
+    # built by model/encoder.py; fitted from RAW_DATA_FILE when missing
+    ENCODER_FILE = '../data/frappe/frappe.encoder.json'
+    RAW_DATA_FILE = '../data/raw/frappe_dataset.csv'
+    META_DATA_FILE = '../data/raw/meta.csv'
+    # rows per insert_many when loading the csv files into MongoDB
+    LOAD_CHUNK_SIZE = 10000
+    # 'numpy' serves the weights exported by model/export.py without TensorFlow, 'tensorflow' restores PRETRAIN_PATH,
+    # 'frozen' loads the inference graph written by model/freeze.py
+    MODEL_BACKEND = 'numpy'
+    WEIGHTS_FILE = '../pretrain/fm_frappe_256/frappe_256.npz'
+    FROZEN_FILE = '../pretrain/fm_frappe_256/frappe_256.pb'
+    # optional FM retrieval stage in front of the model: FM weights exported by model/export.py
+    RETRIEVAL_WEIGHTS_FILE = None
+    RETRIEVAL_INDEX = 'exact'  # 'exact', 'ivf' or 'ivf_int8'
+    RETRIEVAL_CANDIDATES = 200
+    # re-ranking of the retrieved items: None keeps the objective of the model ('closest' to 1.0), so enabling
+    # retrieval does not change the ranking, only which items are scored; 'highest' ranks in the order the
+    # FM index retrieves (higher recall) and changes the items /recommend returns
+    RETRIEVAL_OBJECTIVE = None
+    # cache of ranked items per (user, context), dropped when the model files change
+    CACHE_ENABLED = True
+    CACHE_SIZE = 10000
+    CACHE_TTL = 3600  # seconds
+    CACHE_FILE = None  # e.g. '../data/recommendations.cache.sqlite' to keep results across restarts
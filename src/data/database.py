@@ -1,82 +1,315 @@
+import os
+import threading
+import weakref
+from time import time
 import pandas as pd
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+from pymongo.monitoring import ConnectionPoolListener
 
 from data.config import Config
 
+class PoolMetrics(ConnectionPoolListener):
+    '''connection pool counters of a MongoClient, updated by pymongo's pool events'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(['pools', 'created', 'closed', 'checked_out', 'checked_in',
+                                       'checkout_started', 'checkout_failed', 'cleared'], 0)
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def pool_created(self, event):
+        self.count('pools')
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self.count('cleared')
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.count('created')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.count('closed')
+
+    def connection_check_out_started(self, event):
+        self.count('checkout_started')
+
+    def connection_check_out_failed(self, event):
+        self.count('checkout_failed')
+
+    def connection_checked_out(self, event):
+        self.count('checked_out')
+
+    def connection_checked_in(self, event):
+        self.count('checked_in')
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.counters)
+        stats['open'] = stats['created'] - stats['closed']
+        stats['in_use'] = stats['checked_out'] - stats['checked_in']
+        # requests currently waiting for a free connection
+        stats['waiting'] = stats['checkout_started'] - stats['checked_out'] - stats['checkout_failed']
+        return stats
+
+# one client per process: MongoClient is thread-safe and owns the connection pool
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+pool_metrics = PoolMetrics()
+
+def create_client(config=Config):
+    if getattr(config, 'MONGO_MOCK', False):
+        # in-memory stand-in, for development and tests without a mongod
+        import mongomock
+        return mongomock.MongoClient()
+    if getattr(config, 'MONGO_USERNAME', None) and getattr(config, 'MONGO_PASSWORD', None):
+        uri = f'mongodb://{config.MONGO_USERNAME}:{config.MONGO_PASSWORD}@{config.MONGO_HOST}:{config.MONGO_PORT}/{config.MONGO_DB_NAME}'
+    else:
+        uri = f'mongodb://{config.MONGO_HOST}:{config.MONGO_PORT}/'
+    return MongoClient(uri,
+                       maxPoolSize=config.MONGO_MAX_POOL_SIZE,
+                       minPoolSize=config.MONGO_MIN_POOL_SIZE,
+                       maxIdleTimeMS=config.MONGO_MAX_IDLE_TIME_MS,
+                       waitQueueTimeoutMS=config.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                       connectTimeoutMS=config.MONGO_CONNECT_TIMEOUT_MS,
+                       socketTimeoutMS=config.MONGO_SOCKET_TIMEOUT_MS,
+                       serverSelectionTimeoutMS=config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                       readPreference=config.MONGO_READ_PREFERENCE,
+                       event_listeners=[pool_metrics],
+                       connect=False)  # connect lazily, after a pre-forking server has forked its workers
+
+def get_client(config=Config):
+    '''shared MongoClient of this process, created on first use
+    a client inherited through fork is not reused, the child creates its own pool
+    '''
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = create_client(config)
+            _client_pid = os.getpid()
+        return _client
+
+def close_client():
+    global _client, _client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client, _client_pid = None, None
+
 class MongoDBConnection:
     def __init__(self, host='localhost', 
                  port=27017, 
                  username=None, 
                  password=None, 
-                 db_name='mydatabase'):
+                 db_name='mydatabase',
+                 client=None):
         self.host = host
         self.port = port
         self.username = username
         self.password = password
         self.db_name = db_name
-        self.client = None
+        # shared client from get_client(); a private one is created when it is not given
+        self.client = client
+        self.owns_client = client is None
         self.db = None
 
-    def connect(self):
-        if self.username and self.password:
-            self.client = MongoClient(f'mongodb://{self.username}:{self.password}@{self.host}:{self.port}/{self.db_name}')
-        else:
-            self.client = MongoClient(f'mongodb://{self.host}:{self.port}/')
-        if(self.db_name not in self.client.list_database_names()):
+    def connect(self, data_file=Config.RAW_DATA_FILE, meta_file=Config.META_DATA_FILE, chunk_size=Config.LOAD_CHUNK_SIZE):
+        # the csv files are only read when the database is empty
+        if self.client is None:
+            if self.username and self.password:
+                self.client = MongoClient(f'mongodb://{self.username}:{self.password}@{self.host}:{self.port}/{self.db_name}')
+            else:
+                self.client = MongoClient(f'mongodb://{self.host}:{self.port}/')
+        self.db = self.client[self.db_name]
+        if 'items' not in self.db.list_collection_names():
             print(f'Database {self.db_name} not found. Creating new database.')
-            self.db = self.client[self.db_name]
-            load_csv_to_mongodb(self.db)
+            load_csv_to_mongodb(self.db, data_file, meta_file, chunk_size)
+        elif load_unfinished(self.db):
+            # an interrupted load left partial collections: continue after its last chunk
+            print(f'Database {self.db_name} was not fully loaded. Resuming the load.')
+            load_csv_to_mongodb(self.db, data_file, meta_file, chunk_size, resume=True)
         print(f'Connected to MongoDB database: {self.db_name}')
 
     def close(self):
-        if self.client:
+        # the shared client outlives a connection, see close_client()
+        if self.client and self.owns_client:
             self.client.close()
             print('Connection to MongoDB closed.')
 
     def get_collection(self, collection_name):
-        if not self.db:
+        if self.db is None:
             raise Exception('No database connection. Call connect() method first.')
         return self.db[collection_name]
 
-# Function to load data from CSV to MongoDB
-def load_csv_to_mongodb(db):
-    # Load data from csv
-    user_data = pd.read_csv('../data/raw/frappe_dataset.csv', sep="\t")
-    item_data = pd.read_csv('../data/raw/meta.csv', sep="\t")
-
-    # Select distinct user and store to db
-    users = user_data[['user']].drop_duplicates().reset_index(drop=True)
-    user_docs = users.to_dict(orient='record')
-    db.users.insert_many(user_docs)
-
-    # Select distict item and store to db
-    items = item_data.drop_duplicates().reset_index(drop=True)
-    item_docs = items.to_dict(orient='record')
-    db.items.insert_many(item_docs)
-
-    # Select distinct of each context type and store to db
-    context_columns = ['daytime', 'weekday', 'isweekend', 'homework', 'cost', 'weather', 'country', 'city']
-    for column in context_columns:
-        context_data = user_data[[column]].drop_duplicates().reset_index(drop=True)
-        context_docs = context_data.to_dict(orient='record')
-        # save_data = {column : context_docs}
-        db[column].insert_many(context_docs)
-
-    # Store interaction to db
-    interactions = user_data[['user', 'item', 'cnt', 'daytime', 'weekday', 'isweekend', 'homework', 'cost', 'weather', 'country', 'city']]
-    interaction_docs = interactions.to_dict(orient='record')
-    db.interactions.insert_many(interaction_docs)
-
-
-def update_items(db):
-    item_data = pd.read_csv('data/raw/meta.csv', sep="\t")
-    # item_features = ['item', 'package', 'descriptions','category', 'downloads', 'developer', 'language', 'price', 'rating']
-    items = item_data.drop_duplicates().reset_index(drop=True)
-    item_docs = items.to_dict(orient='records')
+CONTEXT_FIELDS = ['daytime', 'weekday', 'isweekend', 'homework', 'cost', 'weather', 'country', 'city']
+
+# live catalogues, refreshed by the functions that rewrite the collections they mirror
+_catalogues = weakref.WeakSet()
+
+class Catalogue:
+    '''read-through in-memory copy of the collections that only change on data loads:
+    item documents keyed by item id and the values of every context field.
+    Loaded once, served without database round-trips, reloaded by refresh().
+    :param db: pymongo database
+    :param context_fields: context collections to mirror
+    '''
+
+    def __init__(self, db, context_fields=CONTEXT_FIELDS):
+        self.db = db
+        self.context_fields = list(context_fields)
+        self.lock = threading.Lock()
+        self.items = {}
+        self.missing = set()  # ids looked up and not found, not queried again until refresh
+        self.contexts = {}
+        self.refresh()
+        _catalogues.add(self)
+
+    def refresh(self):
+        items = {item['item']: item for item in self.db.items.find({}, {'_id': 0})}
+        contexts = {}
+        for field in self.context_fields:
+            contexts[field] = [doc.get(field) for doc in self.db[field].find({}, {'_id': 0})]
+        with self.lock:
+            self.items, self.contexts, self.missing = items, contexts, set()
+
+    def get_items(self, item_ids):
+        '''item documents of the given ids, in the same order; unknown ids are skipped'''
+        unknown = [item for item in item_ids if item not in self.items and item not in self.missing]
+        if unknown:
+            # read-through: items added since the last refresh
+            found = {item['item']: item for item in self.db.items.find({'item': {'$in': unknown}}, {'_id': 0})}
+            with self.lock:
+                self.items.update(found)
+                self.missing.update(item for item in unknown if item not in found)
+        return [self.items[item] for item in item_ids if item in self.items]
+
+    def context_values(self):  # field -> list of values
+        return self.contexts
+
+def refresh_catalogues(db):
+    for catalogue in list(_catalogues):
+        if catalogue.db.name == db.name:
+            catalogue.refresh()
+
+INTERACTION_FIELDS = ['user', 'item', 'cnt', 'daytime', 'weekday', 'isweekend', 'homework', 'cost', 'weather', 'country', 'city']
+
+def insert_batch(collection, docs):
+    '''unordered insert_many; documents already stored (duplicate _id, e.g. when resuming) are skipped'''
+    if not docs:
+        return 0
+    try:
+        return len(collection.insert_many(docs, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        if any(error['code'] != 11000 for error in e.details['writeErrors']):
+            raise
+        return e.details['nInserted']
+
+def loaded_rows(db, name):  # rows of a csv already loaded, 0 when not started
+    progress = db.load_progress.find_one({'_id': name})
+    return progress['rows'] if progress else 0
+
+def load_unfinished(db):  # True when load_csv_to_mongodb started and did not finish
+    progress = db.load_progress.find_one({'_id': 'load'})
+    return progress is not None and not progress.get('done')
+
+def stream_csv(db, name, file, chunk_size, resume):
+    '''chunks of a tab separated csv with the row number of their first row, skipping the rows already loaded'''
+    progress = db.load_progress.find_one({'_id': name}) if resume else None
+    if progress and progress.get('done'):
+        return
+    start = progress['rows'] if progress else 0
+    if start:
+        print(f'Resuming {name} after {start} rows.')
+    skiprows = range(1, start + 1) if start else None  # keep the header
+    for chunk in pd.read_csv(file, sep="\t", chunksize=chunk_size, skiprows=skiprows):
+        yield start, chunk
+        start += len(chunk)
+        db.load_progress.update_one({'_id': name}, {'$set': {'rows': start, 'done': False}}, upsert=True)
+    db.load_progress.update_one({'_id': name}, {'$set': {'rows': start, 'done': True}}, upsert=True)
+
+def upsert_values(collection, field, values):  # distinct documents {field: value}
+    # one query for the values already stored and one unordered insert of the others; plain
+    # find/insert_many, which mongomock also supports (its bulk_write rejects UpdateOne of pymongo >= 4.11)
+    values = list(values)
+    if not values:
+        return
+    stored = set(doc[field] for doc in collection.find({field: {'$in': values}}, {field: 1}))
+    new_values = [value for value in values if value not in stored]
+    if new_values:
+        collection.insert_many([{field: value} for value in new_values], ordered=False)
+
+def load_items(db, file=Config.META_DATA_FILE, chunk_size=Config.LOAD_CHUNK_SIZE, resume=True):
+    '''stream the item metadata into db.items, one document per item id'''
+    t, rows = time(), 0
+    for start, chunk in stream_csv(db, 'items', file, chunk_size, resume):
+        docs = chunk.to_dict(orient='records')
+        for doc in docs:
+            doc['_id'] = doc['item']  # duplicated items are dropped by the _id index
+        rows += insert_batch(db.items, docs)
+    db.items.create_index('item')
+    print(f'Loaded {rows} items [{rows / max(time() - t, 1e-9):.0f} rows/s]')
+
+def load_csv_to_mongodb(db, data_file=Config.RAW_DATA_FILE, meta_file=Config.META_DATA_FILE,
+                        chunk_size=Config.LOAD_CHUNK_SIZE, resume=True):
+    '''stream the interaction log and the item metadata into MongoDB
+    the csv files are read chunk_size rows at a time and every chunk is one unordered insert_many,
+    so memory does not grow with the log. Progress is stored in db.load_progress: with `resume`
+    an interrupted load continues after the last loaded chunk, and MongoDBConnection.connect resumes
+    it while the 'load' entry is not done. Indexes are built once at the end.
+    '''
+    db.load_progress.update_one({'_id': 'load'}, {'$set': {'done': False}}, upsert=True)
+    load_items(db, meta_file, chunk_size, resume)
+
+    t, rows = time(), 0
+    users, contexts = set(), dict((field, set()) for field in CONTEXT_FIELDS)
+    for start, chunk in stream_csv(db, 'interactions', data_file, chunk_size, resume):
+        chunk = chunk[INTERACTION_FIELDS]
+        docs = chunk.to_dict(orient='records')
+        # the row number as _id: a chunk inserted twice after an interruption is not duplicated
+        for i, doc in enumerate(docs):
+            doc['_id'] = start + i
+        rows += insert_batch(db.interactions, docs)
+
+        # distinct users and context values, only the new ones are written
+        new_users = set(chunk['user'].unique().tolist()) - users
+        upsert_values(db.users, 'user', new_users)
+        users |= new_users
+        for field in CONTEXT_FIELDS:
+            new_values = set(chunk[field].unique().tolist()) - contexts[field]
+            upsert_values(db[field], field, new_values)
+            contexts[field] |= new_values
+    elapsed = max(time() - t, 1e-9)
+    print(f'Loaded {rows} interactions [{rows / elapsed:.0f} rows/s]')
+
+    # indexes after the load: cheaper than maintaining them on every insert
+    for field in ['user', 'item'] + CONTEXT_FIELDS:
+        db.interactions.create_index(field)
+    db.users.create_index('user')
+    for field in CONTEXT_FIELDS:
+        db[field].create_index(field)
+    db.load_progress.update_one({'_id': 'load'}, {'$set': {'done': True}}, upsert=True)
+    refresh_catalogues(db)
+
+
+def update_items(db, file=Config.META_DATA_FILE, chunk_size=Config.LOAD_CHUNK_SIZE):
     db.items.drop()
-    
+    db.load_progress.delete_one({'_id': 'items'})
+
     # Insert new documents into 'items' collection
-    db.items.insert_many(item_docs)
+    load_items(db, file, chunk_size, resume=False)
+    refresh_catalogues(db)
 
 # Usage example
 if __name__ == "__main__":
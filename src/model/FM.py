@@ -18,6 +18,11 @@ from sklearn.metrics import roc_auc_score
 from time import time
 import argparse
 import LoadData as DATA
+from batcher import Batcher
+from checkpoint import load_embeddings, TrainingCheckpoint, BestCheckpoint
+from evaluation import predict_chunked, streaming_rmse
+from training import EarlyStopping, EvaluationSchedule
+from parallel import session_config, data_parallel
 from tensorflow.contrib.layers.python.layers import batch_norm as batch_norm
 
 #################### Arguments ####################
@@ -37,6 +42,8 @@ def parse_args():
                         help='flag for pretrain. 1: initialize from pretrain; 0: randomly initialize; -1: save to pretrain file')
     parser.add_argument('--batch_size', type=int, default=4096,
                         help='Batch size.')
+    parser.add_argument('--eval_chunk_size', type=int, default=0,
+                        help='Samples fed per session run during evaluation. 0: use the batch size.')
     parser.add_argument('--hidden_factor', type=int, default=256,
                         help='Number of hidden factors.')
     parser.add_argument('--lamda', type=float, default=0,
@@ -51,14 +58,41 @@ def parse_args():
                         help='Whether to show the performance of each epoch (0 or 1)')
     parser.add_argument('--batch_norm', type=int, default=1,
                     help='Whether to perform batch normaization (0 or 1)')
+    parser.add_argument('--checkpoint_every', type=int, default=1,
+                        help='Snapshot the training state every n epochs, 0 disables snapshots.')
+    parser.add_argument('--resume', type=int, default=0,
+                        help='Continue from the latest training snapshot (0 or 1).')
+    parser.add_argument('--patience', type=int, default=5,
+                        help='Stop after this many evaluations without a better validation RMSE, 0 disables early stopping.')
+    parser.add_argument('--min_delta', type=float, default=0.0,
+                        help='Smallest decrease of the validation RMSE counted as an improvement.')
+    parser.add_argument('--valid_every', type=int, default=1,
+                        help='Evaluate every n epochs (the last epoch is always evaluated).')
+    parser.add_argument('--train_sample', type=float, default=0,
+                        help='Rows of the training set the train RMSE is computed on, a fraction when below 1. 0: the whole set.')
+    parser.add_argument('--eval_test', type=int, default=1,
+                        help='Evaluate the test set with every evaluation (1) or only for the best weights (0).')
+    parser.add_argument('--towers', type=int, default=1,
+                        help='Data-parallel towers, each training on a slice of every batch.')
+    parser.add_argument('--intra_op_threads', type=int, default=0,
+                        help='Threads splitting a single op. 0: one per core.')
+    parser.add_argument('--inter_op_threads', type=int, default=0,
+                        help='Threads running independent ops (e.g. the towers) concurrently. 0: one per core.')
 
     return parser.parse_args()
 
 class FM(BaseEstimator, TransformerMixin):
     def __init__(self, features_M, pretrain_flag, save_file, hidden_factor, epoch, batch_size, learning_rate, lamda_bilinear, keep,
-                 optimizer_type, batch_norm, verbose, micro_level_analysis, random_seed=2016):
+                 optimizer_type, batch_norm, verbose, micro_level_analysis, eval_chunk_size=None, checkpoint_every=0, resume=False, patience=5, min_delta=0.0, valid_every=1,
+                 train_sample=0, eval_test=True, towers=1, intra_op_threads=0, inter_op_threads=0, random_seed=2016):
         # bind params to class
         self.batch_size = batch_size
+        self.towers = towers
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.checkpoint_every = checkpoint_every
+        self.resume = resume
+        self.eval_chunk_size = eval_chunk_size if eval_chunk_size else batch_size
         self.learning_rate = learning_rate
         self.hidden_factor = hidden_factor
         self.save_file = save_file
@@ -74,6 +108,10 @@ class FM(BaseEstimator, TransformerMixin):
         self.micro_level_analysis = micro_level_analysis
         # performance of each epoch
         self.train_rmse, self.valid_rmse, self.test_rmse = [], [], []
+        # finished epochs after each evaluation, the metrics above are recorded at these epochs only
+        self.eval_epochs = []
+        self.stopping = EarlyStopping(patience, min_delta)
+        self.schedule = EvaluationSchedule(epoch, valid_every, train_sample, eval_test, random_seed)
 
         # init all variables in a tensorflow graph
         self._init_graph()
@@ -96,70 +134,31 @@ class FM(BaseEstimator, TransformerMixin):
             self.weights = self._initialize_weights()
 
             # Model.
-            # get the summed up embeddings of features.
-            self.nonzero_embeddings = tf.nn.embedding_lookup(self.weights['feature_embeddings'], self.train_features, name='nonzero_embeddings')
-            self.summed_features_emb = tf.reduce_sum(self.nonzero_embeddings, 1, keep_dims=True) # None * 1 * K
-            # get the element-multiplication
-            self.summed_features_emb_square = tf.square(self.summed_features_emb)  # None * 1 * K
-  
-            # _________ square_sum part _____________
-            self.squared_features_emb = tf.square(self.nonzero_embeddings)
-            self.squared_sum_features_emb = tf.reduce_sum(self.squared_features_emb, 1, keep_dims=True)  # None * 1 * K
-  
-            # ________ FM __________
-            self.FM = 0.5 * tf.subtract(self.summed_features_emb_square, self.squared_sum_features_emb, name="fm")  # None * 1 * K
-
-#             element_wise_product_list = []
-#             count = 0
-#             for i in range(0, 3):
-#                 for j in range(i+1, 3):
-#                     element_wise_product_list.append(tf.multiply(self.nonzero_embeddings[:,i,:], self.nonzero_embeddings[:,j,:]))
-#                     count += 1
-#             self.element_wise_product = tf.stack(element_wise_product_list) # (M'*(M'-1)) * None * K
-#             self.element_wise_product = tf.transpose(self.element_wise_product, perm=[1,0,2], name="element_wise_product") # None * (M'*(M'-1)) * K
-#             self.interactions = tf.reduce_sum(self.element_wise_product, 1, name="interactions")
-#               
-#             print(self.interactions)
-#             self.FM = tf.expand_dims(self.interactions, 1)
-#             print(self.FM)
-            # ml-tag has 3 interactions. divided by 3 to make sure that the sum of the weights is 1
-            if self.micro_level_analysis:
-                self.FM = self.FM / 3.0
-            if self.batch_norm and not self.micro_level_analysis:
-                self.FM = self.batch_norm_layer(self.FM, train_phase=self.train_phase, scope_bn='bn_fm')
-            self.FM_OUT = tf.reduce_sum(self.FM, 1, name="fm_out") # None * K
-            print("self.FM_OUT = " + str(self.FM_OUT))
-            self.FM_OUT = tf.nn.dropout(self.FM_OUT, self.dropout_keep) # dropout at the FM layer
-
-            # _________out _________
-            if self.micro_level_analysis:
-                # ml-tag has 3 interactions. divided by 3 to make sure that the total weight of the sum is 1
-                self.out = tf.reduce_sum(self.FM_OUT, 1, keep_dims=True, name="out")  # None * 1
-            else:
-                Bilinear = tf.reduce_sum(self.FM_OUT, 1, keep_dims=True)  # None * 1
-                self.Feature_bias = tf.reduce_sum(tf.nn.embedding_lookup(self.weights['feature_bias'], self.train_features) , 1)  # None * 1
-                Bias = self.weights['bias'] * tf.ones_like(self.train_labels)  # None * 1
-                self.out = tf.add_n([Bilinear, self.Feature_bias, Bias], name="out")  # None * 1
+            self.out = self._forward(self.train_features, self.train_labels)
 
             # Compute the square loss.
-            if self.lamda_bilinear > 0:
-                self.loss = tf.nn.l2_loss(tf.subtract(self.train_labels, self.out)) + tf.contrib.layers.l2_regularizer(self.lamda_bilinear)(self.weights['feature_embeddings'])  # regulizer
-            else:
-                self.loss = tf.nn.l2_loss(tf.subtract(self.train_labels, self.out))
+            self.loss = self._loss(self.train_labels, self.out)
 
             # Optimizer.
             if self.optimizer_type == 'AdamOptimizer':
-                self.optimizer = tf.train.AdamOptimizer(learning_rate=self.learning_rate, beta1=0.9, beta2=0.999, epsilon=1e-8).minimize(self.loss)
+                optimizer = tf.train.AdamOptimizer(learning_rate=self.learning_rate, beta1=0.9, beta2=0.999, epsilon=1e-8)
             elif self.optimizer_type == 'AdagradOptimizer':
-                self.optimizer = tf.train.AdagradOptimizer(learning_rate=self.learning_rate, initial_accumulator_value=1e-8).minimize(self.loss)
+                optimizer = tf.train.AdagradOptimizer(learning_rate=self.learning_rate, initial_accumulator_value=1e-8)
             elif self.optimizer_type == 'GradientDescentOptimizer':
-                self.optimizer = tf.train.GradientDescentOptimizer(learning_rate=self.learning_rate).minimize(self.loss)
+                optimizer = tf.train.GradientDescentOptimizer(learning_rate=self.learning_rate)
             elif self.optimizer_type == 'MomentumOptimizer':
-                self.optimizer = tf.train.MomentumOptimizer(learning_rate=self.learning_rate, momentum=0.95).minimize(self.loss)
+                optimizer = tf.train.MomentumOptimizer(learning_rate=self.learning_rate, momentum=0.95)
+            if self.towers > 1:
+                # each tower fits a slice of the batch, the loss of the whole batch is their sum
+                self.optimizer, self.train_loss = data_parallel(optimizer, self._tower_loss, self.train_features, self.train_labels, self.towers)
+            else:
+                self.optimizer, self.train_loss = optimizer.minimize(self.loss), self.loss
 
             # init
             self.sess = self._init_session()
             self.saver = tf.train.Saver()
+            self.checkpoint = TrainingCheckpoint(self.save_file, 'fm')
+            self.best = BestCheckpoint(self.save_file, 'fm')
             init = tf.global_variables_initializer()
             self.sess.run(init)
 
@@ -174,27 +173,62 @@ class FM(BaseEstimator, TransformerMixin):
             if self.verbose > 0:
                 print("#params: %d" % total_parameters)
 
+    def _forward(self, features, labels, reuse=None):
+        '''
+        FM prediction of a batch, None * 1; reuse: the batch norm variables exist already (towers)
+        '''
+        # get the summed up embeddings of features.
+        nonzero_embeddings = tf.nn.embedding_lookup(self.weights['feature_embeddings'], features, name='nonzero_embeddings')
+        summed_features_emb = tf.reduce_sum(nonzero_embeddings, 1, keep_dims=True) # None * 1 * K
+        # get the element-multiplication
+        summed_features_emb_square = tf.square(summed_features_emb)  # None * 1 * K
+  
+        # _________ square_sum part _____________
+        squared_features_emb = tf.square(nonzero_embeddings)
+        squared_sum_features_emb = tf.reduce_sum(squared_features_emb, 1, keep_dims=True)  # None * 1 * K
+  
+        # ________ FM __________
+        FM = 0.5 * tf.subtract(summed_features_emb_square, squared_sum_features_emb, name="fm")  # None * 1 * K
+
+        # ml-tag has 3 interactions. divided by 3 to make sure that the sum of the weights is 1
+        if self.micro_level_analysis:
+            FM = FM / 3.0
+        if self.batch_norm and not self.micro_level_analysis:
+            FM = self.batch_norm_layer(FM, train_phase=self.train_phase, scope_bn='bn_fm', reuse=reuse)
+        FM_OUT = tf.reduce_sum(FM, 1, name="fm_out") # None * K
+        FM_OUT = tf.nn.dropout(FM_OUT, self.dropout_keep) # dropout at the FM layer
+
+        # _________out _________
+        if self.micro_level_analysis:
+            # ml-tag has 3 interactions. divided by 3 to make sure that the total weight of the sum is 1
+            out = tf.reduce_sum(FM_OUT, 1, keep_dims=True, name="out")  # None * 1
+        else:
+            Bilinear = tf.reduce_sum(FM_OUT, 1, keep_dims=True)  # None * 1
+            Feature_bias = tf.reduce_sum(tf.nn.embedding_lookup(self.weights['feature_bias'], features) , 1)  # None * 1
+            Bias = self.weights['bias'] * tf.ones_like(labels)  # None * 1
+            out = tf.add_n([Bilinear, Feature_bias, Bias], name="out")  # None * 1
+        return out
+
+    def _loss(self, labels, out, scale=1.0):  # square loss, the regularizer weighted by scale
+        if self.lamda_bilinear > 0:
+            return tf.nn.l2_loss(tf.subtract(labels, out)) + tf.contrib.layers.l2_regularizer(self.lamda_bilinear * scale)(self.weights['feature_embeddings'])  # regulizer
+        return tf.nn.l2_loss(tf.subtract(labels, out))
+
+    def _tower_loss(self, features, labels):  # loss of one slice of the batch, the towers share the regularizer
+        return self._loss(labels, self._forward(features, labels, reuse=True), 1.0 / self.towers)
+
     def _init_session(self):
-        # adaptively growing video memory
+        # adaptively growing video memory, thread pools of --intra_op_threads and --inter_op_threads
 #         config = tf.ConfigProto(
 #             device_count = {'GPU': 0}
 #             )
-        config = tf.ConfigProto()
-        config.gpu_options.allow_growth = True
-        return tf.Session(config=config)
+        return tf.Session(config=session_config(self.intra_op_threads, self.inter_op_threads))
 
     def _initialize_weights(self):
         all_weights = dict()
         if self.pretrain_flag > 0:
-            weight_saver = tf.train.import_meta_graph(self.save_file + '.meta')
-            pretrain_graph = tf.get_default_graph()
-            feature_embeddings = pretrain_graph.get_tensor_by_name('feature_embeddings:0')
-            feature_bias = pretrain_graph.get_tensor_by_name('feature_bias:0')
-            bias = pretrain_graph.get_tensor_by_name('bias:0')
-
-            with self._init_session() as sess:
-                weight_saver.restore(sess, self.save_file)
-                fe, fb, b = sess.run([feature_embeddings, feature_bias, bias])
+            # read by name from the checkpoint, grown when the vocabulary gained features since
+            fe, fb, b = load_embeddings(self.save_file, self.features_M, self.random_seed)
 
             all_weights['feature_embeddings'] = tf.Variable(fe, dtype=tf.float32, name='feature_embeddings')
             all_weights['feature_bias'] = tf.Variable(fb, dtype=tf.float32, name='feature_bias')
@@ -208,9 +242,9 @@ class FM(BaseEstimator, TransformerMixin):
             all_weights['bias'] = tf.Variable(tf.constant(0.0), name='bias')  # 1 * 1
         return all_weights
 
-    def batch_norm_layer(self, x, train_phase, scope_bn):
+    def batch_norm_layer(self, x, train_phase, scope_bn, reuse=None):
         bn_train = batch_norm(x, decay=0.9, center=True, scale=True, updates_collections=None,
-            is_training=True, reuse=None, trainable=True, scope=scope_bn)
+            is_training=True, reuse=reuse, trainable=True, scope=scope_bn)
         bn_inference = batch_norm(x, decay=0.9, center=True, scale=True, updates_collections=None,
             is_training=False, reuse=True, trainable=True, scope=scope_bn)
         z = tf.cond(train_phase, lambda: bn_train, lambda: bn_inference)
@@ -218,96 +252,93 @@ class FM(BaseEstimator, TransformerMixin):
 
     def partial_fit(self, data):  # fit a batch
         feed_dict = {self.train_features: data['X'], self.train_labels: data['Y'], self.dropout_keep: self.keep, self.train_phase: True}
-        loss, opt = self.sess.run((self.loss, self.optimizer), feed_dict=feed_dict)
+        loss, opt = self.sess.run((self.train_loss, self.optimizer), feed_dict=feed_dict)
         return loss
 
-    def get_random_block_from_data(self, data, batch_size):  # generate a random block of training data
-        start_index = np.random.randint(0, len(data['Y']) - batch_size)
-        X , Y = [], []
-        # forward get sample
-        i = start_index
-        while len(X) < batch_size and i < len(data['X']):
-            if len(data['X'][i]) == len(data['X'][start_index]):
-                Y.append([data['Y'][i]])
-                X.append(data['X'][i])
-                i = i + 1
-            else:
-                break
-        # backward get sample
-        i = start_index
-        while len(X) < batch_size and i >= 0:
-            if len(data['X'][i]) == len(data['X'][start_index]):
-                Y.append([data['Y'][i]])
-                X.append(data['X'][i])
-                i = i - 1
-            else:
-                break
-        return {'X': X, 'Y': Y}
-
-    def shuffle_in_unison_scary(self, a, b): # shuffle two lists simutaneously
-        rng_state = np.random.get_state()
-        np.random.shuffle(a)
-        np.random.set_state(rng_state)
-        np.random.shuffle(b)
-
     def train(self, Train_data, Validation_data, Test_data):  # fit a dataset
+        # continue an interrupted run from its latest snapshot
+        start_epoch = 0
+        if self.resume:
+            state = self.checkpoint.restore(self.sess)
+            if state is not None:
+                start_epoch = state['epoch']
+                self.train_rmse, self.valid_rmse, self.test_rmse = state['train_rmse'], state['valid_rmse'], state['test_rmse']
+                self.eval_epochs = state['eval_epochs']
+                self.stopping.load(state['stopping'])
+                print("Resume after epoch %d" % start_epoch)
+
+        # the train RMSE is followed on a fixed sample, the batches cover the whole set
+        train_sample = self.schedule.train_subset(Train_data)
+
         # Check Init performance
-        if self.verbose > 0:
+        if self.verbose > 0 and start_epoch == 0:
             t2 = time()
-            init_train = self.evaluate(Train_data)
+            init_train = self.evaluate(train_sample)
             init_valid = self.evaluate(Validation_data)
-            init_test  = self.evaluate(Test_data)
+            init_test  = self.evaluate(Test_data) if self.schedule.eval_test else float('nan')
             print(("Init: \t train=%.4f, validation=%.4f, test=%.4f [%.1f s]" %(init_train, init_valid, init_test, time()-t2)))
 
-        for epoch in range(self.epoch):
+        # with towers, the tail of the epoch is merged into the last full batch: never an empty tower slice
+        batcher = Batcher(Train_data, self.batch_size, min_batch=self.towers)
+        for epoch in range(start_epoch, self.epoch):
             t1 = time()
-            self.shuffle_in_unison_scary(Train_data['X'], Train_data['Y'])
-            total_batch = int(len(Train_data['Y']) / self.batch_size)
-            for i in range(total_batch):
-                # generate a batch
-                batch_xs = self.get_random_block_from_data(Train_data, self.batch_size)
+            for batch_xs in batcher: # shuffled batches covering the whole training set
                 # Fit training
                 self.partial_fit(batch_xs)
             t2 = time()
-            # output validation
-            train_result = self.evaluate(Train_data)
-            valid_result = self.evaluate(Validation_data)
-            test_result  = self.evaluate(Test_data)
-
-            self.train_rmse.append(train_result)
-            self.valid_rmse.append(valid_result)
-            self.test_rmse.append(test_result)
-
-            if self.verbose > 0 and epoch%self.verbose == 0:
-                print(("Epoch %d [%.1f s]\ttrain=%.4f, validation=%.4f, Test=%.4f [%.1f s]"
-                      %(epoch+1, t2-t1, train_result, valid_result, test_result, time()-t2)))
-#             if self.eva_termination(self.valid_rmse):
-#                 break
-# 
+            if self.schedule.evaluate_at(epoch + 1):
+                # output validation
+                train_result = self.evaluate(train_sample)
+                valid_result = self.evaluate(Validation_data)
+                test_result  = self.evaluate(Test_data) if self.schedule.eval_test else float('nan')
+
+                self.train_rmse.append(train_result)
+                self.valid_rmse.append(valid_result)
+                self.test_rmse.append(test_result)
+                self.eval_epochs.append(epoch + 1)
+                if self.stopping.update(valid_result, epoch + 1):
+                    self.best.save(self.sess)
+
+                if self.verbose > 0 and epoch%self.verbose == 0:
+                    print(("Epoch %d [%.1f s]\ttrain=%.4f, validation=%.4f, Test=%.4f [%.1f s]"
+                          %(epoch+1, t2-t1, train_result, valid_result, test_result, time()-t2)))
+            elif self.verbose > 0 and epoch%self.verbose == 0:
+                print(("Epoch %d [%.1f s]" %(epoch+1, t2-t1)))
+            if self.checkpoint_every and (epoch + 1) % self.checkpoint_every == 0:
+                self.checkpoint.save(self.sess, epoch + 1, {'train_rmse': self.train_rmse, 'valid_rmse': self.valid_rmse, 'test_rmse': self.test_rmse,
+                                                            'eval_epochs': self.eval_epochs, 'stopping': self.stopping.state()})
+            if self.stopping.stop:
+                print(("Early stop after epoch %d, no improvement in %d evaluations" %(epoch+1, self.stopping.wait)))
+                break
+
+        # keep the weights of the best validation, not of the last epoch
+        best = self.best_index()
+        if best is not None:
+            self.best.restore(self.sess)
+            if not self.schedule.eval_test:
+                self.test_rmse[best] = self.evaluate(Test_data)
         if self.pretrain_flag < 0:
             print("Save model to file as pretrain.")
             self.saver.save(self.sess, self.save_file)
 
-    def eva_termination(self, valid):
-        if len(valid) > 5:
-            if valid[-1] > valid[-2] and valid[-2] > valid[-3] and valid[-3] > valid[-4] and valid[-4] > valid[-5]:
-                return True
-        return False
-
-    def evaluate(self, data):  # evaluate the results for an input set
-        num_example = len(data['Y'])
-        feed_dict = {self.train_features: data['X'], self.train_labels: [[y] for y in data['Y']], self.dropout_keep: 1.0, self.train_phase: False}
-        predictions = self.sess.run((self.out), feed_dict=feed_dict)
-        y_pred = np.reshape(predictions, (num_example,))
-        y_true = np.reshape(data['Y'], (num_example,))
-
-        predictions_bounded = np.maximum(y_pred, np.ones(num_example) * min(y_true))  # bound the lower values
-        predictions_bounded = np.minimum(predictions_bounded, np.ones(num_example) * max(y_true))  # bound the higher values
-        RMSE = math.sqrt(mean_squared_error(y_true, predictions_bounded))
-        return RMSE
+    def best_index(self):  # position of the restored best evaluation in the metric lists, None when nothing was evaluated
+        if self.stopping.best_epoch is None:
+            return None
+        return self.eval_epochs.index(self.stopping.best_epoch)
+
+    def evaluate(self, data):  # evaluate the results for an input set, chunk by chunk
+        return streaming_rmse(self.predict_chunk, data, self.eval_chunk_size)
 #         AUC = roc_auc_score(y_true, predictions_bounded)
 #         return AUC
 
+    def predict(self, X):  # predictions for all rows of X, written into a preallocated buffer
+        return predict_chunked(self.predict_chunk, X, self.eval_chunk_size)
+
+    def predict_chunk(self, X):
+        # labels only give the shape of the bias term
+        feed_dict = {self.train_features: X, self.train_labels: np.zeros((len(X), 1)), self.dropout_keep: 1.0, self.train_phase: False}
+        return self.sess.run(self.out, feed_dict=feed_dict)
+
 
 def make_save_file(args):
     pretrain_path = '../pretrain/fm_%s_%d' %(args.dataset, args.hidden_factor)
@@ -327,15 +358,18 @@ def train(args):
 
     # Training
     t1 = time()
-    model = FM(data.features_M, args.pretrain, make_save_file(args), args.hidden_factor, args.epoch, args.batch_size, args.lr, args.lamda, args.keep, args.optimizer, args.batch_norm, args.verbose, args.mla)
+    model = FM(data.features_M, args.pretrain, make_save_file(args), args.hidden_factor, args.epoch, args.batch_size, args.lr, args.lamda, args.keep, args.optimizer, args.batch_norm, args.verbose, args.mla, args.eval_chunk_size,
+               args.checkpoint_every, args.resume, args.patience, args.min_delta, args.valid_every, args.train_sample, args.eval_test,
+               args.towers, args.intra_op_threads, args.inter_op_threads)
     model.train(data.Train_data, data.Validation_data, data.Test_data)
 
-    # Find the best validation result across iterations
-    best_valid_score = 0
-    best_valid_score = min(model.valid_rmse)
-    best_epoch = model.valid_rmse.index(best_valid_score)
-    print(("Best Iter(validation)= %d\t train = %.4f, valid = %.4f Test = %.4f [%.1f s]"
-           %(best_epoch+1, model.train_rmse[best_epoch], model.valid_rmse[best_epoch], model.test_rmse[best_epoch], time()-t1)))
+    # the best validation result across iterations, the weights the model holds
+    best = model.best_index()
+    if best is None:
+        print("No validation in %d epochs, nothing to report [%.1f s]" % (model.epoch, time()-t1))
+    else:
+        print(("Best Iter(validation)= %d\t train = %.4f, valid = %.4f Test = %.4f [%.1f s]"
+               %(model.eval_epochs[best], model.train_rmse[best], model.valid_rmse[best], model.test_rmse[best], time()-t1)))
 
 
 def evaluate(args):
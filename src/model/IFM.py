@@ -21,13 +21,20 @@ from sklearn.metrics import roc_auc_score
 from time import time
 import argparse
 import model.LoadData as DATA
+from model.batcher import Batcher
+from model.checkpoint import load_embeddings, restore_variables, TrainingCheckpoint, BestCheckpoint
+from model.evaluation import predict_chunked, streaming_rmse
+from model.training import EarlyStopping, EvaluationSchedule
+from model.parallel import session_config, data_parallel
+from model.predictor import Predictor
+from model.encoder import load_encoder
 from tensorflow.contrib.layers.python.layers import batch_norm as batch_norm
 
 #################### Arguments ####################
-def parse_args():
+def parse_args(args=None):
     parser = argparse.ArgumentParser(description="Run IFM.")
     parser.add_argument('--process', nargs='?', default='train',
-                        help='Process type: train, evaluate.')
+                        help='Process type: train, evaluate, incremental.')
     parser.add_argument('--mla', type=int, default=0,
                         help='Set the experiment mode to be Micro Level Analysis or not: 0-disable, 1-enable.')
     parser.add_argument('--path', nargs='?', default='../data/',
@@ -42,6 +49,8 @@ def parse_args():
                         help='flag for pretrain. 1: initialize from pretrain; 0: randomly initialize; -1: save to pretrain file; 2: initialize from pretrain and save to pretrain file')
     parser.add_argument('--batch_size', type=int, default=4096,
                         help='Batch size.')
+    parser.add_argument('--eval_chunk_size', type=int, default=0,
+                        help='Samples fed per session run during evaluation. 0: use the batch size.')
     parser.add_argument('--attention', type=int, default=1,
                         help='flag for attention. 1: use attention; 0: no attention')
     parser.add_argument('--hidden_factor', nargs='?', default='[8,256]',
@@ -71,14 +80,46 @@ def parse_args():
                     help='Decay value for batch norm')
     parser.add_argument('--activation', nargs='?', default='relu',
                     help='Which activation function to use for deep layers: relu, sigmoid, tanh, identity')
-
-    return parser.parse_args()
+    parser.add_argument('--checkpoint_every', type=int, default=1,
+                        help='Snapshot the training state every n epochs, 0 disables snapshots.')
+    parser.add_argument('--resume', type=int, default=0,
+                        help='Continue from the latest training snapshot (0 or 1).')
+    parser.add_argument('--patience', type=int, default=5,
+                        help='Stop after this many evaluations without a better validation RMSE, 0 disables early stopping.')
+    parser.add_argument('--min_delta', type=float, default=0.0,
+                        help='Smallest decrease of the validation RMSE counted as an improvement.')
+    parser.add_argument('--valid_every', type=int, default=1,
+                        help='Evaluate every n epochs (the last epoch is always evaluated).')
+    parser.add_argument('--train_sample', type=float, default=0,
+                        help='Rows of the training set the train RMSE is computed on, a fraction when below 1. 0: the whole set.')
+    parser.add_argument('--eval_test', type=int, default=1,
+                        help='Evaluate the test set with every evaluation (1) or only for the best weights (0).')
+    parser.add_argument('--towers', type=int, default=1,
+                        help='Data-parallel towers, each training on a slice of every batch.')
+    parser.add_argument('--intra_op_threads', type=int, default=0,
+                        help='Threads splitting a single op. 0: one per core.')
+    parser.add_argument('--inter_op_threads', type=int, default=0,
+                        help='Threads running independent ops (e.g. the towers) concurrently. 0: one per core.')
+    parser.add_argument('--new_dataset', nargs='?', default=None,
+                        help='incremental process: dataset of the new interactions, mapped with the vocabulary of --dataset.')
+    parser.add_argument('--passes', type=int, default=2,
+                        help='incremental process: epochs over the new interactions.')
+
+    return parser.parse_args(args)
 
 class AFM(BaseEstimator, TransformerMixin):
     def __init__(self, features_M, pretrain_flag, save_file, attention, hidden_factor, valid_dimension, activation_function, num_variable, 
-                 freeze_fm, epoch, batch_size, learning_rate, lamda_attention, lamda_attention1, kf, temp, keep, optimizer_type, batch_norm, decay, verbose, micro_level_analysis, random_seed=2016):
+                 freeze_fm, epoch, batch_size, learning_rate, lamda_attention, lamda_attention1, kf, temp, keep, optimizer_type, batch_norm, decay, verbose, micro_level_analysis, 
+                 eval_chunk_size=None, checkpoint_every=0, resume=False, patience=5, min_delta=0.0, valid_every=1,
+                 train_sample=0, eval_test=True, towers=1, intra_op_threads=0, inter_op_threads=0, random_seed=2016):
         # bind params to class
         self.batch_size = batch_size
+        self.towers = towers
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.checkpoint_every = checkpoint_every
+        self.resume = resume
+        self.eval_chunk_size = eval_chunk_size if eval_chunk_size else batch_size
         self.learning_rate = learning_rate
         self.attention = attention
         self.hidden_factor = hidden_factor
@@ -103,6 +144,10 @@ class AFM(BaseEstimator, TransformerMixin):
         self.micro_level_analysis = micro_level_analysis
         # performance of each epoch
         self.train_rmse, self.valid_rmse, self.test_rmse = [], [], []
+        # finished epochs after each evaluation, the metrics above are recorded at these epochs only
+        self.eval_epochs = []
+        self.stopping = EarlyStopping(patience, min_delta)
+        self.schedule = EvaluationSchedule(epoch, valid_every, train_sample, eval_test, random_seed)
 
         # init all variables in a tensorflow graph
         self._init_graph()
@@ -125,72 +170,31 @@ class AFM(BaseEstimator, TransformerMixin):
             self.weights = self._initialize_weights()
 
             # Model.
-            self.nonzero_embeddings = tf.nn.embedding_lookup(self.weights['feature_embeddings'], self.train_features) # None * M' * K
-            
-            element_wise_product_list = []
-            interactions = []
-            count = 0
-            for i in range(0, self.valid_dimension):
-                for j in range(i+1, self.valid_dimension):
-                    element_wise_product_list.append(tf.multiply(self.nonzero_embeddings[:,i,:], self.nonzero_embeddings[:,j,:]))
-                    interactions.append(tf.multiply(self.weights['interaction'][i,:], self.weights['interaction'][j,:]))
-                    count += 1
-            self.element_wise_product = tf.stack(element_wise_product_list) # (M'*(M'-1)) * None * K
-            self.element_wise_product = tf.transpose(self.element_wise_product, perm=[1,0,2], name="element_wise_product") # None * (M'*(M'-1)) * K
-            self.interactions = tf.reduce_sum(self.element_wise_product, 2, name="interactions")
-            # _________ MLP Layer / attention part _____________
-            num_interactions = self.valid_dimension*(self.valid_dimension-1)// 2
-            self.num_interactions = num_interactions
-            if self.attention:
-                self.attention_mul = tf.reshape(tf.matmul(tf.reshape(self.element_wise_product, shape=[-1, self.hidden_factor[1]]), \
-                    self.weights['attention_W']), shape=[-1, num_interactions, self.hidden_factor[0]])
-                self.attention_mul = self.attention_mul / self.temp
-                self.attention_exp = tf.exp(tf.reduce_sum(tf.multiply(self.weights['attention_p'], tf.nn.relu(self.attention_mul + \
-                    self.weights['attention_b'])), 2, keep_dims=True)) # None * (M'*(M'-1)) * 1
-                self.attention_sum = tf.reduce_sum(self.attention_exp, 1, keep_dims=True) # None * 1 * 1
-                self.attention_out = tf.div(self.attention_exp, self.attention_sum, name="attention_out") # None * (M'*(M'-1)) * 1
-                self.attention_out = tf.nn.dropout(self.attention_out, self.dropout_keep[0]) # dropout
-            
-            # _________ Attention-aware Pairwise Interaction Layer _____________
-     
-            self.AFM = self.attention_out * self.element_wise_product
-            self.AFM = tf.reshape(self.AFM, [-1, num_interactions * self.hidden_factor[1]])
-            self.AFM = tf.nn.dropout(self.AFM, self.dropout_keep[1]) # dropout
-            
-            self.field_interactions = tf.stack(interactions)  
-            self.attention_interaction = tf.matmul(self.field_interactions, self.weights['factor'])
-            self.attention_interaction = tf.reshape(self.attention_interaction, [num_interactions * self.hidden_factor[1], 1])
-            self.AFM = tf.tensordot(self.AFM, self.attention_interaction, axes=1)
-            self.AFM = tf.reduce_sum(self.AFM, reduction_indices=[1])
-             
-            self.prediction = self.AFM
-            Bilinear = tf.expand_dims(self.prediction, -1)
-            self.Feature_bias = tf.reduce_sum(tf.nn.embedding_lookup(self.weights['feature_bias'], self.train_features) , 1)  # None * 1
-            Bias = self.weights['bias'] * tf.ones_like(self.train_labels)  # None * 1
-            self.out = tf.add_n([Bilinear, self.Feature_bias, Bias], name="out_afm")  # None * 1
+            self.num_interactions = self.valid_dimension*(self.valid_dimension-1)// 2
+            self.out = self._forward(self.train_features, self.train_labels)
 
             # Compute the loss.
-            if self.lamda_attention > 0:
-                self.loss = tf.nn.l2_loss(tf.subtract(self.train_labels, self.out)) + tf.contrib.layers.l2_regularizer(self.lamda_attention)(self.weights['attention_W'])  # regulizer
-            else:
-                self.loss = tf.nn.l2_loss(tf.subtract(self.train_labels, self.out))
-                
-            if self.lamda_attention1 > 0:
-                self.loss += tf.contrib.layers.l2_regularizer(self.lamda_attention1)(self.weights['interaction']) \
-                            + tf.contrib.layers.l2_regularizer(self.lamda_attention1)(self.weights['factor'])
+            self.loss = self._loss(self.train_labels, self.out)
 
             # Optimizer.
             if self.optimizer_type == 'AdamOptimizer':
-                self.optimizer = tf.train.AdamOptimizer(learning_rate=self.learning_rate, beta1=0.9, beta2=0.999, epsilon=1e-8).minimize(self.loss)
+                optimizer = tf.train.AdamOptimizer(learning_rate=self.learning_rate, beta1=0.9, beta2=0.999, epsilon=1e-8)
             elif self.optimizer_type == 'AdagradOptimizer':
-                self.optimizer = tf.train.AdagradOptimizer(learning_rate=self.learning_rate, initial_accumulator_value=1e-8).minimize(self.loss)
+                optimizer = tf.train.AdagradOptimizer(learning_rate=self.learning_rate, initial_accumulator_value=1e-8)
             elif self.optimizer_type == 'GradientDescentOptimizer':
-                self.optimizer = tf.train.GradientDescentOptimizer(learning_rate=self.learning_rate).minimize(self.loss)
+                optimizer = tf.train.GradientDescentOptimizer(learning_rate=self.learning_rate)
             elif self.optimizer_type == 'MomentumOptimizer':
-                self.optimizer = tf.train.MomentumOptimizer(learning_rate=self.learning_rate, momentum=0.95).minimize(self.loss)
+                optimizer = tf.train.MomentumOptimizer(learning_rate=self.learning_rate, momentum=0.95)
+            if self.towers > 1:
+                # each tower fits a slice of the batch, the loss of the whole batch is their sum
+                self.optimizer, self.train_loss = data_parallel(optimizer, self._tower_loss, self.train_features, self.train_labels, self.towers)
+            else:
+                self.optimizer, self.train_loss = optimizer.minimize(self.loss), self.loss
 
             # init
             self.saver = tf.train.Saver()
+            self.checkpoint = TrainingCheckpoint(self.save_file, 'ifm')
+            self.best = BestCheckpoint(self.save_file, 'ifm')
             init = tf.global_variables_initializer()
             self.sess = self._init_session()
             self.sess.run(init)
@@ -206,12 +210,59 @@ class AFM(BaseEstimator, TransformerMixin):
             if self.verbose > 0:
                 print("#params: %d" % total_parameters)
     
+    def _forward(self, features, labels):
+        '''
+        IFM prediction of a batch, None * 1
+        '''
+        num_interactions = self.num_interactions
+        nonzero_embeddings = tf.nn.embedding_lookup(self.weights['feature_embeddings'], features) # None * M' * K
+        
+        element_wise_product, field_interactions = self.pairwise_interactions(nonzero_embeddings, self.weights['interaction'])
+        interactions = tf.reduce_sum(element_wise_product, 2, name="interactions")
+        # _________ MLP Layer / attention part _____________
+        if self.attention:
+            attention_mul = tf.reshape(tf.matmul(tf.reshape(element_wise_product, shape=[-1, self.hidden_factor[1]]), \
+                self.weights['attention_W']), shape=[-1, num_interactions, self.hidden_factor[0]])
+            attention_mul = attention_mul / self.temp
+            attention_exp = tf.exp(tf.reduce_sum(tf.multiply(self.weights['attention_p'], tf.nn.relu(attention_mul + \
+                self.weights['attention_b'])), 2, keep_dims=True)) # None * (M'*(M'-1)) * 1
+            attention_sum = tf.reduce_sum(attention_exp, 1, keep_dims=True) # None * 1 * 1
+            attention_out = tf.div(attention_exp, attention_sum, name="attention_out") # None * (M'*(M'-1)) * 1
+            attention_out = tf.nn.dropout(attention_out, self.dropout_keep[0]) # dropout
+        
+        # _________ Attention-aware Pairwise Interaction Layer _____________
+ 
+        AFM = attention_out * element_wise_product
+        AFM = tf.reshape(AFM, [-1, num_interactions * self.hidden_factor[1]])
+        AFM = tf.nn.dropout(AFM, self.dropout_keep[1]) # dropout
+        
+        attention_interaction = tf.matmul(field_interactions, self.weights['factor'])
+        attention_interaction = tf.reshape(attention_interaction, [num_interactions * self.hidden_factor[1], 1])
+        AFM = tf.tensordot(AFM, attention_interaction, axes=1)
+        AFM = tf.reduce_sum(AFM, reduction_indices=[1])
+         
+        Bilinear = tf.expand_dims(AFM, -1)
+        Feature_bias = tf.reduce_sum(tf.nn.embedding_lookup(self.weights['feature_bias'], features) , 1)  # None * 1
+        Bias = self.weights['bias'] * tf.ones_like(labels)  # None * 1
+        return tf.add_n([Bilinear, Feature_bias, Bias], name="out_afm")  # None * 1
+
+    def _loss(self, labels, out, scale=1.0):  # square loss, the regularizers weighted by scale
+        if self.lamda_attention > 0:
+            loss = tf.nn.l2_loss(tf.subtract(labels, out)) + tf.contrib.layers.l2_regularizer(self.lamda_attention * scale)(self.weights['attention_W'])  # regulizer
+        else:
+            loss = tf.nn.l2_loss(tf.subtract(labels, out))
+            
+        if self.lamda_attention1 > 0:
+            loss += tf.contrib.layers.l2_regularizer(self.lamda_attention1 * scale)(self.weights['interaction']) \
+                        + tf.contrib.layers.l2_regularizer(self.lamda_attention1 * scale)(self.weights['factor'])
+        return loss
+
+    def _tower_loss(self, features, labels):  # loss of one slice of the batch, the towers share the regularizers
+        return self._loss(labels, self._forward(features, labels), 1.0 / self.towers)
+
     def _init_session(self):
-        # adaptively growing video memory
-        # config = tf.ConfigProto()
-        # config.gpu_options.allow_growth = True
-        # return tf.Session()
-        return tf.Session()
+        # adaptively growing video memory, thread pools of --intra_op_threads and --inter_op_threads
+        return tf.Session(config=session_config(self.intra_op_threads, self.inter_op_threads))
 
     def _initialize_weights(self):
         all_weights = dict()
@@ -222,14 +273,8 @@ class AFM(BaseEstimator, TransformerMixin):
             # if self.micro_level_analysis:
             from_file = self.save_file
             print("load from {}".format(from_file))
-            weight_saver = tf.train.import_meta_graph(from_file + '.meta')
-            pretrain_graph = tf.get_default_graph()
-            feature_embeddings = pretrain_graph.get_tensor_by_name('feature_embeddings:0')
-            feature_bias = pretrain_graph.get_tensor_by_name('feature_bias:0')
-            bias = pretrain_graph.get_tensor_by_name('bias:0')
-            with self._init_session() as sess:
-                weight_saver.restore(sess, from_file)
-                fe, fb, b = sess.run([feature_embeddings, feature_bias, bias])
+            # read by name from the checkpoint, grown when the vocabulary gained features since
+            fe, fb, b = load_embeddings(from_file, self.features_M, self.random_seed)
             # all_weights['feature_embeddings'] = tf.Variable(fe, dtype=tf.float32, name='feature_embeddings')
             all_weights['feature_embeddings'] = tf.Variable(fe, dtype=tf.float32, name='feature_embeddings', trainable=trainable)
             all_weights['feature_bias'] = tf.Variable(fb, dtype=tf.float32, name='feature_bias', trainable=trainable)
@@ -260,6 +305,18 @@ class AFM(BaseEstimator, TransformerMixin):
 
         return all_weights
 
+    def pairwise_interactions(self, nonzero_embeddings, interaction):
+        '''
+        products of every pair (i < j) of the first valid_dimension fields, in row-major order as in
+        model/scorer.py: one gather per side of the pairs and a single multiply
+        :return: element_wise_product None * (M'*(M'-1)/2) * K and field_interactions (M'*(M'-1)/2) * t
+        '''
+        rows, cols = np.triu_indices(self.valid_dimension, 1)
+        element_wise_product = tf.multiply(tf.gather(nonzero_embeddings, rows, axis=1), tf.gather(nonzero_embeddings, cols, axis=1),
+                                           name="element_wise_product")
+        field_interactions = tf.multiply(tf.gather(interaction, rows), tf.gather(interaction, cols))
+        return element_wise_product, field_interactions
+
     def batch_norm_layer(self, x, train_phase, scope_bn):
         bn_train = batch_norm(x, decay=self.decay, center=True, scale=True, updates_collections=None,
             is_training=True, reuse=None, trainable=True, scope=scope_bn)
@@ -270,137 +327,97 @@ class AFM(BaseEstimator, TransformerMixin):
 
     def partial_fit(self, data):  # fit a batch
         feed_dict = {self.train_features: data['X'], self.train_labels: data['Y'], self.dropout_keep: self.keep, self.train_phase: True}
-        loss, opt = self.sess.run((self.loss, self.optimizer), feed_dict=feed_dict)
+        loss, opt = self.sess.run((self.train_loss, self.optimizer), feed_dict=feed_dict)
         return loss
 
-    def get_random_block_from_data(self, data, batch_size):  # generate a random block of training data
-        start_index = np.random.randint(0, len(data['Y']) - batch_size)
-        X , Y = [], []
-        # forward get sample
-        i = start_index
-        while len(X) < batch_size and i < len(data['X']):
-            if len(data['X'][i]) == len(data['X'][start_index]):
-                Y.append([data['Y'][i]])
-                X.append(data['X'][i])
-                i = i + 1
-            else:
-                break
-        # backward get sample
-        i = start_index
-        while len(X) < batch_size and i >= 0:
-            if len(data['X'][i]) == len(data['X'][start_index]):
-                Y.append([data['Y'][i]])
-                X.append(data['X'][i])
-                i = i - 1
-            else:
-                break
-        return {'X': X, 'Y': Y}
-    
-    def get_ordered_block_from_data(self, data, batch_size, index):  # generate a ordered block of data
-        start_index = index*batch_size
-        X , Y = [], []
-        # get sample
-        i = start_index
-        while len(X) < batch_size and i < len(data['X']):
-            if len(data['X'][i]) == len(data['X'][start_index]):
-                Y.append(data['Y'][i])
-                X.append(data['X'][i])
-                i = i + 1
-            else:
-                break
-        return {'X': X, 'Y': Y}
-
-    def shuffle_in_unison_scary(self, a, b): # shuffle two lists simutaneously
-        rng_state = np.random.get_state()
-        np.random.shuffle(a)
-        np.random.set_state(rng_state)
-        np.random.shuffle(b)
-
     def train(self, Train_data, Validation_data, Test_data):  # fit a dataset
+        # continue an interrupted run from its latest snapshot
+        start_epoch = 0
+        if self.resume:
+            state = self.checkpoint.restore(self.sess)
+            if state is not None:
+                start_epoch = state['epoch']
+                self.train_rmse, self.valid_rmse, self.test_rmse = state['train_rmse'], state['valid_rmse'], state['test_rmse']
+                self.eval_epochs = state['eval_epochs']
+                self.stopping.load(state['stopping'])
+                print("Resume after epoch %d" % start_epoch)
+
+        # the train RMSE is followed on a fixed sample, the batches cover the whole set
+        train_sample = self.schedule.train_subset(Train_data)
+
         # Check Init performance
-        if self.verbose > 0:
+        if self.verbose > 0 and start_epoch == 0:
             t2 = time()
-            init_train = self.evaluate(Train_data)
+            init_train = self.evaluate(train_sample)
             init_valid = self.evaluate(Validation_data)
-            init_test  = self.evaluate(Test_data)
+            init_test  = self.evaluate(Test_data) if self.schedule.eval_test else float('nan')
             print(("Init: \t train=%.4f, validation=%.4f, test=%.4f [%.1f s]" %(init_train, init_valid, init_test, time()-t2)))
 
-
-        for epoch in range(self.epoch):
+        # with towers, the tail of the epoch is merged into the last full batch: never an empty tower slice
+        batcher = Batcher(Train_data, self.batch_size, min_batch=self.towers)
+        for epoch in range(start_epoch, self.epoch):
             t1 = time()
-            self.shuffle_in_unison_scary(Train_data['X'], Train_data['Y'])
-            total_batch = int(len(Train_data['Y']) / self.batch_size)
-            for i in range(total_batch):
-                # generate a batch
-                batch_xs = self.get_random_block_from_data(Train_data, self.batch_size)
+            for batch_xs in batcher: # shuffled batches covering the whole training set
                 # Fit training
                 self.partial_fit(batch_xs)
             t2 = time()
-
-            # evaluate training and validation datasets
-            train_result = self.evaluate(Train_data)
-            valid_result = self.evaluate(Validation_data)
-            test_result  = self.evaluate(Test_data)
-
-            self.train_rmse.append(train_result)
-            self.valid_rmse.append(valid_result)
-            self.test_rmse.append(test_result)
-            if self.verbose > 0 and epoch%self.verbose == 0:
-                print(("Epoch %d [%.1f s]\ttrain=%.4f, validation=%.4f, Test=%.4f [%.1f s]"
-                      %(epoch+1, t2-t1, train_result, valid_result, test_result, time()-t2)))
-
-            # test_result = self.evaluate(Test_data)
-            # print("Epoch %d [%.1f s]\ttest=%.4f [%.1f s]"
-            #       %(epoch+1, t2-t1, test_result, time()-t2))
-            if self.eva_termination(self.valid_rmse):
+            if self.schedule.evaluate_at(epoch + 1):
+                # output validation
+                train_result = self.evaluate(train_sample)
+                valid_result = self.evaluate(Validation_data)
+                test_result  = self.evaluate(Test_data) if self.schedule.eval_test else float('nan')
+
+                self.train_rmse.append(train_result)
+                self.valid_rmse.append(valid_result)
+                self.test_rmse.append(test_result)
+                self.eval_epochs.append(epoch + 1)
+                if self.stopping.update(valid_result, epoch + 1):
+                    self.best.save(self.sess)
+
+                if self.verbose > 0 and epoch%self.verbose == 0:
+                    print(("Epoch %d [%.1f s]\ttrain=%.4f, validation=%.4f, Test=%.4f [%.1f s]"
+                          %(epoch+1, t2-t1, train_result, valid_result, test_result, time()-t2)))
+            elif self.verbose > 0 and epoch%self.verbose == 0:
+                print(("Epoch %d [%.1f s]" %(epoch+1, t2-t1)))
+            if self.checkpoint_every and (epoch + 1) % self.checkpoint_every == 0:
+                self.checkpoint.save(self.sess, epoch + 1, {'train_rmse': self.train_rmse, 'valid_rmse': self.valid_rmse, 'test_rmse': self.test_rmse,
+                                                            'eval_epochs': self.eval_epochs, 'stopping': self.stopping.state()})
+            if self.stopping.stop:
+                print(("Early stop after epoch %d, no improvement in %d evaluations" %(epoch+1, self.stopping.wait)))
                 break
 
+        # keep the weights of the best validation, not of the last epoch
+        best = self.best_index()
+        if best is not None:
+            self.best.restore(self.sess)
+            if not self.schedule.eval_test:
+                self.test_rmse[best] = self.evaluate(Test_data)
         if self.pretrain_flag < 0 or self.pretrain_flag == 2:
             print("Save model to file as pretrain.")
             self.saver.save(self.sess, self.save_file)
 
-    def eva_termination(self, valid):
-        if len(valid) > 5:
-            if valid[-1] > valid[-2] and valid[-2] > valid[-3] and valid[-3] > valid[-4] and valid[-4] > valid[-5]:
-                return True
-        return False
-
-    def evaluate(self, data):  # evaluate the results for an input set
-        num_example = len(data['Y'])
-        # fetch the first batch
-        batch_index = 0
-        batch_xs = self.get_ordered_block_from_data(data, self.batch_size, batch_index)
-        # batch_xs = data
-        y_pred = None
-        # if len(batch_xs['X']) > 0:
-        while len(batch_xs['X']) > 0:
-            num_batch = len(batch_xs['Y'])
-            feed_dict = {self.train_features: batch_xs['X'], self.train_labels: [[y] for y in batch_xs['Y']], self.dropout_keep: list(1.0 for i in range(len(self.keep))), self.train_phase: False}
-            a_exp, a_sum, a_out, batch_out = self.sess.run((self.attention_exp, self.attention_sum, self.attention_out, self.out), feed_dict=feed_dict)
-            
-            if batch_index == 0:
-                y_pred = np.reshape(batch_out, (num_batch,))
-            else:
-                y_pred = np.concatenate((y_pred, np.reshape(batch_out, (num_batch,))))
-            # fetch the next batch
-            batch_index += 1
-            batch_xs = self.get_ordered_block_from_data(data, self.batch_size, batch_index)
-        
-#         field_out, batch_out = self.sess.run((self.attention_interaction, self.out), feed_dict=feed_dict)
-#         analysis = np.reshape(field_out, [self.num_interactions, self.hidden_factor[1]])
-#         analysis = np.square(analysis)
-#         analysis = np.sum(analysis, axis=1)
-#         print(analysis)
-        y_true = np.reshape(data['Y'], (num_example,))
-
-        predictions_bounded = np.maximum(y_pred, np.ones(num_example) * min(y_true))  # bound the lower values
-        predictions_bounded = np.minimum(predictions_bounded, np.ones(num_example) * max(y_true))  # bound the higher values
-#         accuracy = accuracy_score(y_true, predictions_bounded > 0.5)
-#         return accuracy
+    def best_index(self):  # position of the restored best evaluation in the metric lists, None when nothing was evaluated
+        if self.stopping.best_epoch is None:
+            return None
+        return self.eval_epochs.index(self.stopping.best_epoch)
+
+    def restore(self, save_file):  # warm start from every variable of a trained checkpoint, feature rows grown to features_M
+        restored = restore_variables(self.sess, save_file, self.random_seed)
+        if self.verbose > 0:
+            print("restored %d variables from %s" % (len(restored), save_file))
+
+    def evaluate(self, data):  # evaluate the results for an input set, chunk by chunk
+        return streaming_rmse(self.predict_chunk, data, self.eval_chunk_size)
 #         AUC = roc_auc_score(y_true, predictions_bounded)
 #         return AUC
-        RMSE = math.sqrt(mean_squared_error(y_true, predictions_bounded))
-        return RMSE
+
+    def predict(self, X):  # predictions for all rows of X, written into a preallocated buffer
+        return predict_chunked(self.predict_chunk, X, self.eval_chunk_size)
+
+    def predict_chunk(self, X):
+        # labels only give the shape of the bias term
+        feed_dict = {self.train_features: X, self.train_labels: np.zeros((len(X), 1)), self.dropout_keep: [1.0] * len(self.keep), self.train_phase: False}
+        return self.sess.run(self.out, feed_dict=feed_dict)
 
 def make_save_file(args):
     pretrain_path = '../pretrain/fm_%s_%d' %(args.dataset, eval(args.hidden_factor)[1])
@@ -415,6 +432,23 @@ def make_save_file(args):
     print(save_file)
     return save_file
 
+def activation(name):
+    activation_function = tf.nn.relu
+    if name == 'sigmoid':
+        activation_function = tf.sigmoid
+    elif name == 'tanh':
+        activation_function = tf.tanh
+    elif name == 'identity':
+        activation_function = tf.identity
+    return activation_function
+
+def make_model(args, features_M, num_variable, save_file, pretrain_flag=None, epoch=None):
+    '''AFM with the settings of args; pretrain_flag and epoch default to args.pretrain and args.epoch'''
+    return AFM(features_M, args.pretrain if pretrain_flag is None else pretrain_flag, save_file, args.attention, eval(args.hidden_factor), args.valid_dimen,
+        activation(args.activation), num_variable, args.freeze_fm, args.epoch if epoch is None else epoch, args.batch_size, args.lr, args.lamda_attention, args.lamda_attention1, args.kf, args.temp, eval(args.keep), args.optimizer,
+        args.batch_norm, args.decay, args.verbose, args.mla, args.eval_chunk_size, args.checkpoint_every, args.resume, args.patience, args.min_delta, args.valid_every, args.train_sample, args.eval_test,
+        args.towers, args.intra_op_threads, args.inter_op_threads)
+
 def train(args):
     # Data loading
     data = DATA.LoadData(args.path, args.dataset)
@@ -422,13 +456,6 @@ def train(args):
         print(("IFM: dataset=%s, factors=%s, attention=%d, freeze_fm=%d, #epoch=%d, batch=%d, lr=%.4f, lambda_attention=%.1e, lambda_attention1=%.1e, kf=%d, temp=%.1e, keep=%s, optimizer=%s, batch_norm=%d, decay=%f, activation=%s"
               %(args.dataset, args.hidden_factor, args.attention, args.freeze_fm, args.epoch, args.batch_size, args.lr, args.lamda_attention, args.lamda_attention1, args.kf, args.temp, args.keep, args.optimizer, 
               args.batch_norm, args.decay, args.activation)))
-    activation_function = tf.nn.relu
-    if args.activation == 'sigmoid':
-        activation_function = tf.sigmoid
-    elif args.activation == 'tanh':
-        activation_function == tf.tanh
-    elif args.activation == 'identity':
-        activation_function = tf.identity
     
     save_file = make_save_file(args)
     # Training
@@ -437,18 +464,40 @@ def train(args):
     num_variable = data.truncate_features()
     if args.mla:
         args.freeze_fm = 1
-    model = AFM(data.features_M, args.pretrain, save_file, args.attention, eval(args.hidden_factor), args.valid_dimen, 
-        activation_function, num_variable, args.freeze_fm, args.epoch, args.batch_size, args.lr, args.lamda_attention, args.lamda_attention1, args.kf, args.temp, eval(args.keep), args.optimizer, 
-        args.batch_norm, args.decay, args.verbose, args.mla)
+    model = make_model(args, data.features_M, num_variable, save_file)
     
     model.train(data.Train_data, data.Validation_data, data.Test_data)
     
-    # Find the best validation result across iterations
-    best_valid_score = 0
-    best_valid_score = min(model.valid_rmse)
-    best_epoch = model.valid_rmse.index(best_valid_score)
-    print(("Best Iter(validation)= %d\t train = %.4f, valid = %.4f Test = %.4f [%.1f s]" 
-           %(best_epoch+1, model.train_rmse[best_epoch], model.valid_rmse[best_epoch], model.test_rmse[best_epoch], time()-t1)))
+    # the best validation result across iterations, the weights the model holds
+    best = model.best_index()
+    if best is None:
+        print("No validation in %d epochs, nothing to report [%.1f s]" % (model.epoch, time()-t1))
+    else:
+        print(("Best Iter(validation)= %d\t train = %.4f, valid = %.4f Test = %.4f [%.1f s]"
+               %(model.eval_epochs[best], model.train_rmse[best], model.valid_rmse[best], model.test_rmse[best], time()-t1)))
+
+def incremental(args):
+    '''refresh the trained IFM with new interactions only: restore the latest checkpoint, grown to the
+    vocabulary extended by the new data, and train `passes` epochs over the new data'''
+    save_file = make_save_file(args)
+    vocabulary_file = args.path + args.dataset + '/' + args.dataset + '.vocabulary.json'
+    if not os.path.exists(vocabulary_file):
+        # an empty vocabulary would number the new features from 0, over the trained rows
+        raise ValueError('No feature vocabulary %s for the trained dataset, load --dataset %s once to write it'
+                         % (vocabulary_file, args.dataset))
+    data = DATA.LoadData(args.path, args.new_dataset, vocabulary_file=vocabulary_file)
+    num_variable = data.truncate_features()
+    t1 = time()
+    # random initialization, every variable found in the checkpoint is then overwritten
+    model = make_model(args, data.features_M, num_variable, save_file, pretrain_flag=-1, epoch=args.passes)
+    model.restore(save_file)
+    model.train(data.Train_data, data.Validation_data, data.Test_data)
+    best = model.best_index()
+    if best is None:
+        print("Incremental update on %d new samples, no validation in %d passes [%.1f s]" % (len(data.Train_data['Y']), args.passes, time()-t1))
+    else:
+        print(("Incremental update on %d new samples: train = %.4f, valid = %.4f, Test = %.4f [%.1f s]"
+               %(len(data.Train_data['Y']), model.train_rmse[best], model.valid_rmse[best], model.test_rmse[best], time()-t1)))
 
 def evaluate(args):
     # load test data
@@ -531,54 +580,47 @@ def evaluate(args):
 #                           ao[_id][2], inter[_id][2], y_pred_afm[_id])))
 
 
-def infer(path, dataset, pretrain_path, data_instance, k):
-    # save_file = make_save_file(args)
-    # data_instance = [2, 1, 'morning', 'monday', 'workday', 'home', 'sunny', 'Spain', 0]
-    data = DATA.LoadData(path, dataset).convertData(data_instance)
+class SessionPredictor(Predictor):
+    '''IFM predictor holding one restored graph and session for the lifetime of the process
+    :param pretrain_path: checkpoint prefix, e.g. ../pretrain/fm_frappe_256/frappe_256
+    :param encoder: FeatureEncoder used to encode request instances
+    '''
 
+    def __init__(self, pretrain_path, encoder):
+        Predictor.__init__(self, encoder)
+        # import the graph into a private graph so repeated loads never grow the default graph
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            weight_saver = tf.train.import_meta_graph(pretrain_path + '.meta')
+            self.sess = tf.Session(graph=self.graph)
+            weight_saver.restore(self.sess, pretrain_path)
+
+        self.out_of_afm = self.graph.get_tensor_by_name('out_afm:0')
+        # placeholders for afm
+        self.train_features_afm = self.graph.get_tensor_by_name('train_features_afm:0')
+        self.train_labels_afm = self.graph.get_tensor_by_name('train_labels_afm:0')
+        self.dropout_keep_afm = self.graph.get_tensor_by_name('dropout_keep_afm:0')
+        self.train_phase_afm = self.graph.get_tensor_by_name('train_phase_afm:0')
+        # nothing is added to the graph after loading; Session.run is thread-safe on a finalized graph
+        self.graph.finalize()
+
+    def predict(self, X):
+        # labels are only used for their shape (Bias = bias * ones_like(labels))
+        feed_dict = {self.train_features_afm: X, self.train_labels_afm: np.zeros((len(X), 1)), 
+                     self.dropout_keep_afm: [1.0,1.0], self.train_phase_afm: False}
+        predictions = self.sess.run((self.out_of_afm), feed_dict=feed_dict)
+        return predictions.flatten()
+
+    def close(self):
+        self.sess.close()
 
-    # save_file = make_save_file(args)
-    # print("savefile: " ,save_file)
-    # load the graph
-    weight_saver = tf.train.import_meta_graph(pretrain_path + '.meta')
-    pretrain_graph = tf.get_default_graph()
-    sess = tf.Session()
-    weight_saver.restore(sess, pretrain_path)
-    
-    out_of_afm = pretrain_graph.get_tensor_by_name('out_afm:0')
-    # interactions = pretrain_graph.get_tensor_by_name('interactions:0')
-    # attention_out = pretrain_graph.get_tensor_by_name('attention_out:0')
-    # placeholders for afm
-    train_features_afm = pretrain_graph.get_tensor_by_name('train_features_afm:0')
-    train_labels_afm = pretrain_graph.get_tensor_by_name('train_labels_afm:0')
-    dropout_keep_afm = pretrain_graph.get_tensor_by_name('dropout_keep_afm:0')
-    train_phase_afm = pretrain_graph.get_tensor_by_name('train_phase_afm:0')
-
-    # num_example = len(data['Y'])
-
-    feed_dict = {train_features_afm: data['X'], train_labels_afm: [[y] for y in data['Y']], dropout_keep_afm: [1.0,1.0], train_phase_afm: False}
-    predictions = sess.run((out_of_afm), feed_dict=feed_dict)
-
-    # print(predictions)
-    
-    predictions = predictions.flatten()
-
-    # Compute the absolute difference from 1
-    abs_diff_from_1 = np.abs(1 - predictions)
-
-    # Get the indices of the top 10 smallest differences
-    top_k_indices = np.argsort(abs_diff_from_1)[:k]
-
-    # print("Top 10 indices closest to 1:", top_10_indices)
-    # Get the top 10 predictions
-    # top_10_predictions = predictions[top_10_indices]
-
-    # print("Top 10 predictions closest to 1:", top_10_predictions)
-
-    # closest_to_1 = [(x[1], pred) for x, pred in zip(data['X'][:10], top_10_predictions) if pred >= 0.9]
-    # print(closest_to_1)
-    # return predictions
 
+def infer(path, dataset, pretrain_path, data_instance, k):
+    # one-shot helper for scripts; long running processes should keep a SessionPredictor instead
+    encoder = load_encoder(path + dataset + '/' + dataset + '.encoder.json')
+    predictor = SessionPredictor(pretrain_path, encoder)
+    top_k_indices = predictor.top_k(data_instance[0], data_instance[2:], k)
+    predictor.close()
     return top_k_indices
 
 if __name__ == '__main__':
@@ -597,6 +639,8 @@ if __name__ == '__main__':
         train(args)
     elif args.process == 'evaluate':
         evaluate(args)
+    elif args.process == 'incremental':
+        incremental(args)
     elif args.process == 'infer':
         infer(args)
         
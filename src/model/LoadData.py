@@ -5,81 +5,183 @@ Data pre process for AFM and FM
 Lizi Liao (liaolizi.llz@gmail.com)
 Xiangnan He (xiangnanhe@gmail.com)
 '''
+import argparse
+import json
 import numpy as np
 import os
-import pandas as pd
-from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+# Persistent, append-only feature vocabulary
+#
+# LoadData maps every libfm token ("c:1") to a feature id, which is a row of feature_embeddings.
+# The vocabulary keeps that mapping on disk: new tokens of a daily increment get the next free ids and
+# the ids of known tokens never change, so a checkpoint trained on an older version stays valid and
+# only needs its embedding rows grown (see model/checkpoint.py). Every growth bumps the version.
+# file (json): {"version": 3, "features": {"12:1": 0, ...}, "history": [{"version": 1, "size": 5382}, ...]}
+
+def libfm_tokens(file):
+    with open(file) as f:
+        for line in f:
+            for token in line.strip().split(' ')[1:]:
+                yield token
+
+class FeatureVocabulary(object):
+    '''token -> feature id, ids are never renumbered
+    :param file: json file of the vocabulary, created by save()
+    '''
+
+    def __init__(self, file=None, features=None, version=0, history=None):
+        self.file = file
+        self.features = features if features is not None else {}
+        self.version = version
+        self.history = history if history is not None else []
+
+    @classmethod
+    def load(cls, file):  # the saved vocabulary, or an empty one when the file does not exist yet
+        if not os.path.exists(file):
+            return cls(file)
+        with open(file) as f:
+            vocabulary = json.load(f)
+        return cls(file, vocabulary['features'], vocabulary['version'], vocabulary['history'])
+
+    @classmethod
+    def from_features(cls, file, features):  # version 1 of an existing token -> id mapping, e.g. a features.json
+        return cls(file, dict(features), 1, [{'version': 1, 'size': len(features)}])
+
+    def save(self, file=None):
+        self.file = file or self.file
+        # write then rename, a crash never leaves a truncated vocabulary
+        with open(self.file + '.tmp', 'w') as f:
+            json.dump({'version': self.version, 'features': self.features, 'history': self.history}, f)
+        os.replace(self.file + '.tmp', self.file)
+
+    def __len__(self):
+        return len(self.features)
+
+    def add(self, tokens):
+        '''append the unknown tokens with the next ids; return the number of new tokens'''
+        size = len(self.features)
+        for token in tokens:
+            if token not in self.features:
+                self.features[token] = len(self.features)
+        added = len(self.features) - size
+        if added or not self.history:
+            self.version += 1
+            self.history.append({'version': self.version, 'size': len(self.features)})
+        return added
+
+    def add_libfm(self, files):  # tokens of libfm files, in order of appearance
+        return self.add(token for file in files for token in libfm_tokens(file))
+
+    def size_at(self, version):  # number of features of an earlier version
+        for entry in self.history:
+            if entry['version'] == version:
+                return entry['size']
+        raise ValueError('Unknown vocabulary version %d' % version)
+
 
 class LoadData(object):
     '''given the path of data, return the data format for AFM and FM
     :param path
+    :param binary: read the .npy files written by save_binary() when they exist
+    :param mmap_mode: passed to np.load for the binary files, 'r' maps them read-only
+    :param vocabulary_file: feature vocabulary to map the libfm files with, default <dataset>.vocabulary.json;
+        an increment of new interactions passes the vocabulary of the dataset it extends
     return:
-    Train_data: a dictionary, 'Y' refers to a list of y values; 'X' refers to a list of features_M dimension vectors with 0 or 1 entries
+    Train_data: a dictionary, 'Y' refers to a float32 array of y values; 'X' refers to an int32 array of feature indexes, one row per sample
     Test_data: same as Train_data
     Validation_data: same as Train_data
     '''
 
     # Three files are needed in the path
-    def __init__(self, path, dataset, loss_type="square_loss"):
+    def __init__(self, path, dataset, loss_type="square_loss", binary=True, mmap_mode='r', vocabulary_file=None):
+        self.dataset = dataset
         self.path = path + dataset + "/"
         self.trainfile = self.path + dataset +".train.libfm"
         self.testfile = self.path + dataset + ".test.libfm"
         self.validationfile = self.path + dataset + ".validation.libfm"
-        self.features_M = self.map_features( )
-        self.Train_data, self.Validation_data, self.Test_data = self.construct_data( loss_type )
+        self.encoderfile = self.path + dataset + ".encoder.json"
+        self.featurefile = self.path + dataset + ".features.json"
+        self.vocabularyfile = vocabulary_file if vocabulary_file else self.path + dataset + ".vocabulary.json"
+        self.mmap_mode = mmap_mode
+        if binary and self.has_binary():
+            self.features_M = self.load_features()
+            self.Train_data, self.Validation_data, self.Test_data = self.load_binary( loss_type )
+        else:
+            self.features_M = self.map_features( )
+            self.Train_data, self.Validation_data, self.Test_data = self.construct_data( loss_type )
+
+    def binary_file(self, name, part): # e.g. frappe.train.X.npy
+        return self.path + self.dataset + ".%s.%s.npy" % (name, part)
+
+    def has_binary(self):
+        files = [self.featurefile] + [self.binary_file(name, part) for name in ['train', 'validation', 'test'] for part in ['X', 'Y']]
+        return all(os.path.exists(file) for file in files)
+
+    def load_features(self):
+        # the binaries hold the ids of the vocabulary they were converted with; ids are never renumbered,
+        # so they stay valid when the vocabulary grew since, and features_M is the size of the vocabulary
+        with open(self.featurefile) as f:
+            features = json.load(f)
+        if os.path.exists(self.vocabularyfile):
+            vocabulary = FeatureVocabulary.load(self.vocabularyfile)
+            if any(vocabulary.features.get(token) != feature for token, feature in features.items()):
+                raise ValueError('%s does not match the feature vocabulary %s, convert the libfm files again'
+                                 % (self.featurefile, self.vocabularyfile))
+        else:
+            # binaries written before the vocabulary existed: it starts from their features
+            vocabulary = FeatureVocabulary.from_features(self.vocabularyfile, features)
+            vocabulary.save()
+        self.vocabulary_version = vocabulary.version
+        self.features = vocabulary.features
+        return len(self.features)
+
+    def load_binary(self, loss_type):
+        datasets = []
+        for name in ['train', 'validation', 'test']:
+            Y_ = np.load(self.binary_file(name, 'Y'), mmap_mode=self.mmap_mode)
+            if loss_type == 'log_loss':
+                Y_ = (Y_ > 0).astype(np.float32) # > 0 as 1; others as 0
+            datasets.append({'X': np.load(self.binary_file(name, 'X'), mmap_mode=self.mmap_mode), 'Y': Y_})
+        return datasets
+
+    def save_binary(self):
+        # one-time conversion of the parsed libfm files: int32 feature matrix + float32 labels per set
+        for name, data in [('train', self.Train_data), ('validation', self.Validation_data), ('test', self.Test_data)]:
+            if data['X'].dtype == object:
+                raise ValueError('The binary format needs the same number of features in every row')
+            np.save(self.binary_file(name, 'X'), data['X'])
+            np.save(self.binary_file(name, 'Y'), data['Y'])
+        with open(self.featurefile, 'w') as f:
+            json.dump(self.features, f)
 
     def map_features(self): # map the feature entries in all files, kept in self.features dictionary
-        self.features = {}
-        self.read_features(self.trainfile)
-        self.read_features(self.testfile)
-        self.read_features(self.validationfile)
+        # the ids of known features are kept, new features of the files are appended (see FeatureVocabulary)
+        vocabulary = FeatureVocabulary.load(self.vocabularyfile)
+        added = vocabulary.add_libfm([self.trainfile, self.testfile, self.validationfile])
+        if added:
+            vocabulary.save()
+            print("Feature vocabulary version %d: %d features (%d new)" % (vocabulary.version, len(vocabulary), added))
+        self.vocabulary_version = vocabulary.version
+        self.features = vocabulary.features
         # print("features_M:", len(self.features))
         return  len(self.features)
 
-    def read_features(self, file): # read a feature file
-        f = open( file )
-        line = f.readline()
-        i = len(self.features)
-        while line:
-            items = line.strip().split(' ')
-            for item in items[1:]:
-                if item not in self.features:
-                    self.features[ item ] = i
-                    i = i + 1
-            line = f.readline()
-        f.close()
-
     # def load_data():
     #     # Load the dataset
     #     user_data = pd.read_csv('data/raw/frappe_dataset.csv', sep="\t")
     #     return user_data
 
     def convertData(self, data):
-        df = pd.read_csv('../data/raw/frappe_dataset.csv', sep="\t")
-        context_features = ['user','item','daytime', 'weekday', 'isweekend', 'homework', 'weather', 'country', 'city']
-        encoder = OneHotEncoder()
-        encoder.fit(df[context_features])
-        transformed_data = encoder.transform([data])
-        transformed_data = transformed_data.toarray()
-
-        converted_data = []
+        # one row per candidate item; the encoder is built once per process (see model/encoder.py)
+        from model.encoder import load_encoder
+        encoder = load_encoder(self.encoderfile)
+        instance = [value for field, value in zip(encoder.fields, data) if field != 'item']
+        row, slot, candidates = encoder.candidate_row(instance)
 
-        for i in range(len(transformed_data[0])):
-            if transformed_data[0][i] == 1:
-                converted_data.append(i)
-        # print("Converted Data: ", converted_data)
-
-        Y_ = []
-        X_ = []
-        Y_for_logloss = []
-        for i in range(4081):
-            Y_.append(1.0*float(0))
-
-            converted_data[1] = i + 957
-
-            X_.append(converted_data.copy())
-            
-        return self.construct_dataset(X_, Y_)
+        X_ = np.tile(row, (len(candidates), 1))
+        X_[:, slot] = candidates
+        Y_ = np.zeros(len(candidates))
+        return {'X': X_, 'Y': Y_}
 
     def construct_data(self, loss_type):
         X_, Y_ , Y_for_logloss= self.read_data(self.trainfile)
@@ -133,23 +235,48 @@ class LoadData(object):
     def construct_dataset(self, X_, Y_):
         Data_Dic = {}
         X_lens = [ len(line) for line in X_]
-        indexs = np.argsort(X_lens)
-        Data_Dic['Y'] = [ Y_[i] for i in indexs]
-        Data_Dic['X'] = [ X_[i] for i in indexs]
+        indexs = np.argsort(X_lens, kind='stable')
+        Data_Dic['Y'] = np.array(Y_, dtype=np.float32)[indexs]
+        if len(set(X_lens)) <= 1:
+            Data_Dic['X'] = np.array(X_, dtype=np.int32).reshape(len(X_), X_lens[0] if X_ else 0)[indexs]
+        else:
+            # rows of different length are kept as an object array of lists
+            X = np.empty(len(X_), dtype=object)
+            X[:] = X_
+            Data_Dic['X'] = X[indexs]
         return Data_Dic
     
     def truncate_features(self):
         """
         Make sure each feature vector is of the same length
         """
-        num_variable = len(self.Train_data['X'][0])
-        for i in range(len(self.Train_data['X'])):
-            num_variable = min([num_variable, len(self.Train_data['X'][i])])
+        datasets = [self.Train_data, self.Validation_data, self.Test_data]
+        X = self.Train_data['X']
+        if X.dtype == object:
+            num_variable = min(len(row) for row in X)
+        else:  # every row has X.shape[1] features, the memmapped file is not read
+            num_variable = X.shape[1]
         # truncate train, validation and test
-        for i in range(len(self.Train_data['X'])):
-            self.Train_data['X'][i] = self.Train_data['X'][i][0:num_variable]
-        for i in range(len(self.Validation_data['X'])):
-            self.Validation_data['X'][i] = self.Validation_data['X'][i][0:num_variable]
-        for i in range(len(self.Test_data['X'])):
-            self.Test_data['X'][i] = self.Test_data['X'][i][0:num_variable]
+        for data in datasets:
+            if data['X'].dtype == object:
+                data['X'] = np.array([row[0:num_variable] for row in data['X']], dtype=np.int32)
+            else:
+                data['X'] = data['X'][:, 0:num_variable]
         return num_variable
+
+
+#################### Arguments ####################
+def parse_args():
+    parser = argparse.ArgumentParser(description="Convert libfm files to the binary format read by LoadData.")
+    parser.add_argument('--path', nargs='?', default='../data/',
+                        help='Input data path.')
+    parser.add_argument('--dataset', nargs='?', default='frappe',
+                        help='Choose a dataset.')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    data = LoadData(args.path, args.dataset, binary=False)
+    data.save_binary()
+    print("Saved %s: train=%d, validation=%d, test=%d, features_M=%d" 
+          %(args.dataset, len(data.Train_data['Y']), len(data.Validation_data['Y']), len(data.Test_data['Y']), data.features_M))
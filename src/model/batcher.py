@@ -0,0 +1,85 @@
+'''
+Mini-batch iteration for FM and AFM training
+
+Batches are cut from a permutation of the sample indexes with fancy indexing, so every
+epoch covers each sample exactly once, and are assembled in a background thread while
+the session runs the previous batch.
+'''
+import queue
+import threading
+import numpy as np
+
+
+class Batcher(object):
+    '''iterate over a dataset in shuffled mini-batches
+    :param data: dictionary, 'X' an N * M' int array of feature indexes, 'Y' the N labels
+    :param batch_size
+    :param shuffle: draw a new permutation every epoch (from np.random)
+    :param prefetch: number of batches prepared ahead in a background thread, 0 disables prefetching
+    :param min_batch: a last batch smaller than this is merged into the one before, e.g. the number of
+        data-parallel towers, so that no tower gets an empty slice (NaN batch norm moments)
+    '''
+
+    def __init__(self, data, batch_size, shuffle=True, prefetch=2, min_batch=1):
+        if data['X'].dtype == object:
+            raise ValueError('Batcher needs the same number of features in every row, see LoadData.truncate_features')
+        self.X = data['X']
+        self.Y = np.reshape(data['Y'], (-1, 1))
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.prefetch = prefetch
+        self.min_batch = min_batch
+
+    def bounds(self):  # (start, end) of the batches of an epoch
+        ends = list(range(self.batch_size, len(self.Y), self.batch_size)) + [len(self.Y)]
+        if len(ends) > 1 and ends[-1] - ends[-2] < self.min_batch:
+            del ends[-2]
+        return list(zip([0] + ends[:-1], ends))
+
+    def __len__(self):  # number of batches per epoch
+        return len(self.bounds()) if len(self.Y) else 0
+
+    def __iter__(self):  # one epoch
+        if self.prefetch > 0:
+            return prefetch(self.batches(), self.prefetch)
+        return self.batches()
+
+    def batches(self):
+        num_example = len(self.Y)
+        if self.shuffle:
+            indexes = np.random.permutation(num_example)
+        else:
+            indexes = np.arange(num_example)
+        if num_example == 0:
+            return
+        for start, end in self.bounds():
+            batch_indexes = indexes[start:end]
+            yield {'X': self.X[batch_indexes], 'Y': self.Y[batch_indexes]}
+
+
+def prefetch(iterator, size):
+    '''consume `iterator` in a background thread, keeping up to `size` items ready'''
+    items = queue.Queue(maxsize=size)
+    end = object()
+    errors = []
+
+    def produce():
+        try:
+            for item in iterator:
+                items.put(item)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            items.put(end)
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    while True:
+        item = items.get()
+        if item is end:
+            break
+        yield item
+    thread.join()
+    if errors:
+        raise errors[0]
@@ -0,0 +1,186 @@
+'''
+Checkpoint helpers: periodic training snapshots and a growing feature vocabulary
+
+TrainingCheckpoint saves, every few epochs, everything needed to continue an interrupted run: all
+variables of the graph (weights and optimizer slots), the number of finished epochs, the metrics so
+far and the NumPy random state that drives the batch shuffling. BestCheckpoint keeps the weights of
+the best validation RMSE of the run (see training.py). FM and IFM share their save file, so both
+keep their files in per-model directories, train-<model>/ and best-<model>/, and a snapshot records
+the model it was taken of.
+
+When the vocabulary (LoadData.FeatureVocabulary) gains features, the ids of the known features do
+not change, so a trained checkpoint is still valid for them: feature_embeddings and feature_bias
+(and the optimizer slots of both) only need new rows for the new ids. New embedding rows are drawn
+like the random initialization of FM/IFM, new biases are 0.
+
+usage (from src/):
+python -m model.checkpoint --pretrain ../pretrain/fm_frappe_256/frappe_256 --features_M 5500 --out ../pretrain/fm_frappe_256/frappe_256_grown
+'''
+import argparse
+import os
+import pickle
+import numpy as np
+import tensorflow as tf
+
+GROWN_WEIGHTS = ['feature_embeddings', 'feature_bias']
+# standard deviation of the new rows, as in _initialize_weights of FM and IFM
+INIT_STD = {'feature_embeddings': 0.01, 'feature_bias': 0.0}
+# AdagradOptimizer(initial_accumulator_value=1e-8) in FM and IFM, Adam and Momentum slots start at 0
+SLOT_INIT = {'Adagrad': 1e-8}
+
+#################### Arguments ####################
+def parse_args():
+    parser = argparse.ArgumentParser(description="Grow the feature rows of a checkpoint.")
+    parser.add_argument('--pretrain', nargs='?', default='../pretrain/fm_frappe_256/frappe_256',
+                        help='Checkpoint prefix to grow.')
+    parser.add_argument('--features_M', type=int, required=True,
+                        help='New number of features, e.g. the size of the feature vocabulary.')
+    parser.add_argument('--out', nargs='?', default=None,
+                        help='Output checkpoint prefix. Defaults to <pretrain>_grown')
+    return parser.parse_args()
+
+def grow_rows(values, num_rows, std=0.0, fill=0.0, rng=None):
+    '''values with rows appended up to num_rows: N(0, std) when std > 0, `fill` otherwise'''
+    missing = num_rows - values.shape[0]
+    if missing < 0:
+        raise ValueError('Cannot shrink %d feature rows to %d' % (values.shape[0], num_rows))
+    if missing == 0:
+        return values
+    shape = (missing,) + values.shape[1:]
+    if std > 0:
+        rng = rng if rng is not None else np.random.RandomState(2016)
+        rows = rng.normal(0.0, std, shape)
+    else:
+        rows = np.full(shape, fill)
+    return np.concatenate([values, rows.astype(values.dtype)])
+
+def load_embeddings(save_file, features_M, random_seed=2016):
+    '''feature_embeddings, feature_bias and bias of a checkpoint, grown to features_M rows'''
+    reader = tf.train.NewCheckpointReader(save_file)
+    rng = np.random.RandomState(random_seed)
+    fe = reader.get_tensor('feature_embeddings')
+    if fe.shape[0] < features_M:
+        print("grow the pretrained features from %d to %d" % (fe.shape[0], features_M))
+    fe = grow_rows(fe, features_M, INIT_STD['feature_embeddings'], rng=rng)
+    fb = grow_rows(reader.get_tensor('feature_bias'), features_M)
+    return fe, fb, reader.get_tensor('bias')
+
+def grow_checkpoint(save_file, out_file, features_M, random_seed=2016):
+    '''copy of a checkpoint whose feature rows (weights and optimizer slots) are grown to features_M;
+    every other variable is kept as is, so training can resume from it with a larger vocabulary'''
+    reader = tf.train.NewCheckpointReader(save_file)
+    rng = np.random.RandomState(random_seed)
+    graph = tf.Graph()
+    with graph.as_default():
+        variables = {}
+        for name in sorted(reader.get_variable_to_shape_map()):
+            value = reader.get_tensor(name)
+            parts = name.split('/')
+            if parts[0] in GROWN_WEIGHTS:
+                if len(parts) == 1:
+                    value = grow_rows(value, features_M, INIT_STD[name], rng=rng)
+                else:  # optimizer slot, e.g. feature_embeddings/Adagrad
+                    value = grow_rows(value, features_M, fill=SLOT_INIT.get(parts[-1].split('_')[0], 0.0))
+            variables[name] = tf.Variable(value, name=name.replace('/', '_'))
+        # keyed by the original names: the checkpoint restores into the training graph
+        saver = tf.train.Saver(variables)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            saver.save(sess, out_file, write_meta_graph=False)
+
+def restore_variables(sess, save_file, random_seed=2016):
+    '''load every variable of the session's graph found by name in the checkpoint, weights and
+    optimizer slots, growing the feature rows to the size of the graph; return the names restored'''
+    reader = tf.train.NewCheckpointReader(save_file)
+    shapes = reader.get_variable_to_shape_map()
+    rng = np.random.RandomState(random_seed)
+    restored = []
+    for variable in sess.graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES):
+        name = variable.op.name
+        if name not in shapes:
+            continue
+        value = reader.get_tensor(name)
+        parts = name.split('/')
+        num_rows = variable.get_shape().as_list()[0] if value.ndim else None
+        if parts[0] in GROWN_WEIGHTS and num_rows != value.shape[0]:
+            if len(parts) == 1:
+                value = grow_rows(value, num_rows, INIT_STD[name], rng=rng)
+            else:
+                value = grow_rows(value, num_rows, fill=SLOT_INIT.get(parts[-1].split('_')[0], 0.0))
+        variable.load(value, sess)
+        restored.append(name)
+    return restored
+
+
+class TrainingCheckpoint(object):
+    '''periodic snapshots of a training run, in <directory of save_file>/train-<model>/
+    create it inside the graph of the model, the Saver covers every variable defined before
+    :param save_file: the model save file
+    :param model: 'fm' or 'ifm', the snapshots of another model are never restored
+    :param max_to_keep: snapshots kept on disk
+    '''
+
+    def __init__(self, save_file, model, max_to_keep=2):
+        directory, name = os.path.split(save_file)
+        self.model = model
+        self.directory = os.path.join(directory, 'train-' + model)
+        self.prefix = os.path.join(self.directory, name)
+        self.saver = tf.train.Saver(max_to_keep=max_to_keep)
+
+    def save(self, sess, epoch, state):
+        '''snapshot after `epoch` finished epochs; state: picklable dictionary, e.g. the metrics'''
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        path = self.saver.save(sess, self.prefix, global_step=epoch, write_meta_graph=False)
+        state = dict(state, epoch=epoch, model=self.model, np_random_state=np.random.get_state())
+        with open(path + '.state.tmp', 'wb') as f:
+            pickle.dump(state, f)
+        os.replace(path + '.state.tmp', path + '.state')
+        # the Saver deleted the snapshots beyond max_to_keep, drop their state too
+        for file in os.listdir(self.directory):
+            if file.endswith('.state') and os.path.join(self.directory, file[:-len('.state')]) not in self.saver.last_checkpoints:
+                os.remove(os.path.join(self.directory, file))
+
+    def restore(self, sess):
+        '''restore the latest complete snapshot; return its state, None when there is none'''
+        checkpoint = tf.train.get_checkpoint_state(self.directory)
+        if checkpoint is None:
+            return None
+        for path in reversed(checkpoint.all_model_checkpoint_paths):
+            # a snapshot is complete once its state is written
+            if os.path.exists(path + '.state'):
+                with open(path + '.state', 'rb') as f:
+                    state = pickle.load(f)
+                if state.get('model') != self.model:
+                    raise ValueError('%s is a snapshot of %s, not of %s' % (path, state.get('model'), self.model))
+                self.saver.restore(sess, path)
+                np.random.set_state(state['np_random_state'])
+                return state
+        return None
+
+
+class BestCheckpoint(object):
+    '''weights of the best evaluation so far, in <directory of save_file>/best-<model>/
+    create it inside the graph of the model, like TrainingCheckpoint
+    '''
+
+    def __init__(self, save_file, model):
+        directory, name = os.path.split(save_file)
+        self.directory = os.path.join(directory, 'best-' + model)
+        self.prefix = os.path.join(self.directory, name)
+        self.saver = tf.train.Saver(max_to_keep=1)
+
+    def save(self, sess):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        self.saver.save(sess, self.prefix, write_meta_graph=False)
+
+    def restore(self, sess):
+        self.saver.restore(sess, self.prefix)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    out_file = args.out if args.out else args.pretrain + '_grown'
+    grow_checkpoint(args.pretrain, out_file, args.features_M)
+    print("Saved checkpoint with %d features to %s" % (args.features_M, out_file))
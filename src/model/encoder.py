@@ -0,0 +1,164 @@
+'''
+Precompiled one-hot encoding of request instances
+
+The encoder keeps, for every field, a dictionary value -> global feature id with the same
+column layout as sklearn's OneHotEncoder fitted on the raw frappe csv (fields in order,
+sorted categories per field). It is built once offline, saved as json and loaded at startup,
+so encoding a request is one dictionary lookup per field.
+
+usage (from src/):
+python -m model.encoder --csv ../data/raw/frappe_dataset.csv --out ../data/frappe/frappe.encoder.json
+'''
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# fields of a request instance, in feature-row order
+FIELDS = ['user', 'item', 'daytime', 'weekday', 'isweekend', 'homework', 'weather', 'country', 'city']
+
+#################### Arguments ####################
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the feature encoder.")
+    parser.add_argument('--csv', nargs='?', default='../data/raw/frappe_dataset.csv',
+                        help='Raw interaction log.')
+    parser.add_argument('--out', nargs='?', default='../data/frappe/frappe.encoder.json',
+                        help='Output encoder file.')
+    parser.add_argument('--path', nargs='?', default=None,
+                        help='Optional libfm data path; feature ids are then mapped through LoadData.features.')
+    parser.add_argument('--dataset', nargs='?', default='frappe',
+                        help='Dataset of the libfm files.')
+    return parser.parse_args()
+
+class FeatureEncoder(object):
+    '''field -> value -> feature id
+    :param fields: field names in feature-row order
+    :param vocabulary: dict field -> dict str(value) -> feature id
+    '''
+
+    def __init__(self, fields, vocabulary):
+        self.fields = list(fields)
+        self.vocabulary = vocabulary
+
+    @classmethod
+    def fit(cls, df, fields=FIELDS, features=None):
+        # features: optional LoadData.features, the one-hot column c is stored as features['c:1']
+        return cls.from_categories(fields, [df[field].values for field in fields], features)
+
+    @classmethod
+    def from_categories(cls, fields, categories_per_field, features=None):
+        # categories_per_field: the values seen for every field, e.g. collected over the chunks of a large log
+        vocabulary = {}
+        offset = 0
+        for field, values in zip(fields, categories_per_field):
+            categories = np.unique(values)  # sorted, as OneHotEncoder.categories_
+            vocabulary[field] = {}
+            for i, value in enumerate(categories):
+                feature = offset + i
+                if features is not None:
+                    feature = features['%d:1' % feature]
+                vocabulary[field][str(value)] = int(feature)
+            offset += len(categories)
+        return cls(fields, vocabulary)
+
+    def extend(self, categories_per_field):
+        '''append-only growth: unseen values get new feature ids after the largest one, known ids never change
+        return: number of new values
+        '''
+        next_id = 1 + max([max(values.values()) for values in self.vocabulary.values() if values] + [-1])
+        added = 0
+        for field, values in zip(self.fields, categories_per_field):
+            for value in np.unique(values):
+                if str(value) not in self.vocabulary[field]:
+                    self.vocabulary[field][str(value)] = next_id
+                    next_id += 1
+                    added += 1
+        return added
+
+    @classmethod
+    def load(cls, file):
+        with open(file) as f:
+            encoder = json.load(f)
+        return cls(encoder['fields'], encoder['vocabulary'])
+
+    def save(self, file):
+        with open(file, 'w') as f:
+            json.dump({'fields': self.fields, 'vocabulary': self.vocabulary}, f)
+
+    def feature_id(self, field, value):
+        try:
+            return self.vocabulary[field][str(value)]
+        except KeyError:
+            raise ValueError('Unknown value %r for field %s' % (value, field))
+
+    def encode(self, instance):  # one instance, values in self.fields order -> list of feature ids
+        return [self.feature_id(field, value) for field, value in zip(self.fields, instance)]
+
+    def encode_batch(self, instances):  # many instances -> N * fields int32 array
+        return self.encode_frame(pd.DataFrame(list(instances), columns=self.fields))
+
+    def encode_frame(self, frame):  # DataFrame with a column per field -> N * fields int32 array
+        X = np.empty((len(frame), len(self.fields)), dtype=np.int32)
+        for j, field in enumerate(self.fields):
+            ids = frame[field].astype(str).map(self.vocabulary[field])
+            if ids.isnull().any():
+                unknown = frame[field][ids.isnull()].iloc[0]
+                raise ValueError('Unknown value %r for field %s' % (unknown, field))
+            X[:, j] = ids.values
+        return X
+
+    def candidates(self, field='item'):  # feature ids of every value of a field
+        return np.array(list(self.vocabulary[field].values()), dtype=np.int32)
+
+    def values(self, field='item'):  # values of a field in candidates() order, as ints when they all are integers
+        values = list(self.vocabulary[field].keys())
+        try:
+            return np.array([int(value) for value in values])
+        except ValueError:
+            return np.array(values)
+
+    def positions(self, field, values):  # positions in candidates(field) of the given values, unknown values are skipped
+        index = {value: i for i, value in enumerate(self.vocabulary[field].keys())}
+        return np.array([index[str(value)] for value in values if str(value) in index], dtype=np.int64)
+
+    def candidate_row(self, instance, field='item'):
+        '''encode an instance whose `field` is left open
+        :param instance: values of every field but `field`, in self.fields order
+        return: (row, slot, candidates), row[slot] holds the first candidate
+        '''
+        slot = self.fields.index(field)
+        candidates = self.candidates(field)
+        values = list(instance)
+        row = [self.feature_id(f, v) for f, v in zip(self.fields[:slot] + self.fields[slot+1:], values)]
+        row.insert(slot, candidates[0])
+        return np.array(row, dtype=np.int32), slot, candidates
+
+    def candidate_rows(self, instances, field='item'):  # candidate_row for many instances, encoded column by column
+        slot = self.fields.index(field)
+        first = next(iter(self.vocabulary[field]))
+        instances = [list(instance[:slot]) + [first] + list(instance[slot:]) for instance in instances]
+        return self.encode_batch(instances), slot, self.candidates(field)
+
+
+_encoders = {}
+
+def load_encoder(encoder_file=None, csv_file='../data/raw/frappe_dataset.csv'):
+    '''memoized: load the persisted encoder if it exists, otherwise fit it once from the raw csv'''
+    key = (encoder_file, csv_file)
+    if key not in _encoders:
+        if encoder_file is not None and os.path.exists(encoder_file):
+            _encoders[key] = FeatureEncoder.load(encoder_file)
+        else:
+            _encoders[key] = FeatureEncoder.fit(pd.read_csv(csv_file, sep="\t"))
+    return _encoders[key]
+
+if __name__ == '__main__':
+    args = parse_args()
+    features = None
+    if args.path is not None:
+        import model.LoadData as DATA
+        features = DATA.LoadData(args.path, args.dataset).features
+    encoder = FeatureEncoder.fit(pd.read_csv(args.csv, sep="\t"), features=features)
+    encoder.save(args.out)
+    print("Saved encoder with %d features to %s" % (sum(len(v) for v in encoder.vocabulary.values()), args.out))
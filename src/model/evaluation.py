@@ -0,0 +1,33 @@
+'''
+Chunked evaluation shared by FM and AFM
+
+The data is fed to the session a chunk at a time, so memory is bounded by the chunk
+size instead of the size of the evaluated set.
+'''
+import math
+import numpy as np
+
+
+def predict_chunked(predict, X, chunk_size):
+    '''run predict(X_chunk) over X and collect the (N,) predictions in one preallocated buffer'''
+    y_pred = np.empty(len(X), dtype=np.float32)
+    for start in range(0, len(X), chunk_size):
+        y_pred[start:start + chunk_size] = np.reshape(predict(X[start:start + chunk_size]), (-1,))
+    return y_pred
+
+def streaming_rmse(predict, data, chunk_size):
+    '''RMSE of the predictions bounded to [min(y), max(y)], accumulated chunk by chunk
+    :param predict: function mapping an n * M' feature chunk to n predictions
+    :param data: dictionary with 'X' and 'Y'
+    '''
+    X = data['X']
+    y_true = np.reshape(data['Y'], (-1,))
+    num_example = len(y_true)
+    y_min, y_max = np.min(y_true), np.max(y_true)
+
+    squared_error = 0.0
+    for start in range(0, num_example, chunk_size):
+        y_pred = np.reshape(predict(X[start:start + chunk_size]), (-1,))
+        predictions_bounded = np.clip(y_pred, y_min, y_max)  # bound the lower and higher values
+        squared_error += np.sum(np.square(y_true[start:start + chunk_size] - predictions_bounded), dtype=np.float64)
+    return math.sqrt(squared_error / num_example)
@@ -0,0 +1,69 @@
+'''
+Export the weights of a trained FM / IFM checkpoint to a compact .npz file,
+which is all the NumPy scorer (model/scorer.py) needs at serve time.
+--precision float16 or int8 stores feature_embeddings in 1/2 or about 1/4 of the memory (model/precision.py).
+
+usage (from src/):
+python -m model.export --pretrain ../pretrain/fm_frappe_256/frappe_256 --out ../pretrain/fm_frappe_256/frappe_256.npz
+'''
+import argparse
+import numpy as np
+import tensorflow as tf
+from model.precision import compress, PRECISIONS
+
+# variables shared by FM and IFM
+FM_WEIGHTS = ['feature_embeddings', 'feature_bias', 'bias']
+# attention and field-interaction variables of IFM (AFM._initialize_weights)
+IFM_WEIGHTS = ['attention_W', 'attention_b', 'attention_p', 'interaction', 'factor']
+# batch norm of the FM layer (FM.batch_norm_layer, scope bn_fm)
+BN_WEIGHTS = {'bn_gamma': 'bn_fm/gamma', 'bn_beta': 'bn_fm/beta',
+              'bn_mean': 'bn_fm/moving_mean', 'bn_variance': 'bn_fm/moving_variance'}
+
+#################### Arguments ####################
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export FM/IFM weights for the NumPy scorer.")
+    parser.add_argument('--pretrain', nargs='?', default='../pretrain/fm_frappe_256/frappe_256',
+                        help='Checkpoint prefix to export.')
+    parser.add_argument('--out', nargs='?', default=None,
+                        help='Output .npz file. Defaults to <pretrain>.npz')
+    parser.add_argument('--temp', type=float, default=1.0,
+                        help='Attention temperature the IFM model was trained with (not stored in the checkpoint).')
+    parser.add_argument('--epsilon', type=float, default=0.001,
+                        help='Batch norm epsilon of the FM layer.')
+    parser.add_argument('--precision', nargs='?', default='float32',
+                        help='Storage of feature_embeddings: %s.' % ', '.join(PRECISIONS))
+    return parser.parse_args()
+
+def read_weights(save_file, temp=1.0, epsilon=0.001):
+    # read the variables straight from the checkpoint, no graph import needed
+    reader = tf.train.NewCheckpointReader(save_file)
+    shapes = reader.get_variable_to_shape_map()
+
+    weights = {}
+    for name in FM_WEIGHTS:
+        weights[name] = reader.get_tensor(name).astype(np.float32)
+    weights['feature_bias'] = weights['feature_bias'].reshape(-1)
+
+    if all(name in shapes for name in IFM_WEIGHTS):
+        weights['model'] = np.array('ifm')
+        for name in IFM_WEIGHTS:
+            weights[name] = reader.get_tensor(name).astype(np.float32)
+        weights['temp'] = np.float32(temp)
+    else:
+        weights['model'] = np.array('fm')
+        if all(name in shapes for name in BN_WEIGHTS.values()):
+            for key, name in BN_WEIGHTS.items():
+                weights[key] = reader.get_tensor(name).astype(np.float32)
+            weights['bn_epsilon'] = np.float32(epsilon)
+    return weights
+
+def export_weights(save_file, out_file, temp=1.0, epsilon=0.001, precision='float32'):
+    weights = compress(read_weights(save_file, temp, epsilon), precision)
+    np.savez(out_file, **weights)
+    return weights
+
+if __name__ == '__main__':
+    args = parse_args()
+    out_file = args.out if args.out else args.pretrain + '.npz'
+    weights = export_weights(args.pretrain, out_file, args.temp, args.epsilon, args.precision)
+    print("Exported %s model (%d features, %s embeddings) to %s" % (weights['model'], len(weights['feature_bias']), args.precision, out_file))
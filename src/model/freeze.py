@@ -0,0 +1,119 @@
+'''
+Frozen inference graph of a trained IFM
+
+The training graph recomputes on every run what only depends on the trained weights: the field
+interaction weights (pairs of interaction rows times factor, reshaped into attention_interaction)
+and the division of the attention products by the temperature. It also carries the optimizer slots,
+the dropout ops, the batch-norm branches and the label placeholder that only gives the shape of the
+bias. freeze() builds an inference-only graph from the checkpoint instead, with every weight a
+constant and the input-independent parts folded in NumPy:
+
+    field_weights = (interaction[rows] * interaction[cols]) . factor     (M'*(M'-1)/2) * K
+    attention_W / temp
+
+and writes its GraphDef to a .pb file. With --precision float16 or int8 the embedding table is stored
+compact and the gathered rows are cast back to float32. FrozenPredictor serves it with a single `features` input and
+the `out_afm` output, the scores of the IFM up to float32 rounding.
+
+usage (from src/):
+python -m model.freeze --pretrain ../pretrain/fm_frappe_256/frappe_256 --out ../pretrain/fm_frappe_256/frappe_256.pb
+'''
+import argparse
+import numpy as np
+import tensorflow as tf
+from model.export import read_weights
+from model.precision import compress, PRECISIONS
+from model.predictor import Predictor
+
+#################### Arguments ####################
+def parse_args():
+    parser = argparse.ArgumentParser(description="Freeze an IFM checkpoint into an inference graph.")
+    parser.add_argument('--pretrain', nargs='?', default='../pretrain/fm_frappe_256/frappe_256',
+                        help='Checkpoint prefix to freeze.')
+    parser.add_argument('--out', nargs='?', default=None,
+                        help='Output .pb file. Defaults to <pretrain>.pb')
+    parser.add_argument('--temp', type=float, default=1.0,
+                        help='Attention temperature the IFM model was trained with (not stored in the checkpoint).')
+    parser.add_argument('--precision', nargs='?', default='float32',
+                        help='Storage of feature_embeddings in the graph: %s.' % ', '.join(PRECISIONS))
+    return parser.parse_args()
+
+def embedding_lookup(weights, features):
+    '''float32 rows of feature_embeddings, stored as float16 or int8 codes and scales (model/precision.py compress)'''
+    embeddings = tf.gather(tf.constant(weights['feature_embeddings'], name='feature_embeddings'), features)
+    if 'feature_embeddings_scales' in weights:
+        scales = tf.gather(tf.constant(weights['feature_embeddings_scales'], name='feature_embeddings_scales'), features)
+        return tf.cast(embeddings, tf.float32) * tf.expand_dims(scales, -1)
+    return tf.cast(embeddings, tf.float32)
+
+def inference_graph(weights):
+    '''IFM scoring graph with the weights of `weights` (model/export.py read_weights) as constants'''
+    valid_dimension = weights['interaction'].shape[0]
+    # field pairs in the order of AFM.pairwise_interactions
+    rows, cols = np.triu_indices(valid_dimension, 1)
+    interaction = weights['interaction']
+    field_weights = np.dot(interaction[rows] * interaction[cols], weights['factor'])  # P * K
+    attention_W = weights['attention_W'] / weights['temp']  # K * AK
+
+    graph = tf.Graph()
+    with graph.as_default():
+        features = tf.placeholder(tf.int32, shape=[None, None], name='features')  # None * M'
+        nonzero_embeddings = embedding_lookup(weights, features)  # None * M' * K
+        element_wise_product = tf.multiply(tf.gather(nonzero_embeddings, rows, axis=1), tf.gather(nonzero_embeddings, cols, axis=1))  # None * P * K
+
+        # attention over the pairwise interactions
+        attention_mul = tf.tensordot(element_wise_product, tf.constant(attention_W, name='attention_W'), axes=1)  # None * P * AK
+        attention_hidden = tf.nn.relu(attention_mul + tf.constant(weights['attention_b'].reshape(-1), name='attention_b'))
+        attention_logits = tf.tensordot(attention_hidden, tf.constant(weights['attention_p'], name='attention_p'), axes=1)  # None * P
+        attention_out = tf.nn.softmax(attention_logits, name='attention_out')
+
+        # field-aware weighting of each interaction
+        weighted = tf.reduce_sum(element_wise_product * tf.constant(field_weights.astype(np.float32), name='field_weights'), 2)  # None * P
+        afm = tf.reduce_sum(attention_out * weighted, 1)
+        feature_bias = tf.reduce_sum(tf.gather(tf.constant(weights['feature_bias'], name='feature_bias'), features), 1)
+        tf.add(afm + feature_bias, tf.constant(float(weights['bias']), name='bias'), name='out_afm')  # None
+    # only the ops out_afm depends on
+    return tf.graph_util.extract_sub_graph(graph.as_graph_def(), ['out_afm'])
+
+def freeze(save_file, out_file, temp=1.0, precision='float32'):
+    weights = read_weights(save_file, temp)
+    if str(weights['model']) != 'ifm':
+        raise ValueError('%s is not an IFM checkpoint, FM models are served by NumpyFM' % save_file)
+    graph_def = inference_graph(compress(weights, precision))
+    with open(out_file, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    return graph_def
+
+
+class FrozenPredictor(Predictor):
+    '''IFM predictor on the frozen inference graph written by freeze()
+    :param graph_file: the .pb file
+    :param encoder: FeatureEncoder used to encode request instances
+    '''
+
+    def __init__(self, graph_file, encoder):
+        Predictor.__init__(self, encoder)
+        graph_def = tf.GraphDef()
+        with open(graph_file, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.features = self.graph.get_tensor_by_name('features:0')
+        self.out = self.graph.get_tensor_by_name('out_afm:0')
+        self.sess = tf.Session(graph=self.graph)
+        # nothing is added to the graph after loading; Session.run is thread-safe on a finalized graph
+        self.graph.finalize()
+
+    def predict(self, X):
+        return self.sess.run(self.out, feed_dict={self.features: X})
+
+    def close(self):
+        self.sess.close()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    out_file = args.out if args.out else args.pretrain + '.pb'
+    graph_def = freeze(args.pretrain, out_file, args.temp, args.precision)
+    print("Froze %s into %s (%d ops)" % (args.pretrain, out_file, len(graph_def.node)))
@@ -0,0 +1,59 @@
+'''
+Multi-core CPU training shared by FM and AFM
+
+session_config sets the thread pools of a session: intra-op threads split a single op (a matmul, a
+large gather) across cores, inter-op threads run independent ops at the same time.
+
+data_parallel builds synchronous data-parallel training inside one graph: every batch is cut into
+`towers` contiguous slices, each tower runs the model on its slice, and the gradients of all towers
+are added up before a single update of the shared variables. The towers are independent ops, so the
+inter-op pool runs them concurrently. The losses of FM and AFM are sums over the samples, so the
+summed tower gradients are the gradient of the whole batch and a step is the same as with one tower
+(up to dropout). Sparse gradients (embedding lookups) stay IndexedSlices: their indices and values
+are concatenated, never densified to features_M rows.
+'''
+import tensorflow as tf
+
+
+def session_config(intra_op_threads=0, inter_op_threads=0):
+    '''ConfigProto with the given thread pools, 0 lets TensorFlow use one thread per core'''
+    config = tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                            inter_op_parallelism_threads=inter_op_threads)
+    config.gpu_options.allow_growth = True
+    return config
+
+def split_batch(features, labels, towers):
+    '''`towers` contiguous slices of a batch of any size'''
+    num_example = tf.shape(features)[0]
+    partitions = (tf.range(num_example) * towers) // tf.maximum(num_example, 1)
+    return list(zip(tf.dynamic_partition(features, partitions, towers),
+                    tf.dynamic_partition(labels, partitions, towers)))
+
+def sum_gradients(tower_grads):
+    '''add up the (gradient, variable) lists of the towers variable by variable'''
+    summed = []
+    for grads_and_vars in zip(*tower_grads):
+        variable = grads_and_vars[0][1]
+        grads = [grad for grad, _ in grads_and_vars if grad is not None]
+        if not grads:
+            summed.append((None, variable))
+        elif isinstance(grads[0], tf.IndexedSlices):
+            summed.append((tf.IndexedSlices(tf.concat([grad.values for grad in grads], 0),
+                                            tf.concat([grad.indices for grad in grads], 0),
+                                            grads[0].dense_shape), variable))
+        else:
+            summed.append((tf.add_n(grads), variable))
+    return summed
+
+def data_parallel(optimizer, tower_loss, features, labels, towers):
+    '''training op of `towers` copies of the model, each on a slice of the batch, and the loss of the batch
+    :param optimizer: tf.train.Optimizer applying the summed gradients
+    :param tower_loss: function (features, labels) -> loss of one slice, called inside the tower's name scope
+    '''
+    tower_losses, tower_grads = [], []
+    for tower, (tower_features, tower_labels) in enumerate(split_batch(features, labels, towers)):
+        with tf.name_scope('tower_%d' % tower):
+            loss = tower_loss(tower_features, tower_labels)
+            tower_losses.append(loss)
+            tower_grads.append(optimizer.compute_gradients(loss))
+    return optimizer.apply_gradients(sum_gradients(tower_grads)), tf.add_n(tower_losses)
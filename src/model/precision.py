@@ -0,0 +1,68 @@
+'''
+Reduced-precision embedding tables for serving
+
+feature_embeddings is most of a served model (frappe, K=256: 5.4k * 256 float32, 5.5 MB in every
+worker process). model/export.py can store it as
+    float16: half the size
+    int8:    about a quarter, an int8 code per value and a float32 scale per row (symmetric, the
+             largest |value| of the row maps to 127)
+EmbeddingTable dequantizes only the rows a lookup gathers, so the scorers still compute in float32.
+'''
+import numpy as np
+
+PRECISIONS = ['float32', 'float16', 'int8']
+
+
+def quantize_rows(vectors):  # per-row symmetric int8 quantization: vectors ~= codes * scales[:, None]
+    scales = np.max(np.abs(vectors), 1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.round(vectors / scales[:, np.newaxis]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+def compress(weights, precision='float32', name='feature_embeddings'):
+    '''weights with the table `name` stored in `precision`, the other weights unchanged'''
+    if precision not in PRECISIONS:
+        raise ValueError('Unknown precision %s, expected one of %s' % (precision, PRECISIONS))
+    weights = dict(weights)
+    if precision == 'float16':
+        weights[name] = weights[name].astype(np.float16)
+    elif precision == 'int8':
+        weights[name], weights[name + '_scales'] = quantize_rows(weights[name])
+    weights['precision'] = np.array(precision)
+    return weights
+
+def embedding_table(weights, name='feature_embeddings'):
+    '''the table `name` of exported weights: the array itself in float32, an EmbeddingTable otherwise'''
+    values = weights[name]
+    scales = weights.get(name + '_scales')
+    if scales is None and values.dtype != np.float16:
+        return values
+    return EmbeddingTable(values, scales)
+
+
+class EmbeddingTable(object):
+    '''float16 or int8 rows, indexed like the float32 array: table[ids] is a float32 array of ids.shape + (K,)
+    :param values: features_M * K float16 values or int8 codes
+    :param scales: features_M float32 scales of the int8 codes, None for float16
+    '''
+
+    def __init__(self, values, scales=None):
+        self.values = values
+        self.scales = scales
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, ids):
+        rows = self.values[ids].astype(np.float32)
+        if self.scales is not None:
+            rows *= self.scales[ids][..., np.newaxis]
+        return rows
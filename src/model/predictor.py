@@ -0,0 +1,77 @@
+'''
+Long-lived predictors shared by the recommendation service
+
+A predictor is built once at application startup and reused across requests,
+so the checkpoint and the feature encoding are loaded a single time per process.
+'''
+import numpy as np
+import model.ranking as ranking
+
+
+class Predictor(object):
+    '''base class of the serving predictors
+    :param encoder: FeatureEncoder used to encode request instances
+    subclasses implement predict(X), which must be safe to call from several threads
+    objective / target: how candidates are ranked, see model/ranking.py
+    '''
+
+    objective = 'closest'
+    target = 1.0
+
+    def __init__(self, encoder):
+        self.encoder = encoder
+        if encoder is not None:
+            # item id of every candidate, in encoder.candidates('item') order
+            self.item_ids = encoder.values('item')
+
+    def predict(self, X):  # score a batch of feature rows, returns a (N,) array
+        raise NotImplementedError
+
+    def score_candidates(self, row, slot, candidates):
+        '''score one feature row once per candidate placed in column `slot`
+        subclasses override this to reuse the parts of the row that do not depend on the candidate
+        '''
+        X = np.tile(np.asarray(row), (len(candidates), 1))
+        X[:, slot] = candidates
+        return self.predict(X)
+
+    def score_candidates_batch(self, rows, slot, candidates):  # U rows -> U * N scores
+        return np.array([self.score_candidates(row, slot, candidates) for row in rows])
+
+    def exclude_mask(self, exclude):  # boolean mask over the candidates of the excluded item ids
+        if exclude is None or len(exclude) == 0:
+            return None
+        mask = np.zeros(len(self.item_ids), dtype=bool)
+        mask[self.encoder.positions('item', exclude)] = True
+        return mask
+
+    def top_k(self, user, context, k, exclude=None):
+        '''item ids of the k best items for user + context, best first
+        :param exclude: item ids never to recommend, e.g. already installed apps
+        '''
+        # encode user + context once, the item column is filled with every candidate item
+        row, slot, candidates = self.encoder.candidate_row([user] + list(context))
+        predictions = self.score_candidates(row, slot, candidates)
+        best = ranking.top_k(predictions, k, self.objective, self.target, self.exclude_mask(exclude))
+        return self.item_ids[best]
+
+    def top_k_batch(self, users, contexts, k, excludes=None, batch_users=256):
+        '''top_k for many users: returns one array of item ids per user
+        :param excludes: optional list with one list of excluded item ids per user
+        :param batch_users: users scored together, bounds the batch_users * num_items score buffer
+        '''
+        instances = [[user] + list(context) for user, context in zip(users, contexts)]
+        rows, slot, candidates = self.encoder.candidate_rows(instances)
+        results = []
+        for start in range(0, len(rows), batch_users):
+            scores = self.score_candidates_batch(rows[start:start + batch_users], slot, candidates)
+            exclude_masks = None
+            if excludes is not None:
+                exclude_masks = np.zeros(scores.shape, dtype=bool)
+                for i, exclude in enumerate(excludes[start:start + batch_users]):
+                    mask = self.exclude_mask(exclude)
+                    if mask is not None:
+                        exclude_masks[i] = mask
+            best = ranking.top_k(scores, k, self.objective, self.target, exclude_masks)
+            results.extend(self.item_ids[positions] for positions in best)
+        return results
@@ -0,0 +1,45 @@
+'''
+Top-k selection of candidate items
+
+Selection uses np.argpartition (linear in the number of candidates) and only sorts the k
+winners. Scores can be a (N,) array for one user or a (U, N) array for a batch of users.
+'''
+import numpy as np
+
+# 'closest': score nearest to the target (labels are scaled to [-1, 1], 1 = most preferred)
+# 'highest': largest score
+OBJECTIVES = ['closest', 'highest']
+
+
+def top_n(scores, n):  # indexes of the n highest scores along the last axis, best first
+    n = min(n, scores.shape[-1])
+    if n <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+    top = np.argpartition(-scores, n - 1, axis=-1)[..., :n]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=-1), axis=-1, kind='stable')
+    return np.take_along_axis(top, order, axis=-1)
+
+def preference(scores, objective='closest', target=1.0):  # larger is better
+    if objective == 'closest':
+        return -np.abs(target - scores)
+    if objective == 'highest':
+        return np.array(scores, dtype=np.float64)
+    raise ValueError('Unknown ranking objective %s, expected one of %s' % (objective, OBJECTIVES))
+
+def top_k(scores, k, objective='closest', target=1.0, exclude=None):
+    '''positions of the k best candidates, best first
+    :param scores: (N,) or (U, N) predictions
+    :param exclude: boolean mask of the same shape, True candidates are never returned
+    returns a (k,) array, or (U, k) for a batch; with `exclude` a row has fewer than k positions when
+    fewer candidates are left, so a batch is a list of one array per row
+    '''
+    key = preference(np.asarray(scores), objective, target)
+    if exclude is None:
+        return top_n(key, k)
+    key[exclude] = -np.inf
+    best = top_n(key, k)
+    # drop the excluded candidates of each row that made it into its top k
+    kept = ~np.take_along_axis(exclude, best, axis=-1)
+    if best.ndim == 1:
+        return best[kept]
+    return [row[keep] for row, keep in zip(best, kept)]
@@ -0,0 +1,183 @@
+'''
+Candidate retrieval for large item catalogues
+
+For a fixed user + context the FM score of an item is
+    const + feature_bias[item] + feature_embeddings[item] . query
+(see NumpyFM.item_query), so the best items under FM are a maximum inner product search
+over the vectors [feature_embeddings[item], feature_bias[item]] with the query [query, 1].
+The indexes below return the top-N items of that search, which the IFM model re-ranks.
+'''
+import numpy as np
+from model.predictor import Predictor
+from model.precision import quantize_rows
+from model.ranking import top_n
+import model.ranking as ranking
+
+
+class ExactIndex(object):
+    '''blocked brute-force inner product search
+    :param vectors: num_items * D
+    :param block_size: items scored per matrix product, bounds the num_queries * block_size buffer
+    '''
+
+    def __init__(self, vectors, block_size=8192):
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.block_size = block_size
+
+    def search(self, queries, n):
+        '''queries: D or num_queries * D; returns (ids, scores), best first'''
+        queries = np.asarray(queries, dtype=np.float32)
+        single = queries.ndim == 1
+        queries = np.atleast_2d(queries)
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self.vectors), self.block_size):
+            scores = np.dot(queries, self.vectors[start:start + self.block_size].T)
+            ids = top_n(scores, n)
+            # merge the block winners with the running top-n
+            best_ids = np.concatenate([best_ids, ids + start], axis=1)
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, ids, axis=1)], axis=1)
+            keep = top_n(best_scores, n)
+            best_ids = np.take_along_axis(best_ids, keep, axis=1)
+            best_scores = np.take_along_axis(best_scores, keep, axis=1)
+        if single:
+            return best_ids[0], best_scores[0]
+        return best_ids, best_scores
+
+
+class IVFIndex(object):
+    '''inverted file index for approximate inner product search
+    the vectors are made equal-norm by one extra coordinate (maximum inner product -> nearest neighbour),
+    clustered with k-means, and a query only scans the `nprobe` lists whose centroids score best.
+    :param vectors: num_items * D
+    :param num_lists: number of k-means clusters
+    :param nprobe: lists scanned per query
+    :param quantize: store the list vectors as int8 with one scale per row
+    the probed lists can hold fewer than n items: search pads the results of a query to
+    min(n, num_items) with id -1 and score -inf, so a batch of queries gives rectangular arrays
+    '''
+
+    def __init__(self, vectors, num_lists=64, nprobe=8, quantize=False, iterations=10, random_seed=2016):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.dimension = vectors.shape[1]
+        self.num_items = len(vectors)
+        self.nprobe = nprobe
+        self.quantize = quantize
+
+        norms = np.sum(np.square(vectors), 1)
+        extra = np.sqrt(np.maximum(np.max(norms) - norms, 0))
+        augmented = np.hstack([vectors, extra[:, np.newaxis]])
+        self.centroids, assignment = self.kmeans(augmented, min(num_lists, len(vectors)), iterations, random_seed)
+
+        self.lists = []
+        for c in range(len(self.centroids)):
+            ids = np.where(assignment == c)[0]
+            if quantize:
+                codes, scales = quantize_rows(vectors[ids])
+                self.lists.append((ids, codes, scales))
+            else:
+                self.lists.append((ids, vectors[ids], None))
+
+    def kmeans(self, X, k, iterations, random_seed):
+        rng = np.random.RandomState(random_seed)
+        centroids = X[rng.choice(len(X), k, replace=False)]
+        for i in range(iterations):
+            # squared distance up to the per-row constant |x|^2
+            distance = np.sum(np.square(centroids), 1) - 2 * np.dot(X, centroids.T)
+            assignment = np.argmin(distance, 1)
+            for c in range(k):
+                members = X[assignment == c]
+                # re-seed empty clusters with a random vector
+                centroids[c] = np.mean(members, 0) if len(members) else X[rng.randint(len(X))]
+        distance = np.sum(np.square(centroids), 1) - 2 * np.dot(X, centroids.T)
+        return centroids, np.argmin(distance, 1)
+
+    def search(self, queries, n):
+        queries = np.asarray(queries, dtype=np.float32)
+        if queries.ndim == 1:
+            return self.search_one(queries, n)
+        results = [self.search_one(query, n) for query in queries]
+        return np.array([r[0] for r in results]), np.array([r[1] for r in results])
+
+    def search_one(self, query, n):
+        # the extra coordinate of the query is 0
+        probes = top_n(np.dot(self.centroids[:, :self.dimension], query), self.nprobe)
+        ids, scores = [], []
+        for c in probes:
+            list_ids, vectors, scales = self.lists[c]
+            if scales is None:
+                scores.append(np.dot(vectors, query))
+            else:
+                scores.append(np.dot(vectors, query) * scales)
+            ids.append(list_ids)
+        ids = np.concatenate(ids)
+        scores = np.concatenate(scores)
+        best = top_n(scores, n)
+        # padded to the same length for every query
+        size = min(n, self.num_items)
+        padded_ids = np.full(size, -1, dtype=np.int64)
+        padded_scores = np.full(size, -np.inf, dtype=np.float32)
+        padded_ids[:len(best)] = ids[best]
+        padded_scores[:len(best)] = scores[best]
+        return padded_ids, padded_scores
+
+
+def item_vectors(fm, candidates):  # [feature_embeddings, feature_bias] of the candidate items
+    return np.hstack([fm.feature_embeddings[candidates], fm.feature_bias[candidates][:, np.newaxis]])
+
+
+def build_index(fm, candidates, kind='exact', **kwargs):
+    '''inner product index over the candidate items of an FM scorer (NumpyFM)
+    :param kind: 'exact', 'ivf' or 'ivf_int8'
+    '''
+    vectors = item_vectors(fm, candidates)
+    if kind == 'exact':
+        return ExactIndex(vectors, **kwargs)
+    return IVFIndex(vectors, quantize=(kind == 'ivf_int8'), **kwargs)
+
+
+class RetrievalPredictor(Predictor):
+    '''two-stage predictor: the FM index retrieves `num_candidates` items, `ranker` scores only those
+    :param fm: NumpyFM providing the retrieval query
+    :param index: index built over fm and encoder.candidates() with build_index
+    :param ranker: Predictor re-ranking the retrieved items, usually the IFM scorer
+    :param objective: ranking objective of the re-ranking, default the one of `ranker`
+    the index retrieves the largest FM scores. Re-ranked under the objective of `ranker` ('closest' to
+    1.0), the served items are the same as without retrieval when they are in the retrieved set, but
+    items scored close to 1.0 can be missed and recall@N is lower than benchmark/retrieval.py measures;
+    'highest' ranks in the order the index retrieves, with a different ranking than the service's
+    '''
+
+    def __init__(self, fm, index, ranker, num_candidates=200, objective=None):
+        Predictor.__init__(self, ranker.encoder)
+        self.fm = fm
+        self.index = index
+        self.ranker = ranker
+        self.num_candidates = num_candidates
+        self.objective = objective or ranker.objective
+        self.target = ranker.target
+
+    def predict(self, X):
+        return self.ranker.predict(X)
+
+    def retrieve(self, row, slot, n):  # positions in the candidate list of the n best FM items
+        query, const = self.fm.item_query(row, slot)
+        positions, scores = self.index.search(np.append(query, 1.0), n)
+        return positions[positions >= 0]  # without the padding of IVFIndex
+
+    def top_k(self, user, context, k, exclude=None):
+        row, slot, candidates = self.encoder.candidate_row([user] + list(context))
+        exclude_mask = self.exclude_mask(exclude)
+        num_excluded = 0 if exclude_mask is None else int(np.sum(exclude_mask))
+        positions = self.retrieve(row, slot, max(k + num_excluded, self.num_candidates))
+        predictions = self.ranker.score_candidates(row, slot, candidates[positions])
+
+        exclude_mask = None if exclude_mask is None else exclude_mask[positions]
+        best = ranking.top_k(predictions, k, self.objective, self.target, exclude_mask)
+        return self.item_ids[positions[best]]
+
+    def top_k_batch(self, users, contexts, k, excludes=None, batch_users=256):
+        # retrieval is per user, the retrieved sets differ
+        if excludes is None:
+            excludes = [None] * len(users)
+        return [self.top_k(user, context, k, exclude) for user, context, exclude in zip(users, contexts, excludes)]
@@ -0,0 +1,182 @@
+'''
+Pure NumPy forward pass of FM and IFM
+
+Reproduces `out` of FM._init_graph and `out_afm` of AFM._init_graph at inference time
+(dropout disabled, batch norm in inference mode) from the weights written by model/export.py,
+so the web workers do not need to import TensorFlow. feature_embeddings may be stored in float16
+or int8 (model/precision.py), the scores are computed in float32 either way.
+'''
+import numpy as np
+from model.predictor import Predictor
+from model.precision import embedding_table
+
+
+class NumpyFM(Predictor):
+    '''FM scorer
+    :param weights: mapping with feature_embeddings, feature_bias, bias and optionally the bn_* statistics
+    '''
+
+    def __init__(self, weights, encoder):
+        Predictor.__init__(self, encoder)
+        self.feature_embeddings = embedding_table(weights)  # features_M * K, float16/int8 rows dequantized per lookup
+        self.feature_bias = weights['feature_bias']  # features_M
+        self.bias = float(weights['bias'])
+        # batch norm in inference mode is a per-factor affine map: scale * x + shift
+        self.bn_scale, self.bn_shift = None, None
+        if 'bn_gamma' in weights:
+            self.bn_scale = weights['bn_gamma'] / np.sqrt(weights['bn_variance'] + weights['bn_epsilon'])
+            self.bn_shift = weights['bn_beta'] - weights['bn_mean'] * self.bn_scale
+
+    def predict(self, X):
+        X = np.asarray(X)
+        nonzero_embeddings = self.feature_embeddings[X]  # None * M' * K
+        summed_features_emb = np.sum(nonzero_embeddings, 1)  # None * K
+        squared_sum_features_emb = np.sum(np.square(nonzero_embeddings), 1)  # None * K
+        fm = 0.5 * (np.square(summed_features_emb) - squared_sum_features_emb)  # None * K
+        if self.bn_scale is not None:
+            fm = fm * self.bn_scale + self.bn_shift
+        feature_bias = np.sum(self.feature_bias[X], 1)
+        return np.sum(fm, 1) + feature_bias + self.bias
+
+    def item_query(self, row, slot):
+        '''split the FM score of `row` with a free column `slot` into const + item_embedding . query
+        with the other embeddings summed into c: 0.5*(|c+e|^2 - sum(e_ctx^2) - e^2) = fm_ctx + c*e
+        '''
+        context = np.delete(np.asarray(row), slot)
+        context_embeddings = self.feature_embeddings[context]  # (M'-1) * K
+        summed = np.sum(context_embeddings, 0)
+        fm_context = 0.5 * (np.square(summed) - np.sum(np.square(context_embeddings), 0))  # K
+        query = summed
+        if self.bn_scale is not None:
+            fm_context = fm_context * self.bn_scale + self.bn_shift
+            query = summed * self.bn_scale
+        const = np.sum(fm_context) + np.sum(self.feature_bias[context]) + self.bias
+        return query, const
+
+    def score_candidates(self, row, slot, candidates):
+        # a single matrix-vector product over the candidate embeddings
+        query, const = self.item_query(row, slot)
+        return np.dot(self.feature_embeddings[candidates], query) + self.feature_bias[candidates] + const
+
+    def score_candidates_batch(self, rows, slot, candidates):
+        # one matrix product for all users: U * K queries against N * K item embeddings
+        queries, consts = zip(*[self.item_query(row, slot) for row in rows])
+        scores = np.dot(np.array(queries), self.feature_embeddings[candidates].T)
+        return scores + self.feature_bias[candidates] + np.array(consts)[:, np.newaxis]
+
+
+class NumpyIFM(Predictor):
+    '''IFM scorer
+    :param weights: mapping with the FM weights plus attention_W/b/p, interaction, factor and temp
+    :param chunk_size: rows scored at once, bounds the None * (M'*(M'-1)/2) * K intermediate
+    '''
+
+    def __init__(self, weights, encoder, chunk_size=512):
+        Predictor.__init__(self, encoder)
+        self.chunk_size = chunk_size
+        self.feature_embeddings = embedding_table(weights)  # features_M * K, float16/int8 rows dequantized per lookup
+        self.feature_bias = weights['feature_bias']  # features_M
+        self.bias = float(weights['bias'])
+        self.attention_W = weights['attention_W']  # K * AK
+        self.attention_b = weights['attention_b'].reshape(-1)  # AK
+        self.attention_p = weights['attention_p']  # AK
+        self.temp = float(weights['temp'])
+
+        # field pairs in the order of AFM.pairwise_interactions
+        self.valid_dimension = weights['interaction'].shape[0]
+        self.rows, self.cols = np.triu_indices(self.valid_dimension, 1)
+        # field interaction weights only depend on trained weights: (M'*(M'-1)/2) * K
+        interaction = weights['interaction']
+        self.field_weights = np.dot(interaction[self.rows] * interaction[self.cols], weights['factor'])
+
+    def predict(self, X):
+        X = np.asarray(X)
+        predictions = np.empty(len(X), dtype=np.float32)
+        for start in range(0, len(X), self.chunk_size):
+            predictions[start:start + self.chunk_size] = self._predict_chunk(X[start:start + self.chunk_size])
+        return predictions
+
+    def _predict_chunk(self, X):
+        nonzero_embeddings = self.feature_embeddings[X]  # None * M' * K
+        element_wise_product = nonzero_embeddings[:, self.rows] * nonzero_embeddings[:, self.cols]  # None * P * K
+
+        # attention over the pairwise interactions
+        attention_out = self.softmax(self.attention_logits(element_wise_product))  # None * P
+
+        # field-aware weighting of each interaction
+        weighted = np.sum(element_wise_product * self.field_weights, 2)  # None * P
+        afm = np.sum(attention_out * weighted, 1)
+        feature_bias = np.sum(self.feature_bias[X], 1)
+        return afm + feature_bias + self.bias
+
+    def score_candidates(self, row, slot, candidates):
+        return self.score_candidates_batch(np.asarray(row)[np.newaxis, :], slot, candidates)[0]
+
+    def score_candidates_batch(self, rows, slot, candidates):
+        # users are scored in groups so that the per-candidate buffers hold about chunk_size * 256 rows
+        rows = np.asarray(rows)
+        candidates = np.asarray(candidates)
+        users_per_chunk = max(1, self.chunk_size * 256 // max(len(candidates), 1))
+        scores = np.empty((len(rows), len(candidates)), dtype=np.float32)
+        for start in range(0, len(rows), users_per_chunk):
+            scores[start:start + users_per_chunk] = self._score_candidates_chunk(rows[start:start + users_per_chunk], slot, candidates)
+        return scores
+
+    def _score_candidates_chunk(self, rows, slot, candidates):
+        '''score every row once per candidate in column `slot`: U rows -> U * N scores
+        pairs between the fixed fields are computed once per row, only the pairs involving the
+        candidate field are evaluated per candidate as (candidates * K) matrix products
+        '''
+        num_users, num_candidates = len(rows), len(candidates)
+        item_embeddings = self.feature_embeddings[candidates]  # N * K
+        fixed_bias = np.sum(self.feature_bias[rows], 1) - self.feature_bias[rows[:, slot]] + self.bias  # U
+        candidate_bias = fixed_bias[:, np.newaxis] + self.feature_bias[candidates]  # U * N
+        if slot >= self.valid_dimension:
+            # the candidate field takes no part in the interactions
+            return (self._predict_chunk(rows) - self.feature_bias[rows[:, slot]])[:, np.newaxis] + self.feature_bias[candidates]
+
+        embeddings = self.feature_embeddings[rows[:, :self.valid_dimension]]  # U * M' * K
+        item_pair = (self.rows == slot) | (self.cols == slot)
+
+        # pairs not involving the candidate: identical for every candidate
+        fixed_rows, fixed_cols = self.rows[~item_pair], self.cols[~item_pair]
+        fixed_product = embeddings[:, fixed_rows] * embeddings[:, fixed_cols]  # U * P0 * K
+        fixed_logits = self.attention_logits(fixed_product)  # U * P0
+        fixed_weighted = np.sum(fixed_product * self.field_weights[~item_pair], 2)  # U * P0
+
+        # pairs (candidate, j): e_item * e_j, folded into the weights they are multiplied with
+        partners = np.where(self.rows[item_pair] == slot, self.cols[item_pair], self.rows[item_pair])
+        partner_embeddings = embeddings[:, partners]  # U * (M'-1) * K
+        num_partners = len(partners)
+        # (e_item * e_j) W = e_item (diag(e_j) W), all users and partners in one product: N * (U * (M'-1) * AK)
+        partner_W = partner_embeddings[:, :, :, np.newaxis] * self.attention_W  # U * (M'-1) * K * AK
+        partner_W = np.transpose(partner_W, (2, 0, 1, 3)).reshape(self.attention_W.shape[0], -1)
+        attention_mul = np.dot(item_embeddings, partner_W).reshape(num_candidates, num_users, num_partners, -1) / self.temp
+        item_logits = np.dot(np.maximum(attention_mul + self.attention_b, 0), self.attention_p)  # N * U * (M'-1)
+        partner_weights = (partner_embeddings * self.field_weights[item_pair]).reshape(-1, self.attention_W.shape[0])
+        item_weighted = np.dot(item_embeddings, partner_weights.T).reshape(num_candidates, num_users, num_partners)
+
+        # softmax over all pairs, split into the shared and the per-candidate part
+        shift = np.maximum(np.max(fixed_logits, 1), np.max(item_logits, 2))  # N * U
+        fixed_exp = np.exp(fixed_logits - shift[:, :, np.newaxis])  # N * U * P0
+        item_exp = np.exp(item_logits - shift[:, :, np.newaxis])  # N * U * (M'-1)
+        numerator = np.sum(fixed_exp * fixed_weighted, 2) + np.sum(item_exp * item_weighted, 2)
+        denominator = np.sum(fixed_exp, 2) + np.sum(item_exp, 2)
+        return (numerator / denominator).T + candidate_bias
+
+    def attention_logits(self, element_wise_product):  # ... * K -> ...
+        attention_mul = np.dot(element_wise_product, self.attention_W) / self.temp
+        return np.dot(np.maximum(attention_mul + self.attention_b, 0), self.attention_p)
+
+    def softmax(self, logits):
+        exp = np.exp(logits - np.max(logits, axis=-1, keepdims=True))
+        return exp / np.sum(exp, axis=-1, keepdims=True)
+
+
+def make_scorer(weights, encoder):
+    if str(weights['model']) == 'ifm':
+        return NumpyIFM(weights, encoder)
+    return NumpyFM(weights, encoder)
+
+def load_scorer(weights_file, encoder):
+    return make_scorer(dict(np.load(weights_file)), encoder)
@@ -0,0 +1,209 @@
+'''
+Hyperparameter sweeps of the IFM
+
+The dataset is converted once to the binary .npy files of LoadData and every worker process maps
+them read-only, so all trials share one copy in the page cache instead of parsing the libfm files
+again. Trials run in a process pool, each session limited to --threads threads; by default there
+are as many workers as fit in the cores.
+
+Schedules:
+    grid     every combination of the values of --space
+    random   --trials combinations drawn from --space
+    halving  successive halving of --trials random combinations: every trial trains --min_epochs
+             epochs, the best 1/--eta by validation RMSE continue from their training snapshot for
+             --eta times as many epochs, and so on until one trial is left or --epoch is reached
+Early stopping of IFM.py (--patience) also ends the trials that stop improving.
+
+Each finished trial, or trial rung, becomes a row of the results csv with its parameters, epochs,
+best validation RMSE with the train and test RMSE of that evaluation, and wall time.
+Arguments other than the ones below go to IFM.py and are the fixed settings of every trial.
+
+usage (from src/):
+python -m model.sweep --schedule halving --trials 27 --space '{"lr": [0.01, 0.05, 0.1], "kf": [8, 16, 32], "temp": [1.0, 10.0]}' --dataset frappe --epoch 27
+'''
+import argparse
+import copy
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from time import time
+import model.LoadData as DATA
+
+RESULT_FIELDS = ['epochs', 'train_rmse', 'valid_rmse', 'test_rmse', 'seconds']
+
+#################### Arguments ####################
+def parse_args():
+    parser = argparse.ArgumentParser(description="Hyperparameter sweep of IFM.")
+    parser.add_argument('--space', nargs='?', default='{"lr": [0.01, 0.05, 0.1], "kf": [8, 16, 32]}',
+                        help='JSON object (or file) mapping IFM.py arguments to the values to try.')
+    parser.add_argument('--schedule', nargs='?', default='grid',
+                        help='grid, random or halving.')
+    parser.add_argument('--trials', type=int, default=20,
+                        help='random and halving: number of sampled combinations.')
+    parser.add_argument('--min_epochs', type=int, default=1,
+                        help='halving: epochs of the first rung.')
+    parser.add_argument('--eta', type=int, default=3,
+                        help='halving: 1/eta of the trials go on to the next rung, with eta times the epochs.')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='TensorFlow threads of each trial.')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Trials run at the same time (default: number of CPUs // threads).')
+    parser.add_argument('--work_dir', nargs='?', default='../pretrain/sweep',
+                        help='Training snapshots of the trials.')
+    parser.add_argument('--results', nargs='?', default=None,
+                        help='Results csv (default: <work_dir>/results.csv).')
+    parser.add_argument('--seed', type=int, default=2016,
+                        help='Seed of the random combinations.')
+    return parser.parse_known_args()
+
+def load_space(space):
+    if os.path.exists(space):
+        with open(space) as f:
+            return json.load(f)
+    return json.loads(space)
+
+def grid(space):
+    names = sorted(space)
+    return [dict(zip(names, values)) for values in itertools.product(*[space[name] for name in names])]
+
+def sample(space, num_trials, seed):
+    rng = np.random.RandomState(seed)
+    names = sorted(space)
+    return [dict((name, space[name][rng.randint(len(space[name]))]) for name in names) for _ in range(num_trials)]
+
+def trial_args(base, params, threads):
+    '''IFM.py arguments of one trial'''
+    args = copy.copy(base)
+    for name, value in params.items():
+        # hidden_factor and keep are given to IFM.py as strings of lists
+        setattr(args, name, str(value) if isinstance(value, list) else value)
+    args.intra_op_threads = args.inter_op_threads = threads
+    args.verbose = 0
+    return args
+
+def valid_rmse(result):  # ranking key of a result, trials without an evaluation last
+    return result['valid_rmse'] if result['valid_rmse'] is not None else float('inf')
+
+_dataset = None
+
+def dataset(path, name):
+    '''the binary dataset mapped once per worker process'''
+    global _dataset
+    if _dataset is None:
+        data = DATA.LoadData(path, name)
+        _dataset = (data, data.truncate_features())
+    return _dataset
+
+def run_trial(task):
+    '''train one trial for `epochs` epochs, resuming its last snapshot when `resume`'''
+    trial, args, epochs, resume, work_dir = task
+    # TensorFlow is only imported in the workers
+    from model.IFM import make_model
+    data, num_variable = dataset(args.path, args.dataset)
+    save_file = os.path.join(work_dir, 'trial-%04d' % trial, 'ifm')
+    if not os.path.exists(os.path.dirname(save_file)):
+        os.makedirs(os.path.dirname(save_file))
+    args = copy.copy(args)
+    args.resume = int(resume)
+    t = time()
+    model = make_model(args, data.features_M, num_variable, save_file, pretrain_flag=0, epoch=epochs)
+    model.train(data.Train_data, data.Validation_data, data.Test_data)
+    best = model.best_index()
+    result = {'trial': trial, 'epochs': epochs, 'train_rmse': None, 'valid_rmse': None, 'test_rmse': None, 'seconds': time() - t}
+    if best is not None:  # no evaluation yet: empty metrics, ranked last
+        result.update(epochs=model.eval_epochs[-1], train_rmse=model.train_rmse[best],
+                      valid_rmse=model.valid_rmse[best], test_rmse=model.test_rmse[best])
+    model.sess.close()
+    return result
+
+
+class Sweep(object):
+    '''
+    :param base: IFM.py arguments shared by all trials
+    :param configs: one dictionary of IFM.py argument values per trial
+    :param results_file: csv the results are appended to after every rung
+    '''
+
+    def __init__(self, base, configs, threads, work_dir, results_file):
+        self.base = base
+        self.configs = configs
+        self.threads = threads
+        self.work_dir = work_dir
+        self.results_file = results_file
+        self.fields = ['trial', 'rung'] + sorted(configs[0]) + RESULT_FIELDS
+        self.results = []
+
+    def run(self, tasks, rung, executor):
+        '''run (trial, epochs, resume) tasks, write their rows; return the results in task order'''
+        results = list(executor.map(run_trial, [(trial, trial_args(self.base, self.configs[trial], self.threads), epochs, resume, self.work_dir)
+                                                for trial, epochs, resume in tasks]))
+        with open(self.results_file, 'a') as f:
+            writer = csv.DictWriter(f, self.fields)
+            for result in results:
+                row = dict(result, rung=rung, **dict((name, json.dumps(value)) for name, value in self.configs[result['trial']].items()))
+                writer.writerow(row)
+                print("trial %d, rung %d, %d epochs: valid=%.4f [%.1f s]" % (result['trial'], rung, result['epochs'], valid_rmse(result), result['seconds']))
+        self.results.extend(dict(result, rung=rung) for result in results)
+        return results
+
+    def all(self, epochs, executor):  # grid and random: every trial once
+        return self.run([(trial, epochs, False) for trial in range(len(self.configs))], 0, executor)
+
+    def halving(self, min_epochs, max_epochs, eta, executor):
+        trials, epochs, rung = list(range(len(self.configs))), min_epochs, 0
+        while True:
+            results = self.run([(trial, epochs, rung > 0) for trial in trials], rung, executor)
+            if len(trials) == 1 or epochs >= max_epochs:
+                return results
+            # the best 1/eta go on with eta times the epochs, the others are dropped
+            ranked = sorted(results, key=valid_rmse)
+            trials = [result['trial'] for result in ranked[:max(1, len(trials) // eta)]]
+            epochs, rung = min(epochs * eta, max_epochs), rung + 1
+
+    def write_header(self):
+        with open(self.results_file, 'w') as f:
+            csv.DictWriter(f, self.fields).writeheader()
+
+
+if __name__ == '__main__':
+    args, ifm_argv = parse_args()
+    from model.IFM import parse_args as ifm_args
+    base = ifm_args(ifm_argv)
+    space = load_space(args.space)
+    if args.schedule == 'grid':
+        configs = grid(space)
+    else:
+        configs = sample(space, args.trials, args.seed)
+
+    # convert the libfm files once; the workers map the .npy files
+    data = DATA.LoadData(base.path, base.dataset)
+    if not data.has_binary():
+        data.save_binary()
+    del data
+
+    if not os.path.exists(args.work_dir):
+        os.makedirs(args.work_dir)
+    results_file = args.results if args.results else os.path.join(args.work_dir, 'results.csv')
+    workers = args.workers if args.workers else max(1, multiprocessing.cpu_count() // args.threads)
+    # snapshots every min_epochs: the end of every halving rung
+    base.checkpoint_every = args.min_epochs if args.schedule == 'halving' else 0
+    sweep = Sweep(base, configs, args.threads, args.work_dir, results_file)
+    sweep.write_header()
+
+    t = time()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if args.schedule == 'halving':
+            results = sweep.halving(args.min_epochs, base.epoch, args.eta, executor)
+        else:
+            results = sweep.all(base.epoch, executor)
+    best = min(results, key=valid_rmse)
+    if best['valid_rmse'] is None:
+        raise SystemExit("No trial was evaluated, lower --valid_every or raise --epoch")
+    print("Best trial %d %s: train = %.4f, valid = %.4f, Test = %.4f (%d trials, %d runs) [%.1f s]"
+          % (best['trial'], json.dumps(configs[best['trial']]), best['train_rmse'], best['valid_rmse'], best['test_rmse'],
+             len(configs), len(sweep.results), time() - t))
+    print("results in %s" % results_file)
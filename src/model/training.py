@@ -0,0 +1,72 @@
+'''
+Training control shared by FM and AFM
+
+EarlyStopping ends a run once the validation RMSE has not improved for `patience` evaluations; the
+model keeps the weights of the best evaluation (checkpoint.BestCheckpoint) and restores them at the
+end, so the saved model is the best on validation and not the last one trained.
+EvaluationSchedule decides what is evaluated after an epoch: the validation set every `valid_every`
+epochs (and after the last one), the train RMSE on a fixed sample of the training set, and the test
+set with every evaluation or only once for the best weights.
+'''
+import numpy as np
+
+
+class EarlyStopping(object):
+    '''
+    :param patience: evaluations without improvement before stopping, 0 never stops
+    :param min_delta: smallest decrease of the validation RMSE counted as an improvement
+    '''
+
+    def __init__(self, patience=5, min_delta=0.0):
+        self.patience = patience
+        self.min_delta = min_delta
+        self.best = float('inf')
+        self.best_epoch = None
+        self.wait = 0
+
+    def update(self, value, epoch):
+        '''record the validation RMSE after `epoch` finished epochs; return True for a new best'''
+        if value < self.best - self.min_delta:
+            self.best, self.best_epoch, self.wait = value, epoch, 0
+            return True
+        self.wait += 1
+        return False
+
+    @property
+    def stop(self):
+        return self.patience > 0 and self.wait >= self.patience
+
+    def state(self):  # for the training snapshots
+        return {'best': self.best, 'best_epoch': self.best_epoch, 'wait': self.wait}
+
+    def load(self, state):
+        self.best, self.best_epoch, self.wait = state['best'], state['best_epoch'], state['wait']
+
+
+class EvaluationSchedule(object):
+    '''
+    :param num_epochs: epochs of the run, the last one is always evaluated
+    :param valid_every: evaluate every n epochs
+    :param train_sample: rows of the training set the train RMSE is computed on, a fraction when
+        below 1, 0 for the whole set
+    :param eval_test: evaluate the test set with every evaluation, otherwise only for the best weights
+    '''
+
+    def __init__(self, num_epochs, valid_every=1, train_sample=0, eval_test=True, random_seed=2016):
+        self.num_epochs = num_epochs
+        self.valid_every = max(1, valid_every)
+        self.train_sample = train_sample
+        self.eval_test = eval_test
+        self.random_seed = random_seed
+
+    def evaluate_at(self, epoch):  # epoch: number of finished epochs
+        return epoch % self.valid_every == 0 or epoch == self.num_epochs
+
+    def train_subset(self, data):
+        '''the same random rows every epoch, drawn apart from np.random so the batch shuffling is unchanged'''
+        num_example = len(data['Y'])
+        size = int(round(self.train_sample * num_example)) if self.train_sample < 1 else int(self.train_sample)
+        if size <= 0 or size >= num_example:
+            return data
+        rows = np.sort(np.random.RandomState(self.random_seed).choice(num_example, size, replace=False))
+        return {'X': data['X'][rows], 'Y': data['Y'][rows]}
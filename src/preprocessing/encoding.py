@@ -0,0 +1,98 @@
+'''
+One-hot encoding of the labeled log as a CSR matrix, and bulk writers for libfm and the binary format
+
+The vocabulary is a FeatureEncoder (model/encoder.py) fitted once, so the column of a value is the
+feature id served by the recommendation service. Every row has exactly one active column per field:
+the CSR matrix stores nnz = rows * fields indices and no dense rows * vocabulary array is built.
+The writers work on the CSR index arrays, a chunk of rows at a time.
+'''
+import json
+import os
+import numpy as np
+from scipy.sparse import csr_matrix
+from model.encoder import FeatureEncoder, FIELDS
+from model.LoadData import FeatureVocabulary
+
+
+def fit_encoder(data, fields=FIELDS, encoder_file=None):
+    '''the encoder of `encoder_file` grown by the values of `data` it does not know yet, so the feature
+    ids of a previous run are kept; fitted on `data` when the file does not exist'''
+    if encoder_file is not None and os.path.exists(encoder_file):
+        encoder = FeatureEncoder.load(encoder_file)
+        encoder.extend([data[field].values for field in encoder.fields])
+        return encoder
+    return FeatureEncoder.fit(data, fields)
+
+def num_features(encoder):
+    return sum(len(values) for values in encoder.vocabulary.values())
+
+def encode(data, encoder):
+    '''one-hot encoding of the encoder fields of `data`
+    return: rows * num_features(encoder) CSR matrix of ones
+    '''
+    return to_csr(encoder.encode_frame(data), num_features(encoder))
+
+def to_csr(indices, num_features):  # rows * fields array of active columns -> CSR matrix of ones
+    rows, width = indices.shape
+    indptr = np.arange(0, rows * width + 1, max(width, 1), dtype=np.int64)[:rows + 1]
+    return csr_matrix((np.ones(rows * width, dtype=np.float32), indices.ravel(), indptr),
+                      shape=(rows, num_features))
+
+def row_indices(X):
+    '''active columns of a one-hot CSR matrix as a rows * fields int32 array'''
+    nnz = np.diff(X.indptr)
+    if len(nnz) and np.any(nnz != nnz[0]):
+        raise ValueError('Expected the same number of active features in every row')
+    width = int(nnz[0]) if len(nnz) else 0
+    # a row slice of a CSR matrix keeps the full index array, start at the first row of the slice
+    indices = X.indices[X.indptr[0]:X.indptr[-1]]
+    return indices.reshape(X.shape[0], width).astype(np.int32)
+
+def write_libfm(X, Y, file, chunk_size=100000):
+    '''libfm lines "label c:1 c:1 ..." for the one-hot CSR matrix X and the labels Y'''
+    indices = row_indices(X)
+    Y = np.asarray(Y, dtype=np.float64)
+    line = '%r' + ' %d:1' * indices.shape[1] + '\n'
+    with open(file, 'w') as f:
+        for start in range(0, len(Y), chunk_size):
+            # one format operation for the whole chunk
+            values = np.empty((len(Y[start:start + chunk_size]), indices.shape[1] + 1), dtype=object)
+            values[:, 0] = Y[start:start + chunk_size].tolist()
+            values[:, 1:] = indices[start:start + chunk_size]
+            f.write((line * len(values)) % tuple(values.ravel().tolist()))
+
+def write_binary(X, Y, prefix, name):
+    '''the .npy files read by LoadData.load_binary, <prefix>.<name>.X.npy and .Y.npy
+    with prefix = <path><dataset>/<dataset> as in LoadData
+    '''
+    np.save('%s.%s.X.npy' % (prefix, name), row_indices(X))
+    np.save('%s.%s.Y.npy' % (prefix, name), np.asarray(Y, dtype=np.float32))
+
+def write_features(encoder, prefix):
+    '''LoadData.features of the files written above: the token of column c is "c:1" and maps to c.
+    The columns are appended to the feature vocabulary of LoadData (<prefix>.vocabulary.json), which
+    features.json is written from, and the encoder is saved next to them for the service.'''
+    check_encoder(encoder, prefix + '.encoder.json')
+    vocabulary = FeatureVocabulary.load(prefix + '.vocabulary.json')
+    added = vocabulary.add('%d:1' % c for c in range(num_features(encoder)))
+    if any(vocabulary.features['%d:1' % c] != c for c in range(num_features(encoder))):
+        raise ValueError('%s.vocabulary.json numbers the columns differently, remove it to write a new dataset' % prefix)
+    if added:
+        vocabulary.save()
+    with open(prefix + '.features.json', 'w') as f:
+        json.dump(vocabulary.features, f)
+    encoder.save(prefix + '.encoder.json')
+
+def check_encoder(encoder, encoder_file):
+    '''raise when a value of the saved encoder has another feature id in `encoder`: the checkpoints
+    trained on the saved ids would silently read other rows'''
+    if not os.path.exists(encoder_file):
+        return
+    saved = FeatureEncoder.load(encoder_file)
+    for field, values in saved.vocabulary.items():
+        ids = encoder.vocabulary.get(field, {})
+        changed = [value for value, feature in values.items() if ids.get(value) != feature]
+        if changed:
+            raise ValueError('%s: the feature id of %s=%s changed (%d values); extend the saved encoder '
+                             'instead of fitting a new one, or remove it to start a new dataset'
+                             % (encoder_file, field, changed[0], len(changed)))
@@ -0,0 +1,42 @@
+'''
+Labels of the frappe interaction log, computed with column operations
+
+The label of an interaction is its share of the usage count of the same user in the same context:
+    user_rate = cnt / context_total_cnt * 100
+where context_total_cnt sums cnt over all items used by the user in that context. A single use in a
+context that saw nothing else carries no preference and is labeled 50. The rates are then min-max
+scaled to [-1, 1].
+'''
+import numpy as np
+
+CONTEXT_COLUMNS = ['user', 'daytime', 'weekday', 'isweekend', 'homework', 'cost', 'weather', 'country', 'city']
+
+
+def context_totals(data, context_columns=CONTEXT_COLUMNS):  # sum of cnt over the rows of the same user and context
+    return data.groupby(context_columns, sort=False, observed=True)['cnt'].transform('sum').values
+
+def user_rate(cnt, context_total_cnt):
+    cnt = np.asarray(cnt, dtype=np.float64)
+    context_total_cnt = np.asarray(context_total_cnt, dtype=np.float64)
+    return np.where((cnt == 1) & (context_total_cnt == 1), 50.0, cnt / context_total_cnt * 100)
+
+def min_max_scale(values, feature_range=(-1, 1), data_min=None, data_max=None):
+    '''MinMaxScaler.fit_transform on one column
+    :param data_min, data_max: bounds of the whole data set when `values` is only a part of it
+    '''
+    low, high = feature_range
+    data_min = np.min(values) if data_min is None else data_min
+    data_max = np.max(values) if data_max is None else data_max
+    data_range = data_max - data_min
+    if data_range == 0:  # constant column, as MinMaxScaler: values map to the low end
+        data_range = 1.0
+    return (values - data_min) * ((high - low) / data_range) + low
+
+def label(data, context_columns=CONTEXT_COLUMNS, scale=True):
+    '''add the context_total_cnt and user_rate columns to the log
+    :param scale: min-max scale user_rate to [-1, 1]
+    '''
+    data['context_total_cnt'] = context_totals(data, context_columns)
+    rate = user_rate(data['cnt'].values, data['context_total_cnt'].values)
+    data['user_rate'] = min_max_scale(rate) if scale else rate
+    return data
@@ -0,0 +1,224 @@
+'''
+Sharded, parallel preprocessing of large interaction logs
+
+1. partition: the csv is streamed in chunks and every row goes to the shard of hash(user), so the
+   (user, context) groups of the labels never span two shards. The values of every field are
+   collected on the way and frozen into one FeatureEncoder shared by all shards. The vocabulary of
+   --encoder, by default the <path><dataset>.encoder.json of a previous run, is kept and only grown by
+   the values it does not know yet, so the feature ids trained checkpoints use never change.
+2. label + encode (parallel): each shard is labeled with unscaled rates, one-hot encoded with the
+   frozen vocabulary and split into train/validation/test by a hash of the row, independent of the
+   shard and of the other rows.
+3. scale + write (parallel): rates are min-max scaled with the global min/max of phase 2 and the
+   shard sets are written as libfm and/or binary.
+4. merge: the shard files are concatenated, in shard order, into <path><dataset>.<set>.*
+
+A manifest in the work directory records a checksum of every shard and of the vocabulary: on a re-run
+only the shards whose content changed are labeled again, and only the shards whose scaling changed
+are written again.
+
+usage (from src/):
+python -m preprocessing.pipeline --csv ../data/raw/frappe_dataset.csv --path ../data/frappe/ --dataset frappe --format both
+'''
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from time import time
+from model.encoder import FeatureEncoder, FIELDS
+from preprocessing.labeling import label, min_max_scale, CONTEXT_COLUMNS
+from preprocessing.encoding import to_csr, write_libfm, write_features
+
+SETS = ['train', 'validation', 'test']
+
+#################### Arguments ####################
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sharded parallel preprocessing.")
+    parser.add_argument('--csv', nargs='?', default='../data/raw/frappe_dataset.csv',
+                        help='Raw interaction log.')
+    parser.add_argument('--path', nargs='?', default='../data/processed/',
+                        help='Output directory.')
+    parser.add_argument('--dataset', nargs='?', default='frappe',
+                        help='Prefix of the output files.')
+    parser.add_argument('--work_dir', nargs='?', default=None,
+                        help='Directory of the shards and of the manifest (default: <path><dataset>.shards/).')
+    parser.add_argument('--shards', type=int, default=16,
+                        help='Number of user hash partitions.')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes (default: number of CPUs).')
+    parser.add_argument('--chunk_size', type=int, default=1000000,
+                        help='Rows read from the csv at a time.')
+    parser.add_argument('--split', nargs='?', default='[0.6,0.2,0.2]',
+                        help='Fractions of the train, validation and test sets.')
+    parser.add_argument('--format', nargs='?', default='libfm',
+                        help='libfm, binary (the .npy files of LoadData) or both.')
+    parser.add_argument('--encoder', nargs='?', default=None,
+                        help='Existing encoder.json to keep the feature ids of, new values are appended. Default: the encoder of the previous run, if any.')
+    return parser.parse_args()
+
+def checksum(file):
+    md5 = hashlib.md5()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+def row_hash(frame, columns):  # deterministic 64-bit hash of the given columns of every row
+    return pd.util.hash_pandas_object(frame[columns].astype(str), index=False).values
+
+def shard_file(work_dir, shard):
+    return os.path.join(work_dir, 'shard-%05d' % shard)
+
+def partition(csv, work_dir, num_shards, chunk_size, fields=FIELDS):
+    '''hash(user) partitioning of the csv; return the values seen for every field'''
+    values = dict((field, set()) for field in fields)
+    files = [shard_file(work_dir, shard) + '.csv' for shard in range(num_shards)]
+    header = True
+    for chunk in pd.read_csv(csv, sep="\t", chunksize=chunk_size):
+        shards = row_hash(chunk, ['user']) % num_shards
+        for shard, rows in chunk.groupby(shards, sort=False):
+            rows.to_csv(files[shard], sep="\t", index=False, header=header, mode='w' if header else 'a')
+        if header:
+            # shards without rows in the first chunk still get a header
+            for shard in set(range(num_shards)) - set(np.unique(shards).tolist()):
+                chunk.iloc[:0].to_csv(files[shard], sep="\t", index=False)
+        header = False
+        for field in fields:
+            values[field].update(chunk[field].unique().tolist())
+    return values
+
+def split_of(frame, fractions, columns):  # 0, 1, 2 = train, validation, test, from a hash of the row
+    buckets = (row_hash(frame, columns) % 1000000) / 1000000.0
+    return np.searchsorted(np.cumsum(fractions)[:-1], buckets, side='right')
+
+def label_shard(task):
+    '''phase 2: label, encode and split one shard; return the min/max of its unscaled rates'''
+    shard, encoder_file, fractions = task
+    data = pd.read_csv(shard + '.csv', sep="\t")
+    encoder = FeatureEncoder.load(encoder_file)
+    if len(data) == 0:
+        for name in SETS:
+            np.save('%s.%s.X.npy' % (shard, name), np.empty((0, len(encoder.fields)), dtype=np.int32))
+            np.save('%s.%s.rate.npy' % (shard, name), np.empty(0))
+        return None, None
+    data = label(data, CONTEXT_COLUMNS, scale=False)
+    X = encoder.encode_frame(data)
+    sets = split_of(data, fractions, list(data.columns.drop(['context_total_cnt', 'user_rate'])))
+    for i, name in enumerate(SETS):
+        np.save('%s.%s.X.npy' % (shard, name), X[sets == i])
+        np.save('%s.%s.rate.npy' % (shard, name), data['user_rate'].values[sets == i])
+    return float(data['user_rate'].min()), float(data['user_rate'].max())
+
+def write_shard(task):
+    '''phase 3: scale the rates of one shard with the global bounds and write its sets'''
+    shard, data_min, data_max, format, num_features = task
+    for name in SETS:
+        X = np.load('%s.%s.X.npy' % (shard, name))
+        Y = min_max_scale(np.load('%s.%s.rate.npy' % (shard, name)), data_min=data_min, data_max=data_max)
+        np.save('%s.%s.Y.npy' % (shard, name), Y.astype(np.float32))
+        if format in ('libfm', 'both'):
+            write_libfm(to_csr(X, num_features), Y, '%s.%s.libfm' % (shard, name))
+    return shard
+
+def merge(shards, prefix, format):
+    '''phase 4: concatenate the shard sets in shard order'''
+    counts = {}
+    for name in SETS:
+        if format in ('libfm', 'both'):
+            with open('%s.%s.libfm' % (prefix, name), 'wb') as out:
+                for shard in shards:
+                    with open('%s.%s.libfm' % (shard, name), 'rb') as f:
+                        shutil.copyfileobj(f, out)
+        Xs = [np.load('%s.%s.X.npy' % (shard, name), mmap_mode='r') for shard in shards]
+        counts[name] = sum(len(X) for X in Xs)
+        if format in ('binary', 'both'):
+            # written through a memory map, the whole set is never held in memory
+            width = Xs[0].shape[1]
+            X_out = np.lib.format.open_memmap('%s.%s.X.npy' % (prefix, name), mode='w+', dtype=np.int32,
+                                              shape=(counts[name], width))
+            Y_out = np.lib.format.open_memmap('%s.%s.Y.npy' % (prefix, name), mode='w+', dtype=np.float32,
+                                              shape=(counts[name],))
+            start = 0
+            for shard, X in zip(shards, Xs):
+                X_out[start:start + len(X)] = X
+                Y_out[start:start + len(X)] = np.load('%s.%s.Y.npy' % (shard, name))
+                start += len(X)
+            X_out.flush()
+            Y_out.flush()
+    return counts
+
+def run(csv, path, dataset, work_dir=None, num_shards=16, workers=None, chunk_size=1000000,
+        fractions=(0.6, 0.2, 0.2), format='libfm', encoder_file=None):
+    prefix = path + dataset
+    work_dir = work_dir or prefix + '.shards'
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    manifest_file = os.path.join(work_dir, 'manifest.json')
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    # a different layout invalidates every shard
+    layout = {'shards': num_shards, 'split': list(fractions), 'format': format}
+    if manifest.get('layout') != layout:
+        manifest = {'layout': layout, 'shards': {}}
+
+    if encoder_file is None and os.path.exists(prefix + '.encoder.json'):
+        # a re-run keeps the feature ids of the previous one
+        encoder_file = prefix + '.encoder.json'
+    t = time()
+    values = partition(csv, work_dir, num_shards, chunk_size)
+    if encoder_file is None:
+        encoder = FeatureEncoder.from_categories(FIELDS, [list(values[field]) for field in FIELDS])
+    else:
+        # the ids of the given vocabulary are kept, values new in this log are appended
+        encoder = FeatureEncoder.load(encoder_file)
+        added = encoder.extend([list(values[field]) for field in encoder.fields])
+        if added:
+            print("%d new feature values appended to the vocabulary" % added)
+    frozen_file = os.path.join(work_dir, 'encoder.json')
+    encoder.save(frozen_file)
+    vocabulary = checksum(frozen_file)
+    num_features = sum(len(v) for v in encoder.vocabulary.values())
+    print("partitioned into %d shards [%.1f s]" % (num_shards, time() - t))
+
+    shards = [shard_file(work_dir, shard) for shard in range(num_shards)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # phase 2, only the shards whose rows or vocabulary changed
+        state = manifest['shards']
+        signatures = dict((shard, checksum(shard + '.csv')) for shard in shards)
+        stale = [shard for shard in shards if state.get(shard, {}).get('signature') != signatures[shard]
+                 or state[shard].get('vocabulary') != vocabulary]
+        t = time()
+        for shard, bounds in zip(stale, executor.map(label_shard, [(shard, frozen_file, fractions) for shard in stale])):
+            state[shard] = {'signature': signatures[shard], 'vocabulary': vocabulary, 'bounds': bounds}
+        print("labeled %d of %d shards [%.1f s]" % (len(stale), num_shards, time() - t))
+
+        # global bounds of the rates, as MinMaxScaler on the whole log
+        bounds = [state[shard]['bounds'] for shard in shards if state[shard]['bounds'][0] is not None]
+        data_min, data_max = min(b[0] for b in bounds), max(b[1] for b in bounds)
+
+        # phase 3, the shards labeled again or scaled with other bounds
+        rewrite = [shard for shard in shards if state[shard].get('scaled') != [data_min, data_max]]
+        t = time()
+        for shard in executor.map(write_shard, [(shard, data_min, data_max, format, num_features) for shard in rewrite]):
+            state[shard]['scaled'] = [data_min, data_max]
+        print("wrote %d of %d shards [%.1f s]" % (len(rewrite), num_shards, time() - t))
+
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f)
+
+    t = time()
+    counts = merge(shards, prefix, format)
+    write_features(encoder, prefix)
+    print("merged %s [%.1f s]" % (', '.join('%s=%d' % (name, counts[name]) for name in SETS), time() - t))
+    return counts
+
+if __name__ == '__main__':
+    args = parse_args()
+    run(args.csv, args.path, args.dataset, args.work_dir, args.shards, args.workers, args.chunk_size,
+        eval(args.split), args.format, args.encoder)
@@ -1,6 +1,9 @@
+import argparse
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import OneHotEncoder, MinMaxScaler
+from preprocessing.labeling import label, CONTEXT_COLUMNS
+from preprocessing.encoding import fit_encoder, encode, write_libfm, write_binary, write_features
 
 def load_data():
     # Load the dataset
@@ -11,21 +14,9 @@ def load_data():
     # merged_data = pd.merge(user_data, item_data, on='item')
     return user_data
 
-def calculate_user_rate(row):
-    if row['cnt'] == 1 and row['context_total_cnt'] == 1:
-        return 50
-    return (row['cnt'] / row['context_total_cnt']) * 100
-
 def preprocess_data(data):
-    context_columns = ['user', 'daytime', 'weekday', 'isweekend', 'homework', 'cost', 'weather', 'country', 'city']
-    
-    # Calculate the total cnt for each context
-    data['context_total_cnt'] = data.groupby(context_columns)['cnt'].transform('sum')
-    
-    # Calculate user rate
-    data['user_rate'] = data.apply(calculate_user_rate, axis=1)
-    scaler = MinMaxScaler(feature_range=(-1, 1))
-    data['user_rate'] = scaler.fit_transform(data['user_rate'].values.reshape(-1, 1))
+    # Calculate the total cnt for each context, the user rate and scale it to [-1, 1]
+    data = label(data, CONTEXT_COLUMNS)
     # Select relevant features
     features = ['user', 'item', 'daytime', 'weekday', 'isweekend', 'homework', 'cost', 'weather', 
                 'country', 'city', 'user_rate']
@@ -33,42 +24,44 @@ def preprocess_data(data):
     
     return data
 
-def encode_data(data):
-    # Prepare the encoder
-    categorical_features = ['user', 'item', 'daytime', 'weekday', 'isweekend', 'homework', 'cost'
-                            'weather', 'country', 'city']
-    encoder = OneHotEncoder(sparse=False)
-    encoded_features = encoder.fit_transform(data[categorical_features])
-    
-    # Create a DataFrame with encoded features
-    encoded_df = pd.DataFrame(encoded_features, columns=encoder.get_feature_names(categorical_features))
-    
-    # Combine with numeric features and the target variable
-    numeric_features = data[[ 'user_rate']]
-    final_data = pd.concat([encoded_df, numeric_features], axis=1)
-    
-    return final_data
+def encode_data(data, encoder_file=None):
+    # Fit the vocabulary once, or grow the one of a previous run, and one-hot encode every row as a sparse matrix
+    encoder = fit_encoder(data, encoder_file=encoder_file)
+    X = encode(data, encoder)
+    return encoder, X, data['user_rate'].values
 
-def split_data(data):
-    train_data, temp_data = train_test_split(data, test_size=0.4, random_state=42)
+def split_data(num_rows):
+    # row indexes of the train, validation and test sets
+    train_data, temp_data = train_test_split(np.arange(num_rows), test_size=0.4, random_state=42)
     val_data, test_data = train_test_split(temp_data, test_size=0.5, random_state=42)
     return train_data, val_data, test_data
 
-def save_to_libfm(data, filename):
-    with open(filename, 'w') as f:
-        for index, row in data.iterrows():
-            label = row['user_rate']
-            features = row.drop('user_rate')
-            feature_str = " ".join([f"{i+1}:{val}" for i, val in enumerate(features) if val != 0])
-            f.write(f"{label} {feature_str}\n")
+def save_to_libfm(X, Y, filename):
+    write_libfm(X, Y, filename)
+
+#################### Arguments ####################
+def parse_args():
+    parser = argparse.ArgumentParser(description="Label, encode and split the frappe log.")
+    parser.add_argument('--path', nargs='?', default='../data/processed/',
+                        help='Output directory.')
+    parser.add_argument('--dataset', nargs='?', default='frappe',
+                        help='Prefix of the output files.')
+    parser.add_argument('--format', nargs='?', default='libfm',
+                        help='libfm, binary (the .npy files of LoadData) or both.')
+    return parser.parse_args()
 
 if __name__ == "__main__":
+    args = parse_args()
     data = load_data()
     data = preprocess_data(data)
-    data = encode_data(data)
+    prefix = args.path + args.dataset
+    encoder, X, Y = encode_data(data, prefix + '.encoder.json')
     
-    train_data, val_data, test_data = split_data(data)
+    train_data, val_data, test_data = split_data(X.shape[0])
     
-    save_to_libfm(train_data, "../data/processed/frappe.train.libfm")
-    save_to_libfm(val_data, "../data/processed/frappe.validation.libfm")
-    save_to_libfm(test_data, "../data/processed/frappe.test.libfm")
+    for name, rows in [('train', train_data), ('validation', val_data), ('test', test_data)]:
+        if args.format in ('libfm', 'both'):
+            save_to_libfm(X[rows], Y[rows], "%s.%s.libfm" % (prefix, name))
+        if args.format in ('binary', 'both'):
+            write_binary(X[rows], Y[rows], prefix, name)
+    write_features(encoder, prefix)
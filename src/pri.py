@@ -1,25 +1,9 @@
-import pandas as pd
-from sklearn.preprocessing import OneHotEncoder, StandardScaler
-
-def load_data():
-    # Load the dataset
-    user_data = pd.read_csv('../data/raw/frappe_dataset.csv', sep="\t")
-    return user_data
+from model.encoder import load_encoder
 
 
 def convertData(data):
-    df = load_data()
-    context_features = ['user','item','daytime', 'weekday', 'isweekend', 'homework', 'weather', 'country', 'city']
-    encoder = OneHotEncoder()
-    encoder.fit(df[context_features])
-    transformed_data = encoder.transform([data])
-    transformed_data = transformed_data.toarray()
-
-    converted_data = []
-
-    for i in range(len(transformed_data[0])):
-        if transformed_data[0][i] == 1:
-            converted_data.append(i)
+    encoder = load_encoder(csv_file='../data/raw/frappe_dataset.csv')
+    converted_data = encoder.encode(data)
     print("Converted Data: ", converted_data)
     # print("Encoder Categories:\n", encoder.categories_)
     Y = []
@@ -0,0 +1,107 @@
+'''
+Cache of ranked recommendations keyed on (user, context)
+
+Frappe contexts take few values, so the same (user, context) pair comes back often.
+Ranked item ids are kept in an in-process LRU with a time to live, optionally backed by
+a local SQLite file that survives worker restarts. Entries are tied to the version of the model
+the process serves (a signature of the model files taken when the predictor is loaded): rankings
+of another version are dropped when a worker starts, a new model is picked up by restarting the
+workers, so a ranking is never stored under a version its model did not produce.
+'''
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from time import time
+
+
+def model_version(paths):
+    '''signature of the model files: name, size and mtime of every file under the given paths'''
+    signature = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, name) for name in os.listdir(path))
+        else:
+            # a checkpoint prefix or a single file: every file of its directory starting with it
+            directory, prefix = os.path.split(path)
+            directory = directory or '.'
+            files = sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.startswith(prefix)) \
+                if os.path.isdir(directory) else []
+        for file in files:
+            stat = os.stat(file)
+            signature.append('%s:%d:%d' % (os.path.basename(file), stat.st_size, int(stat.st_mtime)))
+    return '|'.join(signature)
+
+
+class ResultCache(object):
+    '''LRU cache with TTL of ranked item ids
+    :param max_size: entries kept in memory
+    :param ttl: seconds an entry stays valid
+    :param version: model_version of the model files the served predictor was loaded from
+    :param db_file: optional SQLite file used as a second tier
+    '''
+
+    def __init__(self, max_size=10000, ttl=3600, version='', db_file=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires, value)
+        self.lock = threading.Lock()
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        self.version = version
+
+        self.db = None
+        if db_file:
+            self.db = sqlite3.connect(db_file, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, version TEXT, expires REAL, value TEXT)')
+            self.db.execute('DELETE FROM results WHERE version != ? OR expires < ?', (self.version, time()))
+            self.db.commit()
+
+    def key(self, user, context, k, exclude=None):
+        # normalized: values compared as strings, exclusions as a sorted set
+        exclude = sorted(set(str(item) for item in exclude)) if exclude else []
+        return json.dumps([str(user), [str(value) for value in context], int(k), exclude])
+
+    def get(self, key):
+        with self.lock:
+            now = time()
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+
+            if self.db is not None:
+                row = self.db.execute('SELECT expires, value FROM results WHERE key = ? AND version = ? AND expires > ?',
+                                      (key, self.version, now)).fetchone()
+                if row is not None:
+                    value = json.loads(row[1])
+                    self._store(key, row[0], value)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self.lock:
+            expires = time() + self.ttl
+            self._store(key, expires, value)
+            if self.db is not None:
+                self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', (key, self.version, expires, json.dumps(value)))
+                self.db.commit()
+
+    def _store(self, key, expires, value):
+        self.entries[key] = (expires, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / float(lookups) if lookups else 0.0,
+                    'size': len(self.entries), 'max_size': self.max_size, 'evictions': self.evictions,
+                    'version': self.version}
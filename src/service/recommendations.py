@@ -1,34 +1,63 @@
-from model.IFM import infer 
 from scipy import stats
 hidden_factors = [8, 256]
 
 
 class RecommendationService:
 
-    def __init__(self, db):
+    def __init__(self, db, predictor, cache=None, catalogue=None):
         self.db = db
+        self.predictor = predictor
+        # optional ResultCache of ranked item ids (service/cache.py)
+        self.cache = cache
+        # optional in-memory Catalogue of item documents (data/database.py)
+        self.catalogue = catalogue
 
-    def get_recommendations(self, user_id, contexts):
-        # Example function to get recommendations based on user_id and context
-        # Implement your recommendation logic here
-        pretrain_path = '../pretrain/fm_frappe_256/frappe_256'
-        path = '../data/'
-        dataset = 'frappe'
-        
-        data_instance = []
-        # data_instance = [2, 1, 'morning', 'monday', 'workday', 'home', 'sunny', 'Spain', 0]
-        data_instance.append(int(user_id))
-        data_instance.append(1)
-        # print(contexts)
+    def get_items(self, item_ids):
+        '''item documents of the given ids in the same order'''
+        if self.catalogue is not None:
+            return self.catalogue.get_items(item_ids)
+        # keep the ranking order, $in returns documents in storage order
+        items = {item['item']: item for item in self.db.items.find({'item': {'$in': list(item_ids)}}, {'_id': 0})}
+        return [items[item] for item in item_ids if item in items]
 
-        for context in contexts:
-            data_instance.append(context['value'])
+    def rank(self, users, contexts, k, excludes=None):
+        '''ranked item ids per request, served from the cache when possible
+        return: list of lists of item ids
+        '''
+        if excludes is None:
+            excludes = [None] * len(users)
+        if self.cache is None:
+            keys = [None] * len(users)
+            results = [None] * len(users)
+        else:
+            keys = [self.cache.key(user, context, k, exclude) for user, context, exclude in zip(users, contexts, excludes)]
+            results = [self.cache.get(key) for key in keys]
+
+        misses = [i for i, result in enumerate(results) if result is None]
+        if len(misses) == 1:
+            i = misses[0]
+            computed = [self.predictor.top_k(users[i], contexts[i], k, excludes[i])]
+        elif misses:
+            miss_excludes = [excludes[i] for i in misses]
+            computed = self.predictor.top_k_batch([users[i] for i in misses], [contexts[i] for i in misses], k,
+                                                  miss_excludes if any(miss_excludes) else None)
+        else:
+            computed = []
+        for i, result in zip(misses, computed):
+            results[i] = result.tolist()
+            if self.cache is not None:
+                self.cache.set(keys[i], results[i])
+        return results
 
-        # print(data_instance)
-        result = infer(path, dataset, pretrain_path, data_instance, 3)
-        result = result  - 957
+    def get_recommendations(self, user_id, contexts, exclude=None):
+        # contexts: list of {'type', 'value'} in the encoder field order
+        # exclude: item ids never to recommend, e.g. apps the user already has
+        context_values = []
+        for context in contexts:
+            context_values.append(context['value'])
 
-        items = self.db.items.find({'item': {'$in': result.tolist()}})
+        result = self.rank([int(user_id)], [context_values], 3, [exclude])[0]
+        items = self.get_items(result)
         # items = []
         # explanations = []
         # for item in result:
@@ -38,6 +67,59 @@ class RecommendationService:
         # print(explanations)
         return items
 
+    def parse_request(self, r, context_fields):
+        '''(user, context values, exclude) of one batch entry; ValueError when it is malformed or
+        has a value the encoder does not know
+        '''
+        if not isinstance(r, dict) or 'userId' not in r or not isinstance(r.get('context'), dict):
+            raise ValueError('Expected {"userId": ..., "context": {field: value}}')
+        try:
+            user = int(r['userId'])
+        except (TypeError, ValueError):
+            raise ValueError('Invalid userId %r' % (r['userId'],))
+        missing = [field for field in context_fields if field not in r['context']]
+        if missing:
+            raise ValueError('Missing context fields %s' % ', '.join(missing))
+        context = [r['context'][field] for field in context_fields]
+        exclude = r.get('exclude')
+        if exclude is not None and not isinstance(exclude, list):
+            raise ValueError('exclude must be a list of item ids')
+        # unknown values fail this entry only, not the whole batch
+        encoder = self.predictor.encoder
+        encoder.feature_id('user', user)
+        for field, value in zip(context_fields, context):
+            encoder.feature_id(field, value)
+        return user, context, exclude
+
+    def get_recommendations_batch(self, requests, k=3):
+        '''recommendations for many user/context pairs at once
+        :param requests: list of {'userId': ..., 'context': {field: value}, 'exclude': [item ids] (optional)}
+        return: one entry per request, the list of its item documents best first, or {'error': message}
+        when the request is invalid
+        '''
+        context_fields = [field for field in self.predictor.encoder.fields if field not in ('user', 'item')]
+        results = [None] * len(requests)
+        valid, users, contexts, excludes = [], [], [], []
+        for i, r in enumerate(requests):
+            try:
+                user, context, exclude = self.parse_request(r, context_fields)
+            except ValueError as e:
+                results[i] = {'error': str(e)}
+                continue
+            valid.append(i)
+            users.append(user)
+            contexts.append(context)
+            excludes.append(exclude)
+
+        ranked = self.rank(users, contexts, k, excludes) if valid else []
+
+        # a single lookup for the union of all recommended items
+        item_ids = sorted(set(item for result in ranked for item in result))
+        items = {item['item']: item for item in self.get_items(item_ids)}
+        for i, result in zip(valid, ranked):
+            results[i] = [items[item] for item in result if item in items]
+        return results
+
     # def compute_oic(self, item_id, context, context_value):
     #     # Number of interactions where item is equal to item_id and context is equal to context_value
     #     return self.db['interactions'].count_documents({'item': item_id, context: context_value})
@@ -0,0 +1,66 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+# the modules are imported from src/, as when the service runs
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data.config import Config
+from data.database import close_client
+from model.encoder import FeatureEncoder
+from model.scorer import NumpyFM
+
+USERS, ITEMS = 5, 6
+
+
+def interactions(rows=60, seed=2016):
+    rng = np.random.RandomState(seed)
+    columns = {'user': rng.randint(USERS, size=rows), 'item': rng.randint(ITEMS, size=rows),
+               'cnt': rng.randint(1, 10, size=rows), 'cost': 'free'}
+    values = {'daytime': ['morning', 'evening'], 'weekday': ['monday', 'sunday'], 'isweekend': ['workday', 'weekend'],
+              'homework': ['home', 'work'], 'weather': ['sunny', 'rainy'], 'country': ['Spain', 'Germany'], 'city': [1, 2]}
+    for field, choices in values.items():
+        columns[field] = np.array(choices)[rng.randint(len(choices), size=rows)]
+    frame = pd.DataFrame(columns)
+    frame['user'] = np.arange(rows) % USERS  # every user and item appears
+    frame['item'] = np.arange(rows) % ITEMS
+    return frame
+
+
+@pytest.fixture
+def config(tmp_path):
+    frame = interactions()
+    raw_file, meta_file = tmp_path / 'frappe_dataset.csv', tmp_path / 'meta.csv'
+    frame.to_csv(raw_file, sep='\t', index=False)
+    pd.DataFrame({'item': np.arange(ITEMS), 'name': ['app %d' % i for i in range(ITEMS)]}).to_csv(meta_file, sep='\t', index=False)
+
+    encoder = FeatureEncoder.fit(frame)
+    encoder_file = tmp_path / 'frappe.encoder.json'
+    encoder.save(str(encoder_file))
+    features_M = sum(len(values) for values in encoder.vocabulary.values())
+    rng = np.random.RandomState(0)
+    weights_file = tmp_path / 'fm.npz'
+    np.savez(str(weights_file), model=np.array('fm'), feature_embeddings=rng.normal(0, 0.1, (features_M, 8)).astype(np.float32),
+             feature_bias=rng.normal(0, 0.1, features_M).astype(np.float32), bias=np.float32(0.0))
+
+    class TestConfig(Config):
+        MONGO_MOCK = True
+        MONGO_DB_NAME = 'test_%s' % tmp_path.name
+        RAW_DATA_FILE = str(raw_file)
+        META_DATA_FILE = str(meta_file)
+        ENCODER_FILE = str(encoder_file)
+        WEIGHTS_FILE = str(weights_file)
+        LOAD_CHUNK_SIZE = 16
+        CACHE_FILE = None
+    yield TestConfig
+    close_client()
+
+
+def fm_predictor(seed=0):
+    encoder = FeatureEncoder.fit(interactions())
+    features_M = sum(len(values) for values in encoder.vocabulary.values())
+    rng = np.random.RandomState(seed)
+    return NumpyFM({'feature_embeddings': rng.normal(0, 0.3, (features_M, 8)).astype(np.float32),
+                    'feature_bias': rng.normal(0, 0.3, features_M).astype(np.float32), 'bias': np.float32(0.5)}, encoder)
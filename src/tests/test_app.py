@@ -0,0 +1,68 @@
+'''
+create_app against mongomock (Config.MONGO_MOCK) with a small generated dataset and random FM weights
+
+usage (from src/):
+python -m pytest -q tests
+'''
+import pytest
+
+import app as app_module
+from conftest import ITEMS, USERS
+
+CONTEXT = {'daytime': 'morning', 'weekday': 'monday', 'isweekend': 'workday', 'homework': 'home',
+           'weather': 'sunny', 'country': 'Spain', 'city': 1}
+
+
+@pytest.fixture
+def client(config):
+    return app_module.create_app(config).test_client()
+
+
+def test_import_builds_nothing():
+    assert not hasattr(app_module, 'app')
+
+
+def test_create_app_loads_csv(config):
+    service = app_module.create_app(config).extensions['recommendation_service']
+    db = service.db
+    assert db.interactions.count_documents({}) == 60
+    assert db.items.count_documents({}) == ITEMS
+    assert sorted(doc['user'] for doc in db.users.find()) == list(range(USERS))
+    assert sorted(service.catalogue.context_values()['weather']) == ['rainy', 'sunny']
+
+
+def test_index(client):
+    response = client.get('/')
+    assert response.status_code == 200
+    assert b'morning' in response.data
+
+
+def test_recommend_batch(client):
+    response = client.post('/recommend/batch', json={'k': 2, 'requests': [
+        {'userId': 1, 'context': CONTEXT},
+        {'userId': 2, 'context': CONTEXT, 'exclude': [0, 1, 2]},
+        {'userId': 99, 'context': CONTEXT},
+        {'userId': 3, 'context': dict(CONTEXT, weather='snow')},
+        {'userId': 4}]})
+    assert response.status_code == 200
+    recommendations = response.get_json()['recommendations']
+    assert [len(items) for items in recommendations[:2]] == [2, 2]
+    assert all(item['item'] not in (0, 1, 2) for item in recommendations[1])
+    assert 'user' in recommendations[2]['error']
+    assert 'weather' in recommendations[3]['error']
+    assert 'error' in recommendations[4]
+
+
+@pytest.mark.parametrize('payload', [None, [], {'k': 3}, {'requests': {}}, {'requests': [], 'k': 0}, {'requests': [], 'k': '3'}])
+def test_recommend_batch_malformed(client, payload):
+    response = client.post('/recommend/batch', json=payload)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_cache_hit(client):
+    body = {'k': 3, 'requests': [{'userId': 1, 'context': CONTEXT}]}
+    first = client.post('/recommend/batch', json=body).get_json()
+    second = client.post('/recommend/batch', json=body).get_json()
+    assert first == second
+    assert client.get('/cache/stats').get_json()['hits'] == 1
@@ -0,0 +1,35 @@
+'''
+Mini-batches of model/batcher.py
+'''
+import numpy as np
+import pytest
+
+from model.batcher import Batcher
+
+
+def dataset(num_example):
+    return {'X': np.arange(num_example * 2, dtype=np.int32).reshape(num_example, 2), 'Y': np.arange(num_example, dtype=np.float32)}
+
+
+@pytest.mark.parametrize('num_example, batch_size, min_batch, sizes', [
+    (10, 4, 1, [4, 4, 2]),
+    (10, 4, 3, [4, 6]),  # the tail of 2 rows would leave a tower of 3 empty
+    (8, 4, 4, [4, 4]),
+    (3, 4, 4, [3]),
+    (0, 4, 2, []),
+])
+def test_batch_sizes(num_example, batch_size, min_batch, sizes):
+    batcher = Batcher(dataset(num_example), batch_size, prefetch=0, min_batch=min_batch)
+    batches = list(batcher)
+    assert [len(batch['Y']) for batch in batches] == sizes
+    assert len(batcher) == len(sizes)
+    # every sample once per epoch
+    assert sorted(np.concatenate([batch['Y'].ravel() for batch in batches] + [np.empty(0)]).tolist()) == list(range(num_example))
+
+
+def test_prefetch_same_batches():
+    np.random.seed(0)
+    direct = [batch['Y'].ravel().tolist() for batch in Batcher(dataset(11), 4, prefetch=0, min_batch=4)]
+    np.random.seed(0)
+    prefetched = [batch['Y'].ravel().tolist() for batch in Batcher(dataset(11), 4, prefetch=2, min_batch=4)]
+    assert direct == prefetched
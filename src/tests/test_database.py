@@ -0,0 +1,52 @@
+'''
+Resumable csv loads of data/database.py against mongomock
+'''
+import pytest
+
+import data.database as database
+from conftest import ITEMS, USERS
+
+
+def interrupted_load(config, monkeypatch, after_chunks):
+    '''start load_csv_to_mongodb and stop it after `after_chunks` interaction chunks'''
+    db = database.get_client(config)[config.MONGO_DB_NAME]
+    insert_batch, calls = database.insert_batch, []
+
+    def failing_insert(collection, docs):
+        if collection.name == 'interactions':
+            if len(calls) == after_chunks:
+                raise RuntimeError('interrupted')
+            calls.append(len(docs))
+        return insert_batch(collection, docs)
+    monkeypatch.setattr(database, 'insert_batch', failing_insert)
+    with pytest.raises(RuntimeError):
+        database.load_csv_to_mongodb(db, config.RAW_DATA_FILE, config.META_DATA_FILE, config.LOAD_CHUNK_SIZE)
+    monkeypatch.setattr(database, 'insert_batch', insert_batch)
+    return db
+
+
+def connect(config):
+    connection = database.MongoDBConnection(db_name=config.MONGO_DB_NAME, client=database.get_client(config))
+    connection.connect(config.RAW_DATA_FILE, config.META_DATA_FILE, config.LOAD_CHUNK_SIZE)
+    return connection.db
+
+
+def test_connect_resumes_interrupted_load(config, monkeypatch):
+    db = interrupted_load(config, monkeypatch, after_chunks=2)
+    assert db.interactions.count_documents({}) == 2 * config.LOAD_CHUNK_SIZE
+    assert database.load_unfinished(db)
+
+    db = connect(config)
+    assert not database.load_unfinished(db)
+    assert db.interactions.count_documents({}) == 60
+    assert sorted(db.interactions.distinct('_id')) == list(range(60))
+    assert db.items.count_documents({}) == ITEMS
+    assert sorted(db.users.distinct('user')) == list(range(USERS))
+
+
+def test_connect_keeps_finished_load(config, monkeypatch):
+    db = connect(config)
+    db.interactions.delete_one({'_id': 0})
+    # a finished load is not read again
+    db = connect(config)
+    assert db.interactions.count_documents({}) == 59
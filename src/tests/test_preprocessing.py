@@ -0,0 +1,43 @@
+'''
+Feature ids of the preprocessing pipeline across runs
+'''
+import json
+import pandas as pd
+import pytest
+
+from conftest import interactions
+from model.encoder import FeatureEncoder
+from preprocessing.encoding import check_encoder
+from preprocessing.pipeline import run
+
+
+def run_pipeline(frame, path):
+    csv = str(path / 'log.csv')
+    frame.to_csv(csv, sep='\t', index=False)
+    run(csv, str(path) + '/', 'frappe', num_shards=2, workers=1, format='binary')
+    return FeatureEncoder.load(str(path / 'frappe.encoder.json'))
+
+
+def test_rerun_keeps_feature_ids(tmp_path):
+    frame = interactions()
+    first = run_pipeline(frame, tmp_path)
+    # a user sorted before every other one would shift all the later ids of a refitted encoder
+    new_rows = frame.iloc[:3].copy()
+    new_rows['user'] = -1
+    second = run_pipeline(pd.concat([frame, new_rows]), tmp_path)
+    for field, values in first.vocabulary.items():
+        for value, feature in values.items():
+            assert second.vocabulary[field][value] == feature
+    assert second.vocabulary['user']['-1'] == sum(len(values) for values in first.vocabulary.values())
+    with open(str(tmp_path / 'frappe.features.json')) as f:
+        assert len(json.load(f)) == sum(len(values) for values in second.vocabulary.values())
+
+
+def test_renumbered_encoder_is_rejected(tmp_path):
+    frame = interactions()
+    saved = FeatureEncoder.fit(frame)
+    saved.save(str(tmp_path / 'frappe.encoder.json'))
+    frame.loc[0, 'user'] = -1
+    with pytest.raises(ValueError, match='changed'):
+        check_encoder(FeatureEncoder.fit(frame), str(tmp_path / 'frappe.encoder.json'))
+    check_encoder(saved, str(tmp_path / 'frappe.encoder.json'))
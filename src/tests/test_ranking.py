@@ -0,0 +1,36 @@
+'''
+Top-k selection of model/ranking.py and the batched predictor ranking
+'''
+import numpy as np
+
+from conftest import fm_predictor
+from model.ranking import top_k
+
+CONTEXT = ['morning', 'monday', 'workday', 'home', 'sunny', 'Spain', 1]
+
+
+def test_top_k_clamps_each_row():
+    scores = np.array([[0.9, 0.8, 0.7, 0.6], [0.9, 0.8, 0.7, 0.6]])
+    exclude = np.array([[True, True, True, False], [False, True, False, False]])
+    best = top_k(scores, 3, 'highest', exclude=exclude)
+    # the first row has one item left, the second row keeps three
+    np.testing.assert_array_equal(best[0], [3])
+    np.testing.assert_array_equal(best[1], [0, 2, 3])
+    for row, mask, positions in zip(scores, exclude, best):
+        np.testing.assert_array_equal(top_k(row, 3, 'highest', exclude=mask), positions)
+
+
+def test_top_k_batch_equals_top_k():
+    fm = fm_predictor()
+    users = list(range(5))
+    contexts = [CONTEXT] * len(users)
+    # user 0 keeps a single item, user 1 excludes nothing, the others a few items
+    excludes = [fm.item_ids[1:].tolist(), [], [0, 1], [2], [0, 3, 5]]
+    batch = fm.top_k_batch(users, contexts, 3, excludes, batch_users=2)
+    for user, exclude, items in zip(users, excludes, batch):
+        np.testing.assert_array_equal(items, fm.top_k(user, CONTEXT, 3, exclude))
+        assert not set(items.tolist()) & set(exclude)
+    assert [len(items) for items in batch] == [1, 3, 3, 3, 3]
+    # a row only loses its own excluded items
+    unexcluded = fm.top_k_batch(users, contexts, 3)
+    np.testing.assert_array_equal(batch[1], unexcluded[1])
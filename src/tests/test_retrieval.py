@@ -0,0 +1,62 @@
+'''
+Inner product indexes of model/retrieval.py
+'''
+import numpy as np
+import pytest
+
+from conftest import fm_predictor
+from model.retrieval import ExactIndex, IVFIndex, RetrievalPredictor, build_index
+
+
+def vectors_and_queries(num_items=100, dimension=8, num_queries=20, seed=0):
+    rng = np.random.RandomState(seed)
+    return rng.normal(0, 1, (num_items, dimension)), rng.normal(0, 1, (num_queries, dimension))
+
+
+def test_exact_batch_matches_single():
+    vectors, queries = vectors_and_queries()
+    index = ExactIndex(vectors, block_size=16)
+    ids, scores = index.search(queries, 10)
+    assert ids.shape == scores.shape == (len(queries), 10)
+    for query, row in zip(queries, ids):
+        np.testing.assert_array_equal(index.search(query, 10)[0], row)
+        np.testing.assert_array_equal(row, np.argsort(-np.dot(vectors, query), kind='stable')[:10])
+
+
+@pytest.mark.parametrize('quantize', [False, True])
+def test_ivf_batch_is_padded(quantize):
+    # 64 lists of 100 items, one probed: most queries see fewer than n items
+    vectors, queries = vectors_and_queries()
+    index = IVFIndex(vectors, num_lists=64, nprobe=1, quantize=quantize)
+    ids, scores = index.search(queries, 10)
+    assert ids.shape == scores.shape == (len(queries), 10)
+    assert np.any(ids == -1)
+    assert np.all(np.isneginf(scores[ids == -1]))
+    for query, row, row_scores in zip(queries, ids, scores):
+        found = row[row >= 0]
+        assert len(found) and len(np.unique(found)) == len(found)
+        # the padding is at the end, after the results in decreasing score
+        assert np.all(row[len(found):] == -1)
+        assert np.all(np.diff(row_scores[:len(found)]) <= 1e-6)
+        np.testing.assert_array_equal(index.search(query, 10)[0], row)
+
+
+def test_ivf_all_lists_is_exact():
+    vectors, queries = vectors_and_queries()
+    index = IVFIndex(vectors, num_lists=8, nprobe=8)
+    np.testing.assert_array_equal(index.search(queries, 10)[0], ExactIndex(vectors).search(queries, 10)[0])
+
+
+def test_retrieval_keeps_the_ranking_of_the_model():
+    fm = fm_predictor()
+    index = build_index(fm, fm.encoder.candidates('item'))
+    context = ['morning', 'monday', 'workday', 'home', 'sunny', 'Spain', 1]
+    # every item retrieved: the same items as the model alone, ranked 'closest' to 1.0
+    predictor = RetrievalPredictor(fm, index, fm, num_candidates=len(fm.item_ids))
+    assert predictor.objective == 'closest'
+    for user in range(5):
+        np.testing.assert_array_equal(predictor.top_k(user, context, 3), fm.top_k(user, context, 3))
+
+    highest = RetrievalPredictor(fm, index, fm, num_candidates=len(fm.item_ids), objective='highest')
+    scores = fm.score_candidates(*fm.encoder.candidate_row([0] + context))
+    np.testing.assert_array_equal(highest.top_k(0, context, 3), fm.item_ids[np.argsort(-scores, kind='stable')[:3]])
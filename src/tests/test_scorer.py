@@ -0,0 +1,65 @@
+'''
+The candidate scoring of the NumPy scorers against predict() on the full rows
+'''
+import numpy as np
+import pytest
+
+from model.precision import compress
+from model.scorer import NumpyFM, NumpyIFM
+
+FEATURES_M, K, AK, KF = 40, 6, 4, 3
+VALID_DIMENSION, WIDTH = 5, 7  # fields valid_dimension.. take no part in the IFM interactions
+
+
+def ifm_weights(seed=0):
+    rng = np.random.RandomState(seed)
+    return {'model': np.array('ifm'),
+            'feature_embeddings': rng.normal(0, 0.5, (FEATURES_M, K)).astype(np.float32),
+            'feature_bias': rng.normal(0, 0.1, FEATURES_M).astype(np.float32), 'bias': np.float32(0.1),
+            'attention_W': rng.normal(0, 0.5, (K, AK)).astype(np.float32),
+            'attention_b': rng.normal(0, 0.1, (1, AK)).astype(np.float32),
+            'attention_p': rng.normal(0, 0.5, AK).astype(np.float32),
+            'interaction': rng.normal(0, 0.5, (VALID_DIMENSION, KF)).astype(np.float32),
+            'factor': rng.normal(0, 0.5, (KF, K)).astype(np.float32), 'temp': np.float32(2.0)}
+
+
+def full_rows(rows, slot, candidates):  # U * N * WIDTH rows with every candidate in column `slot`
+    X = np.repeat(rows[:, np.newaxis, :], len(candidates), 1)
+    X[:, :, slot] = candidates
+    return X
+
+
+@pytest.mark.parametrize('precision', ['float32', 'float16', 'int8'])
+@pytest.mark.parametrize('slot', [0, 2, VALID_DIMENSION - 1, VALID_DIMENSION, WIDTH - 1])
+def test_ifm_candidates_match_predict(slot, precision):
+    rng = np.random.RandomState(1)
+    # a small chunk_size splits the users into several chunks
+    scorer = NumpyIFM(compress(ifm_weights(), precision), None, chunk_size=1)
+    rows = rng.randint(FEATURES_M, size=(6, WIDTH))
+    candidates = rng.choice(FEATURES_M, 15, replace=False)
+    expected = scorer.predict(full_rows(rows, slot, candidates).reshape(-1, WIDTH)).reshape(len(rows), len(candidates))
+
+    np.testing.assert_allclose(scorer.score_candidates_batch(rows, slot, candidates), expected, rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(scorer.score_candidates(rows[0], slot, candidates), expected[0], rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize('precision', ['float32', 'float16', 'int8'])
+def test_fm_candidates_match_predict(precision):
+    rng = np.random.RandomState(2)
+    weights = ifm_weights()
+    scorer = NumpyFM(compress({'feature_embeddings': weights['feature_embeddings'], 'feature_bias': weights['feature_bias'],
+                               'bias': weights['bias']}, precision), None)
+    rows = rng.randint(FEATURES_M, size=(4, WIDTH))
+    candidates = np.arange(10, 30)
+    expected = scorer.predict(full_rows(rows, 1, candidates).reshape(-1, WIDTH)).reshape(len(rows), len(candidates))
+    np.testing.assert_allclose(scorer.score_candidates_batch(rows, 1, candidates), expected, rtol=1e-5, atol=1e-5)
+
+
+def test_low_precision_tables_are_close():
+    rng = np.random.RandomState(3)
+    X = rng.randint(FEATURES_M, size=(50, WIDTH))
+    reference = NumpyIFM(ifm_weights(), None).predict(X)
+    for precision, tolerance in [('float16', 1e-2), ('int8', 5e-2)]:
+        scorer = NumpyIFM(compress(ifm_weights(), precision), None)
+        assert scorer.feature_embeddings.nbytes < ifm_weights()['feature_embeddings'].nbytes
+        np.testing.assert_allclose(scorer.predict(X), reference, atol=tolerance)